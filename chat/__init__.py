@@ -1,3 +1,3 @@
 # chat/__init__.py
 # This file intentionally left minimal.
-# Signals are imported in urls.py after apps are ready.
+# Signals are connected in ChatConfig.ready() (chat/apps.py).
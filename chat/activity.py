@@ -0,0 +1,139 @@
+"""
+Typing indicators and read receipts.
+
+Both are noisy on the way in (a frame per keystroke, a read mark per
+rendered message) and only interesting as state. Each worker's
+``RoomActivity`` folds them per room and flushes every
+``CHAT_ACTIVITY_INTERVAL`` seconds: at most one ``activity`` frame per room
+per interval, carrying only what changed::
+
+    {"type": "activity", "typing": {"alice": true}, "read": {"bob": 41}}
+
+Typing expires after ``CHAT_TYPING_TTL`` seconds without a refresh, and
+is re-announced at half that so clients can expire it on their own too.
+Read marks keep only the highest ``seq`` per (user, room) and are written
+with ``ReadMarker.objects.advance`` in one DB call per flush, capped at the
+room's last sequence number so a client can't mark messages not yet sent.
+"""
+import asyncio
+import logging
+import weakref
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from chat import metrics
+from chat.db import database_sync_to_async
+from chat.fanout import frame_event
+from chat.models import Conversation, ReadMarker, RoomSequence
+
+logger = logging.getLogger(__name__)
+
+
+@database_sync_to_async
+def save_read_marks(marks) -> dict:
+    """Save ``marks`` capped at each room's last seq; returns what was saved."""
+    last = dict(RoomSequence.objects.filter(room__in={key for _, key in marks}).values_list("room", "last"))
+    saved = {}
+    for (user_id, key), (seq, *_) in marks.items():
+        seq = min(seq, last.get(key, 0))
+        if seq > 0:
+            saved[(user_id, key)] = seq
+    ReadMarker.objects.advance(saved)
+    # Reading a direct conversation also clears its unread badge in the inbox.
+    for (user_id, key), (_, peer_id, *_) in marks.items():
+        if peer_id is not None and (user_id, key) in saved:
+            Conversation.objects.mark_read(user_id, peer_id)
+    return saved
+
+
+class RoomActivity:
+    def __init__(self, interval=1.0, typing_ttl=6.0):
+        self.interval = interval
+        self.typing_ttl = typing_ttl
+        self.typing = {}  # room -> {username: expires}
+        self.changes = {}  # room -> {"typing": {username: bool}, "read": {username: seq}}
+        self.marks = {}  # (user_id, sequence key) -> (seq, peer_id, room, username)
+        self._task = None
+
+    def _change(self, room, kind, username, value):
+        self.changes.setdefault(room, {}).setdefault(kind, {})[username] = value
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def set_typing(self, room, username, active):
+        typers = self.typing.setdefault(room, {})
+        if active:
+            now = asyncio.get_running_loop().time()
+            expires = typers.get(username)
+            typers[username] = now + self.typing_ttl
+            if expires is None or expires - now < self.typing_ttl / 2:
+                self._change(room, "typing", username, True)
+        elif typers.pop(username, None) is not None:
+            self._change(room, "typing", username, False)
+        if not typers:
+            del self.typing[room]
+
+    def read(self, room, user, key, seq, peer_id=None):
+        marked = self.marks.get((user.id, key))
+        if marked is not None and marked[0] >= seq:
+            return
+        self.marks[(user.id, key)] = (seq, peer_id, room, user.username)
+        self._change(room, "read", user.username, seq)
+
+    def _expire(self):
+        now = asyncio.get_running_loop().time()
+        for room, typers in list(self.typing.items()):
+            for username, expires in list(typers.items()):
+                if expires <= now:
+                    self.set_typing(room, username, False)
+
+    @staticmethod
+    def _announce_saved(changes, marks, saved):
+        """Bring the read receipts about to go out in line with what was saved."""
+        for mark, (seq, _, room, username) in marks.items():
+            capped = saved.get(mark)
+            reads = changes.get(room, {}).get("read", {})
+            if capped == seq or reads.get(username) != seq:
+                continue
+            if capped:
+                reads[username] = capped
+                continue
+            del reads[username]
+            if not reads:
+                del changes[room]["read"]
+                if not changes[room]:
+                    del changes[room]
+
+    async def _run(self):
+        layer = get_channel_layer()
+        while self.changes or self.marks or self.typing:
+            await asyncio.sleep(self.interval)
+            self._expire()
+            changes, marks = self.changes, self.marks
+            self.changes, self.marks = {}, {}
+            if marks:
+                try:
+                    self._announce_saved(changes, marks, await save_read_marks(marks))
+                except Exception:
+                    logger.exception("Could not save %d read markers", len(marks))
+            for room, change in changes.items():
+                try:
+                    await metrics.group_send(layer, room, frame_event("chat_activity", {"type": "activity", **change}))
+                except Exception:
+                    logger.exception("Could not broadcast activity for room %s", room)
+
+
+_activity = weakref.WeakKeyDictionary()
+
+
+def get_activity() -> RoomActivity:
+    """The RoomActivity for the running event loop."""
+    loop = asyncio.get_running_loop()
+    activity = _activity.get(loop)
+    if activity is None:
+        activity = _activity[loop] = RoomActivity(
+            interval=settings.CHAT_ACTIVITY_INTERVAL,
+            typing_ttl=settings.CHAT_TYPING_TTL,
+        )
+    return activity
@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class ChatConfig(AppConfig):
+    default_auto_field = "django.db.models.BigAutoField"
+    name = "chat"
+
+    def ready(self):
+        # Connect the model receivers (sequencing, broadcast, history cache) and SQLite tuning.
+        from . import signals  # noqa: F401
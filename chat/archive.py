@@ -0,0 +1,196 @@
+"""
+Cold storage for old messages.
+
+``archive_messages`` moves messages older than ``CHAT_RETENTION_DAYS`` out
+of ``Message``/``GroupMessage`` into ``ArchiveBlock`` rows: up to
+``CHAT_ARCHIVE_BLOCK`` consecutive messages of one room per row,
+zlib-compressed JSON. Each block is written and its messages deleted in
+one short transaction (with their search rows, see
+``deletion.delete_messages``), so the hot tables and their indexes only
+hold recent traffic.
+
+History pagination falls through to the archive once a room's hot rows
+run out; archived messages come back as ``ArchivedMessage`` objects that
+look enough like a Message for ``message_to_dict``, cursors and the
+message templates. Archived messages are not searchable. Attachments
+stay in ``Attachment`` and are looked up again when a page is read; each
+remembers the room it was archived from, so the room's participants can
+still fetch it (``is_participant``).
+"""
+import zlib
+from datetime import datetime
+
+from django.db import transaction
+from django.db.models import Q
+
+from chat import jsonenc
+from chat.models import ArchiveBlock, Attachment, Group, GroupMessage, Message, RoomSequence
+
+
+class ArchivedSender:
+    __slots__ = ("id", "username")
+
+    def __init__(self, pk, username):
+        self.id = pk
+        self.username = username
+
+
+class ArchivedMessage:
+    __slots__ = ("id", "seq", "timestamp", "sender", "text", "attachment_id", "attachment")
+
+    def __init__(self, pk, seq, timestamp, sender_id, sender_username, text, attachment_id=None):
+        self.id = pk
+        self.seq = seq
+        self.timestamp = datetime.fromisoformat(timestamp)
+        self.sender = ArchivedSender(sender_id, sender_username)
+        self.text = text
+        self.attachment_id = attachment_id
+        self.attachment = None
+
+
+# ============================
+# Packing
+# ============================
+def to_rows(messages) -> list:
+    return [
+        [m.id, m.seq, m.timestamp.isoformat(), m.sender_id, m.sender.username, m.text, m.attachment_id]
+        for m in messages
+    ]
+
+
+def pack(rows) -> bytes:
+    return zlib.compress(jsonenc.dumps(rows).encode(), 6)
+
+
+def unpack(data) -> list:
+    return jsonenc.loads(zlib.decompress(bytes(data)))
+
+
+def _block_fields(room, rows) -> dict:
+    return {
+        "room": room,
+        "first_seq": rows[0][1],
+        "last_seq": rows[-1][1],
+        "first_timestamp": datetime.fromisoformat(rows[0][2]),
+        "last_timestamp": datetime.fromisoformat(rows[-1][2]),
+        "count": len(rows),
+        "senders": " %s " % " ".join(str(pk) for pk in sorted({row[3] for row in rows})),
+    }
+
+
+# ============================
+# Archiving
+# ============================
+def _room_queryset(room):
+    kind, _, rest = room.partition(":")
+    if kind == "group":
+        return GroupMessage.objects.filter(group_id=int(rest))
+    low, high = (int(pk) for pk in rest.split(":"))
+    return Message.objects.filter(Q(sender_id=low, receiver_id=high) | Q(sender_id=high, receiver_id=low))
+
+
+def is_participant(user_id, room) -> bool:
+    """Whether ``user_id`` may read ``room`` (a RoomSequence key)."""
+    kind, _, rest = room.partition(":")
+    if kind == "group":
+        return Group.members.through.objects.filter(group_id=int(rest), user_id=user_id).exists()
+    return str(user_id) in rest.split(":")
+
+
+def old_rooms(horizon):
+    """RoomSequence keys of every room with messages older than ``horizon``."""
+    pairs = Message.objects.filter(timestamp__lt=horizon).values_list("sender_id", "receiver_id").distinct()
+    rooms = {RoomSequence.direct_key(a, b) for a, b in pairs}
+    groups = GroupMessage.objects.filter(timestamp__lt=horizon).values_list("group_id", flat=True).distinct()
+    rooms.update(RoomSequence.group_key(pk) for pk in groups)
+    return sorted(rooms)
+
+
+def archive_room(room, horizon, block_size=500) -> int:
+    """Move ``room``'s messages older than ``horizon`` into blocks; returns how many moved."""
+    # chat.deletion imports this module, hence the late import.
+    from chat.deletion import delete_messages
+
+    queryset = _room_queryset(room).filter(timestamp__lt=horizon).select_related("sender").order_by("seq")
+    moved = 0
+    while True:
+        with transaction.atomic():
+            messages = list(queryset[:block_size])
+            if not messages:
+                return moved
+            rows = to_rows(messages)
+            ArchiveBlock.objects.create(data=pack(rows), **_block_fields(room, rows))
+            attached = [m.attachment_id for m in messages if m.attachment_id is not None]
+            if attached:
+                Attachment.objects.filter(id__in=attached).update(archived_room=room)
+            delete_messages(queryset.model, messages)
+        moved += len(messages)
+
+
+# ============================
+# Reading
+# ============================
+def page(room, before, limit):
+    """
+    Up to ``limit`` archived messages of ``room`` older than the ``before``
+    cursor (``(timestamp, id)`` or None), oldest first, and whether more
+    remain. A ``limit`` below 1 reads nothing and says more may remain.
+    """
+    if limit <= 0:
+        return [], True
+    blocks = _older_blocks(room, before).order_by("-last_seq")
+
+    found = []
+    for block in blocks.only("data").iterator(chunk_size=8):
+        rows = [ArchivedMessage(*row) for row in unpack(block.data)]
+        if before is not None:
+            rows = [m for m in rows if (m.timestamp, m.id) < before]
+        found = rows + found
+        if len(found) > limit:
+            return _with_attachments(found[-limit:]), True
+    return _with_attachments(found), False
+
+
+def has_older(room, before) -> bool:
+    """Whether ``room`` has archived messages that may be older than ``before``."""
+    return _older_blocks(room, before).exists()
+
+
+def _older_blocks(room, before):
+    blocks = ArchiveBlock.objects.filter(room=room)
+    if before is not None:
+        blocks = blocks.filter(first_timestamp__lte=before[0])
+    return blocks
+
+
+def _with_attachments(messages):
+    wanted = {m.attachment_id for m in messages if m.attachment_id is not None}
+    if wanted:
+        found = Attachment.objects.in_bulk(wanted)
+        for message in messages:
+            if message.attachment_id is not None:
+                message.attachment = found.get(message.attachment_id)
+    return messages
+
+
+def iter_rows(room):
+    """Every archived row of ``room``, in seq order, one block in memory at a time."""
+    blocks = ArchiveBlock.objects.filter(room=room).order_by("first_seq").values_list("data", flat=True)
+    for data in blocks.iterator(chunk_size=8):
+        yield from unpack(data)
+
+
+def drop_sender(user_id):
+    """Remove a user's archived messages: their direct rooms go entirely, group blocks are repacked."""
+    direct = Q(room__startswith=f"dm:{user_id}:") | Q(room__startswith="dm:", room__endswith=f":{user_id}")
+    ArchiveBlock.objects.filter(direct).delete()
+
+    blocks = ArchiveBlock.objects.filter(room__startswith="group:", senders__contains=f" {user_id} ")
+    for pk in list(blocks.values_list("pk", flat=True)):
+        block = ArchiveBlock.objects.get(pk=pk)
+        rows = [row for row in unpack(block.data) if row[3] != user_id]
+        with transaction.atomic():
+            if not rows:
+                block.delete()
+                continue
+            ArchiveBlock.objects.filter(pk=block.pk).update(data=pack(rows), **_block_fields(block.room, rows))
@@ -0,0 +1,269 @@
+"""
+File attachments and avatars.
+
+Uploads are parsed by ``HashingUploadHandler``: each chunk is hashed and
+written straight to a temporary file under ``MEDIA_ROOT``. Once its
+``Attachment`` row exists the file is hard-linked to its content address,
+``attachments/<sha256[:2]>/<sha256>`` (content already stored is not
+linked twice); the temporary file is deleted when the request ends,
+whether or not the upload was kept. No upload is held in memory.
+
+Images get a JPEG thumbnail (``CHAT_THUMBNAIL_SIZE`` px, stored by hash as
+well), rendered in a process pool so decoding never runs on the event
+loop or holds the GIL for the server's threads. Thumbnails need the
+optional Pillow package; without it images are sent as plain files.
+
+Messages carry attachment metadata (``to_dict``) in their ``chat_message``
+event, so receivers never touch the file until someone opens it.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db.models import Q
+from django.http import JsonResponse
+from django.urls import reverse
+
+from chat import archive, thumbnails
+from chat.db import database_sync_to_async
+from chat.models import Attachment, GroupMessage, Message, Profile
+
+try:
+    import PIL  # noqa: F401  (imported for real in the thumbnail processes)
+except ImportError:  # optional; no thumbnails without it
+    PIL = None
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp", "image/bmp"}
+# Served inline; anything else is sent as a download.
+INLINE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+READ_CHUNK = 64 * 1024
+
+
+# ============================
+# Storage layout
+# ============================
+def _media(*parts):
+    return os.path.join(settings.MEDIA_ROOT, *parts)
+
+
+def blob_path(sha256):
+    return _media("attachments", sha256[:2], sha256)
+
+
+def thumbnail_path(sha256):
+    return _media("thumbnails", sha256[:2], sha256 + ".jpg")
+
+
+def file_chunks(path):
+    with open(path, "rb") as f:
+        while chunk := f.read(READ_CHUNK):
+            yield chunk
+
+
+# ============================
+# Uploads
+# ============================
+class HashedUpload(UploadedFile):
+    """
+    An upload in a temporary file under ``MEDIA_ROOT``, hashed on the way
+    in. Closing it (Django closes request files when the response is done)
+    deletes the file; ``store`` first links it to its content address.
+    """
+
+    def __init__(self, file, sha256, name, content_type, size, charset=None):
+        super().__init__(file, name, content_type, size, charset)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+    def store(self):
+        target = blob_path(self.sha256)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(self.file.name, target)
+        except FileExistsError:
+            pass  # the same content is stored already
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Every upload's handler (``FILE_UPLOAD_HANDLERS``), so CSRF parsing uses it too."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.temp = None
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        os.makedirs(_media("tmp"), exist_ok=True)
+        self.temp = tempfile.NamedTemporaryFile(dir=_media("tmp"), suffix=".upload")
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > settings.CHAT_ATTACHMENT_MAX_BYTES:
+            self.too_large = True
+            self._discard()
+            raise StopUpload()
+        self.hash.update(raw_data)
+        self.temp.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.temp.flush()
+        self.temp.seek(0)
+        upload = HashedUpload(
+            self.temp, self.hash.hexdigest(), self.file_name, (self.content_type or "")[:100], self.size, self.charset,
+        )
+        self.temp = None
+        return upload
+
+    def upload_interrupted(self):
+        self._discard()
+
+    def _discard(self):
+        if self.temp is not None:
+            self.temp.close()  # deletes it
+            self.temp = None
+
+
+def receive(request):
+    """
+    Parse a multipart request (if CSRF checking has not already); returns a
+    413 response if an upload was over ``CHAT_ATTACHMENT_MAX_BYTES``, else
+    None. Blocking: call it off the event loop.
+    """
+    request.FILES
+    if any(getattr(handler, "too_large", False) for handler in request.upload_handlers):
+        return JsonResponse({"error": "file too large"}, status=413)
+    return None
+
+
+# ============================
+# Attachments
+# ============================
+def create(user, upload) -> Attachment:
+    """Record a HashedUpload and only then keep its file, so no file lacks a row."""
+    attachment = Attachment.objects.create(
+        uploader=user,
+        sha256=upload.sha256,
+        name=upload.name[:255],
+        content_type=upload.content_type or "application/octet-stream",
+        size=upload.size,
+    )
+    upload.store()
+    return attachment
+
+
+def _reuse_thumbnail(attachment) -> bool:
+    """Copy the thumbnail details of earlier attachments with the same content."""
+    twin = (
+        Attachment.objects.filter(sha256=attachment.sha256, has_thumbnail=True)
+        .exclude(pk=attachment.pk).values("width", "height").first()
+    )
+    if twin is None or not os.path.exists(thumbnail_path(attachment.sha256)):
+        return False
+    attachment.width, attachment.height = twin["width"], twin["height"]
+    _save_thumbnail(attachment)
+    return True
+
+
+def _save_thumbnail(attachment):
+    attachment.has_thumbnail = True
+    attachment.save(update_fields=["width", "height", "has_thumbnail"])
+
+
+_pool = None
+
+
+def _thumbnail_pool():
+    global _pool
+    if _pool is None:
+        # spawn: forking a process running an event loop and thread pools is unsafe.
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.CHAT_THUMBNAIL_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _pool
+
+
+async def athumbnail(attachment):
+    if PIL is None or attachment.content_type not in THUMBNAIL_TYPES:
+        return
+    if await database_sync_to_async(_reuse_thumbnail)(attachment):
+        return
+    target = thumbnail_path(attachment.sha256)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        attachment.width, attachment.height = await asyncio.get_running_loop().run_in_executor(
+            _thumbnail_pool(), thumbnails.make_thumbnail,
+            blob_path(attachment.sha256), target, settings.CHAT_THUMBNAIL_SIZE,
+        )
+    except Exception:
+        logger.warning("No thumbnail for attachment %s", attachment.pk, exc_info=True)
+        return
+    await database_sync_to_async(_save_thumbnail)(attachment)
+
+
+async def acreate(user, upload) -> Attachment:
+    """Record an upload and render its thumbnail before anyone is sent it."""
+    attachment = await database_sync_to_async(create)(user, upload)
+    await athumbnail(attachment)
+    return attachment
+
+
+@database_sync_to_async
+def aowned(user, attachment_id):
+    """The attachment ``user`` uploaded with this id, or None."""
+    if not isinstance(attachment_id, int) or isinstance(attachment_id, bool):
+        return None
+    return Attachment.objects.filter(pk=attachment_id, uploader=user).first()
+
+
+def to_dict(attachment):
+    if attachment is None:
+        return None
+    return {
+        "id": attachment.id,
+        "name": attachment.name,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+        "url": reverse("attachment_file", args=[attachment.id]),
+        "thumbnail": reverse("attachment_thumbnail", args=[attachment.id]) if attachment.has_thumbnail else None,
+        "width": attachment.width,
+        "height": attachment.height,
+    }
+
+
+def can_view(user, attachment) -> bool:
+    if attachment.uploader_id == user.id:
+        return True
+    return (
+        # Avatars are visible to everyone signed in.
+        Profile.objects.filter(avatar=attachment).exists()
+        or Message.objects.filter(Q(sender=user) | Q(receiver=user), attachment=attachment).exists()
+        or GroupMessage.objects.filter(attachment=attachment, group__members=user).exists()
+        # Its message has moved to the archive.
+        or (attachment.archived_room != "" and archive.is_participant(user.id, attachment.archived_room))
+    )
+
+
+def delete_unused(sha256s):
+    """Remove stored files no attachment refers to any more (see chat/deletion.py)."""
+    used = set(Attachment.objects.filter(sha256__in=sha256s).values_list("sha256", flat=True))
+    for sha256 in set(sha256s) - used:
+        for path in (blob_path(sha256), thumbnail_path(sha256)):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
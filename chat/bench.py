@@ -0,0 +1,276 @@
+"""
+In-process websocket load generator for ChatConsumer and CallConsumer.
+
+Drives ``imessage_clone.asgi.application`` (auth middleware included) with
+simulated clients over ``WebsocketCommunicator``; no network or daphne
+needed. Used by ``manage.py chatbench``.
+
+Every scenario returns a flat dict so runs can be diffed as JSON:
+messages sent, deliveries observed, throughput, end-to-end fan-out latency
+percentiles (sender ``send`` to recipient ``receive``) and traced memory per
+open connection.
+"""
+import asyncio
+import json
+import time
+import tracemalloc
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+
+from chat.models import Group
+
+USER_PREFIX = "bench"
+
+
+# ============================
+# Fixtures
+# ============================
+def create_users(count, prefix=USER_PREFIX):
+    """Create ``count`` users with ready-made sessions; returns [(user, cookie)]."""
+    users = [User(username=f"{prefix}{i}") for i in range(count)]
+    for user in users:
+        user.set_unusable_password()
+    User.objects.bulk_create(users, batch_size=1000)
+    users = list(User.objects.filter(username__startswith=prefix).order_by("id"))
+
+    result = []
+    for user in users:
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = "django.contrib.auth.backends.ModelBackend"
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        cookie = f"{settings.SESSION_COOKIE_NAME}={session.session_key}"
+        result.append((user, cookie))
+    return result
+
+
+def create_groups(users, group_size):
+    groups = []
+    for start in range(0, len(users) - group_size + 1, group_size):
+        group = Group.objects.create(name=f"{USER_PREFIX}-group-{start // group_size}")
+        members = [user for user, _ in users[start:start + group_size]]
+        group.members.add(*members)
+        groups.append((group, users[start:start + group_size]))
+    return groups
+
+
+# ============================
+# Measurement helpers
+# ============================
+def percentiles(samples):
+    if not samples:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "max": round(ordered[-1] * 1000, 3)}
+
+
+class Client:
+    def __init__(self, application, path, cookie, user):
+        self.user = user
+        self.comm = WebsocketCommunicator(application, path, headers=[(b"cookie", cookie.encode())])
+
+    async def connect(self):
+        connected, _ = await self.comm.connect(timeout=10)
+        if not connected:
+            raise RuntimeError(f"{self.user.username} could not connect")
+
+    async def send(self, payload):
+        await self.comm.send_to(text_data=json.dumps(payload))
+
+    async def drain(self, on_frame, expected, timeout):
+        """Read frames until ``expected`` have been counted by ``on_frame``."""
+        seen = 0
+        while seen < expected:
+            try:
+                frame = json.loads(await self.comm.receive_from(timeout=timeout))
+            except asyncio.TimeoutError:
+                break
+            seen += on_frame(frame)
+        return seen
+
+    async def close(self):
+        await self.comm.disconnect()
+
+
+async def connect_all(clients, batch=200):
+    """Connect every client; returns traced bytes allocated per connection."""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for start in range(0, len(clients), batch):
+        await asyncio.gather(*(c.connect() for c in clients[start:start + batch]))
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / max(1, len(clients))
+
+
+async def close_all(clients):
+    await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+
+async def run_senders(senders, messages, rate, make_payload, sent_at):
+    async def pump(client, index):
+        interval = 1 / rate if rate else 0
+        for seq in range(messages):
+            key = f"{index}:{seq}"
+            sent_at[key] = time.perf_counter()
+            await client.send(make_payload(client, key))
+            await asyncio.sleep(interval)
+
+    await asyncio.gather(*(pump(client, i) for i, client in enumerate(senders)))
+
+
+def summarize(name, clients, memory, sent, deliveries, expected, latencies, elapsed):
+    return {
+        "scenario": name,
+        "connections": len(clients),
+        "messages_sent": sent,
+        "deliveries": deliveries,
+        "deliveries_expected": expected,
+        "elapsed_s": round(elapsed, 4),
+        "messages_per_sec": round(sent / elapsed, 1) if elapsed else None,
+        "deliveries_per_sec": round(deliveries / elapsed, 1) if elapsed else None,
+        "latency_ms": percentiles(latencies),
+        "memory_per_connection_kb": round(memory / 1024, 2),
+    }
+
+
+# ============================
+# Scenarios
+# ============================
+async def direct_scenario(application, users, messages, rate, timeout):
+    """Pairs of users; each side sends ``messages`` to the other over /ws/chat/."""
+    pairs = list(zip(users[0::2], users[1::2]))
+    clients = []
+    for (a, a_cookie), (b, b_cookie) in pairs:
+        clients.append(Client(application, f"/ws/chat/{b.username}/", a_cookie, a))
+        clients.append(Client(application, f"/ws/chat/{a.username}/", b_cookie, b))
+    memory = await connect_all(clients)
+
+    sent_at, latencies = {}, []
+
+    def on_frame_for(client):
+        def on_frame(frame):
+            key = frame.get("client_id")
+            if frame.get("type") or key is None or frame.get("sender") == client.user.username:
+                return 0
+            latencies.append(time.perf_counter() - sent_at[key])
+            return 1
+        return on_frame
+
+    expected_each = messages
+    started = time.perf_counter()
+    readers = [asyncio.ensure_future(c.drain(on_frame_for(c), expected_each, timeout)) for c in clients]
+    await run_senders(
+        clients, messages, rate,
+        lambda client, key: {"type": "chat", "text": f"bench {key}", "client_id": key},
+        sent_at,
+    )
+    deliveries = sum(await asyncio.gather(*readers))
+    elapsed = time.perf_counter() - started
+    await close_all(clients)
+    return summarize("direct", clients, memory, len(sent_at), deliveries,
+                     expected_each * len(clients), latencies, elapsed)
+
+
+async def group_scenario(application, groups, messages, rate, timeout, senders_per_group=1):
+    """Every member listens on /ws/group/<id>/; a few members per group send."""
+    clients, senders = [], []
+    for group, members in groups:
+        room_clients = [Client(application, f"/ws/group/{group.id}/", cookie, user) for user, cookie in members]
+        clients += room_clients
+        senders += room_clients[:senders_per_group]
+    memory = await connect_all(clients)
+
+    sent_at, latencies = {}, []
+
+    def on_frame(frame):
+        key = frame.get("client_id")
+        if frame.get("type") or key is None:
+            return 0
+        latencies.append(time.perf_counter() - sent_at[key])
+        return 1
+
+    group_size = len(groups[0][1]) if groups else 0
+    expected_each = messages * senders_per_group
+    started = time.perf_counter()
+    readers = [asyncio.ensure_future(c.drain(on_frame, expected_each, timeout)) for c in clients]
+    await run_senders(
+        senders, messages, rate,
+        lambda client, key: {"type": "chat", "text": f"bench {key}", "client_id": key},
+        sent_at,
+    )
+    deliveries = sum(await asyncio.gather(*readers))
+    elapsed = time.perf_counter() - started
+    await close_all(clients)
+    result = summarize("group", clients, memory, len(sent_at), deliveries,
+                       expected_each * len(clients), latencies, elapsed)
+    result["group_size"] = group_size
+    return result
+
+
+async def call_scenario(application, users, messages, rate, timeout):
+    """Pairs exchange ICE-candidate-sized signaling frames over /ws/call/."""
+    pairs = list(zip(users[0::2], users[1::2]))
+    clients, peer_of = [], {}
+    for (a, a_cookie), (b, b_cookie) in pairs:
+        ca = Client(application, f"/ws/call/{a.username}/", a_cookie, a)
+        cb = Client(application, f"/ws/call/{b.username}/", b_cookie, b)
+        peer_of[ca], peer_of[cb] = b.username, a.username
+        clients += [ca, cb]
+    memory = await connect_all(clients)
+
+    # Only live calls relay candidates (chat/calls.py); ring and answer first.
+    async def set_up(caller, callee):
+        await caller.send({"type": "offer", "to": peer_of[caller], "offer": {"type": "offer", "sdp": "bench"}})
+        await callee.drain(lambda frame: frame.get("type") == "offer", 1, timeout)
+        await callee.send({"type": "answer", "to": peer_of[callee], "answer": {"type": "answer", "sdp": "bench"}})
+        await caller.drain(lambda frame: frame.get("type") == "answer", 1, timeout)
+
+    await asyncio.gather(*(set_up(clients[i], clients[i + 1]) for i in range(0, len(clients), 2)))
+
+    sent_at, latencies = {}, []
+    candidate = {"candidate": "candidate:1 1 udp 2122260223 10.0.0.1 54321 typ host", "sdpMid": "0"}
+
+    def on_frame(frame):
+        key = frame.get("bench_id")
+        if key is None:
+            return 0
+        latencies.append(time.perf_counter() - sent_at[key])
+        return 1
+
+    started = time.perf_counter()
+    readers = [asyncio.ensure_future(c.drain(on_frame, messages, timeout)) for c in clients]
+    await run_senders(
+        clients, messages, rate,
+        lambda client, key: {
+            "type": "ice", "from": client.user.username, "to": peer_of[client],
+            "candidate": candidate, "bench_id": key,
+        },
+        sent_at,
+    )
+    deliveries = sum(await asyncio.gather(*readers))
+    elapsed = time.perf_counter() - started
+    await close_all(clients)
+    return summarize("call", clients, memory, len(sent_at), deliveries,
+                     messages * len(clients), latencies, elapsed)
+
+
+async def run(application, scenarios, users, groups, messages, rate, timeout):
+    results = []
+    for name in scenarios:
+        if name == "direct":
+            results.append(await direct_scenario(application, users, messages, rate, timeout))
+        elif name == "group":
+            results.append(await group_scenario(application, groups, messages, rate, timeout))
+        elif name == "call":
+            results.append(await call_scenario(application, users, messages, rate, timeout))
+    return results
@@ -0,0 +1,84 @@
+"""
+Small in-process caches shared by every connection of a worker.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.contrib.auth import get_user_model
+
+from chat.db import database_sync_to_async
+
+
+class TTLCache:
+    """
+    Thread-safe LRU mapping whose entries also expire after ``ttl`` seconds.
+
+    Sync views (in the thread pool) and consumers (on the event loop) both
+    touch these, hence the lock; every operation is O(1).
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def prune(self, predicate):
+        """Drop every entry whose value matches ``predicate``; O(n), for rare events."""
+        with self._lock:
+            for key in [key for key, (value, _) in self._data.items() if predicate(value)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# username -> user id
+user_ids = TTLCache(maxsize=50000, ttl=300)
+
+
+def _lookup_user_id(username):
+    return (
+        get_user_model().objects
+        .filter(username=username)
+        .values_list("id", flat=True)
+        .first()
+    )
+
+
+async def aresolve_user_id(username):
+    """User id for ``username`` or None; misses are not cached."""
+    user_id = user_ids.get(username)
+    if user_id is None:
+        user_id = await database_sync_to_async(_lookup_user_id)(username)
+        if user_id is not None:
+            user_ids.set(username, user_id)
+    return user_id
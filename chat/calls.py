@@ -0,0 +1,47 @@
+"""
+Call sessions for WebRTC signaling.
+
+Every call socket (``CallConsumer``) tracks the calls it takes part in,
+one per peer. A call is ringing from its offer until the callee answers,
+then active until either side hangs up or disconnects. One that is still
+ringing after ``CHAT_CALL_RING_TIMEOUT`` seconds times out on both ends.
+Answers, candidates and hangups only pass for a live call with a matching
+id; anything left over from an abandoned call is dropped instead of being
+delivered to a page that has moved on.
+
+The server stamps ``from`` and ``call`` on every relayed frame; a client
+cannot speak for someone else or for a call it is not in.
+"""
+import secrets
+
+RINGING = "ringing"
+ACTIVE = "active"
+ENDED = "ended"
+
+
+class CallSession:
+    __slots__ = ("id", "caller", "callee", "state", "timer")
+
+    def __init__(self, call_id, caller, callee):
+        self.id = call_id
+        self.caller = caller
+        self.callee = callee
+        self.state = RINGING
+        self.timer = None
+
+    @classmethod
+    def start(cls, caller, callee):
+        return cls(secrets.token_hex(8), caller, callee)
+
+    def answer(self):
+        self.state = ACTIVE
+        self._cancel_timer()
+
+    def end(self):
+        self.state = ENDED
+        self._cancel_timer()
+
+    def _cancel_timer(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
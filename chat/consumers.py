@@ -1,134 +1,280 @@
-import re
-import json
+import asyncio
+import logging
+import uuid
 from channels.generic.websocket import AsyncJsonWebsocketConsumer, AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
-from chat.models import Message
-from django.contrib.auth import get_user_model
+from chat.db import database_sync_to_async
+from chat import attachments, jsonenc, metrics
+from chat.activity import get_activity
+from chat.cache import aresolve_user_id
+from chat.calls import ACTIVE, RINGING, CallSession
+from chat.dispatch import direct_room, group_room, safe_group_name
+from chat.fanout import frame_event, get_hub
+from chat.membership import ais_member
+from chat.models import GroupMessage, Message, RoomSequence
+from chat.pagination import conversation_since, group_since, message_to_dict
+from chat.pipeline import PendingMessage, get_writer
+from chat.presence import aonline, call_key, get_tracker
+from chat.ratelimit import Coalescer, SocketLimiter, get_limiter
+from django.conf import settings
+from django.utils import timezone
 
-User = get_user_model()
+logger = logging.getLogger(__name__)
 
-# ============================
-# Utility: Safe group names
-# ============================
-def safe_group_name(name: str) -> str:
-    return re.sub(r'[^a-zA-Z0-9_.-]', '_', name)
+
+def provisional_id(content) -> str:
+    # Clients may name their optimistic copy so they can match the echo.
+    client_id = content.get("client_id")
+    if isinstance(client_id, str) and 0 < len(client_id) <= 64:
+        return client_id
+    return f"p-{uuid.uuid4().hex}"
+
+
+class ConnectionState:
+    """Everything a chat socket needs per frame, resolved once in connect()."""
+
+    __slots__ = ("user", "room", "peer_id", "group_id", "key")
+
+    def __init__(self, user, room, peer_id=None, group_id=None):
+        self.user = user
+        self.room = room
+        self.peer_id = peer_id
+        self.group_id = group_id
+        # RoomSequence key, which read markers are stored under.
+        if group_id is not None:
+            self.key = RoomSequence.group_key(group_id)
+        else:
+            self.key = RoomSequence.direct_key(user.id, peer_id)
+
+
+@database_sync_to_async
+def messages_since(state, after, limit):
+    if state.group_id is not None:
+        rows = group_since(GroupMessage.objects.filter(group_id=state.group_id), after, limit)
+    else:
+        rows = conversation_since(Message.objects, state.user.id, state.peer_id, after, limit)
+    return [message_to_dict(m) for m in rows]
 
 
 # ============================
 # CHAT CONSUMER (1-on-1 + groups)
 # ============================
 class ChatConsumer(AsyncJsonWebsocketConsumer):
+    FRAME_TYPES = {"chat", "call_started", "resume", "typing", "read"}
+    state = None
+    # Room events arrive through the worker's fan-out hub (chat/fanout.py),
+    # not through this consumer's own channel.
+    outbox = None
+
     async def connect(self):
+        self.limiter = SocketLimiter(settings.CHAT_RATE_LIMITS)
         user = self.scope["user"]
         if not user.is_authenticated:
             await self.close()
             return
 
-        # 1-on-1 chat
-        if "username" in self.scope["url_route"]["kwargs"]:
-            other_username = self.scope["url_route"]["kwargs"]["username"]
+        kwargs = self.scope["url_route"]["kwargs"]
 
-            self.room_group = (
-                f"chat_{safe_group_name(min(user.username, other_username))}_"
-                f"{safe_group_name(max(user.username, other_username))}"
-            )
+        # 1-on-1 chat
+        if "username" in kwargs:
+            other_username = kwargs["username"]
+            peer_id = await aresolve_user_id(other_username)
+            if peer_id is None:
+                await self.close()
+                return
+            self.state = ConnectionState(user, direct_room(user.username, other_username), peer_id=peer_id)
 
         # Group chat
-        elif "group_id" in self.scope["url_route"]["kwargs"]:
-            group_id = self.scope["url_route"]["kwargs"]["group_id"]
-            self.room_group = f"group_{safe_group_name(str(group_id))}"
+        elif "group_id" in kwargs:
+            group_id = int(kwargs["group_id"])
+            if not await ais_member(user.id, group_id):
+                await self.close()
+                return
+            self.state = ConnectionState(user, group_room(group_id), group_id=group_id)
 
         else:
             await self.close()
             return
 
-        await self.channel_layer.group_add(self.room_group, self.channel_name)
         await self.accept()
+        self.outbox = await get_hub().subscribe(self.state.room, self.channel_layer, self.send_text, self.close)
+        get_tracker().connect(user.id, self.channel_name)
+        metrics.ws_connects.inc("chat")
+        metrics.ws_open.inc("chat")
 
     async def disconnect(self, code):
-        if hasattr(self, "room_group"):
-            await self.channel_layer.group_discard(self.room_group, self.channel_name)
+        if self.outbox is not None:
+            metrics.ws_disconnects.inc("chat")
+            metrics.ws_open.dec("chat")
+            get_activity().set_typing(self.state.room, self.state.user.username, False)
+            get_tracker().disconnect(self.state.user.id, self.channel_name)
+            await get_hub().unsubscribe(self.state.room, self.outbox)
+
+    async def send_text(self, text):
+        await self.send(text_data=text)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return jsonenc.loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return jsonenc.dumps(content)
 
     # ============================
     # RECEIVE JSON (chat + call events)
     # ============================
     async def receive_json(self, content):
         msg_type = content.get("type")  # may be None for old messages
+        label = metrics.frame_type(msg_type, self.FRAME_TYPES)
+        metrics.ws_frames.inc("chat", label)
+        if not await self.throttle(msg_type or "chat", label, content):
+            return
         text = content.get("text")
-        sender_username = content.get("sender")
-
-        # Get sender user object
-        sender = await database_sync_to_async(User.objects.get)(username=sender_username)
-
-        # Determine receiver (1-on-1 chat)
-        receiver = None
-        if "username" in self.scope["url_route"]["kwargs"]:
-            other_username = self.scope["url_route"]["kwargs"]["username"]
-            receiver = await database_sync_to_async(User.objects.get)(username=other_username)
+        # The sender is always the authenticated user; content["sender"] is ignored.
+        sender = self.state.user
 
         # ⭐ CASE 1: Normal chat message (old format OR new format)
         if msg_type == "chat" or msg_type is None:
-            if not text:
+            # Attachments are uploaded over HTTP first (views.upload_attachment)
+            # and referenced here by id.
+            attachment = None
+            if content.get("attachment") is not None:
+                attachment = await attachments.aowned(sender, content["attachment"])
+                if attachment is None:
+                    return
+            if not text and attachment is None:
                 return
 
-            msg = await database_sync_to_async(Message.objects.create)(
-                sender=sender,
-                receiver=receiver,
-                text=text,
-            )
-
-            await self.channel_layer.group_send(
-                self.room_group,
-                {
-                    "type": "chat_message",
-                    "text": msg.text,
-                    "sender": sender.username,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-            )
+            await self.queue_message(text or "", provisional_id(content), attachment)
             return
 
         # ⭐ CASE 2: Call started — system message
         if msg_type == "call_started":
             system_text = f"{sender.username} started a call"
 
-            msg = await database_sync_to_async(Message.objects.create)(
-                sender=sender,
-                receiver=receiver,
-                text=system_text,
-            )
+            await self.queue_message(system_text, provisional_id(content))
+            return
 
-            await self.channel_layer.group_send(
-                self.room_group,
-                {
-                    "type": "chat_message",
-                    "text": msg.text,
-                    "sender": sender.username,
-                    "timestamp": msg.timestamp.isoformat(),
-                }
-            )
+        # ⭐ CASE 3: (Re)connected client asks for what it missed
+        if msg_type == "resume":
+            after = content.get("after")
+            if isinstance(after, int) and not isinstance(after, bool) and after >= 0:
+                await self.resume(after)
             return
 
-    # ============================
-    # SEND MESSAGE TO CLIENT
-    # ============================
-    async def chat_message(self, event):
-        await self.send_json({
-            "sender": event["sender"],
-            "text": event["text"],
-            "timestamp": event["timestamp"],
-        })
+        # ⭐ CASE 4: Typing started/stopped (coalesced per room, chat/activity.py)
+        if msg_type == "typing":
+            get_activity().set_typing(self.state.room, sender.username, bool(content.get("active")))
+            return
+
+        # ⭐ CASE 5: Read up to a sequence number
+        if msg_type == "read":
+            seq = content.get("seq")
+            # Beyond a bigint is junk; the flush caps the rest at the room's last seq.
+            if isinstance(seq, int) and not isinstance(seq, bool) and 0 < seq < 2**63:
+                get_activity().read(self.state.room, sender, self.state.key, seq, peer_id=self.state.peer_id)
+            return
+
+    async def throttle(self, msg_type, label, content):
+        """
+        Apply the user's and this socket's rate limits. Chat messages a little
+        over the limit are held back; everything else over it is dropped.
+        """
+        if not get_limiter().allow(self.state.user.id):
+            delay = float("inf")
+        else:
+            delay = self.limiter.delay(msg_type)
+            if not delay:
+                return True
+            if msg_type == "chat" and delay <= settings.CHAT_RATE_MAX_DELAY:
+                metrics.ws_frames_limited.inc("chat", label, "deferred")
+                await asyncio.sleep(delay)
+                return True
+            self.limiter.refund(msg_type)
+
+        metrics.ws_frames_limited.inc("chat", label, "dropped")
+        if msg_type == "chat":
+            # Lets the sender mark its optimistic copy as not sent.
+            await self.send_text(jsonenc.dumps({"type": "failed", "client_ids": [provisional_id(content)]}))
+        return False
+
+    async def resume(self, after):
+        """
+        Stream messages with ``seq > after`` in batches. Live frames wait in
+        this socket's bounded outbox meanwhile, so they follow the backlog.
+        """
+        batch_size = settings.CHAT_RESUME_BATCH
+        self.outbox.hold()
+        try:
+            sent = 0
+            while True:
+                batch = await messages_since(self.state, after, batch_size)
+                if not batch:
+                    break
+                sent += len(batch)
+                if sent > settings.CHAT_RESUME_LIMIT:
+                    # Too far behind to replay; the client reloads instead.
+                    await self.send_text(jsonenc.dumps({"type": "lagged"}))
+                    return
+                await self.send_text(jsonenc.dumps({"type": "sync", "messages": batch}))
+                after = batch[-1]["seq"]
+                if len(batch) < batch_size:
+                    break
+            await self.send_text(jsonenc.dumps({"type": "synced", "seq": after}))
+        finally:
+            self.outbox.release()
+
+    async def queue_message(self, text, client_id, attachment=None):
+        """
+        Broadcast under a provisional id now and persist write-behind;
+        chat_confirm later maps ``client_id`` to the durable id.
+        """
+        state = self.state
+        get_activity().set_typing(state.room, state.user.username, False)
+
+        await metrics.group_send(
+            self.channel_layer,
+            state.room,
+            frame_event("chat_message", {
+                "id": None,
+                "client_id": client_id,
+                "sender": state.user.username,
+                "text": text,
+                "attachment": attachments.to_dict(attachment),
+                "timestamp": timezone.now().isoformat(),
+            })
+        )
+        # Waits while the writer is saturated, throttling this socket only.
+        await get_writer().submit(PendingMessage(
+            state.room,
+            client_id,
+            state.user,
+            text,
+            receiver_id=state.peer_id,
+            group_id=state.group_id,
+            attachment=attachment,
+        ))
 
 
 # ============================
 # CALL CONSUMER (WebRTC signaling)
 # ============================
 class CallConsumer(AsyncWebsocketConsumer):
+    FRAME_TYPES = {"offer", "answer", "ice", "hangup"}
+    room_group_name = None
+
     async def connect(self):
+        if not self.scope["user"].is_authenticated:
+            await self.close()
+            return
+
+        self.limiter = SocketLimiter(settings.CHAT_RATE_LIMITS)
+        self.ice = Coalescer(self.relay, settings.CHAT_ICE_COALESCE)
+        self.calls = {}  # peer username -> CallSession (chat/calls.py)
         self.username = self.scope["user"].username
         self.room_group_name = f"call_{safe_group_name(self.username)}"
 
-        print(f"[CALL] Connected: {self.username}")
+        logger.debug("Call socket connected: %s", self.username)
 
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -136,29 +282,163 @@ class CallConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        metrics.ws_connects.inc("call")
+        metrics.ws_open.inc("call")
+        get_tracker().connect(call_key(self.scope["user"].id), self.channel_name)
 
     async def disconnect(self, close_code):
+        if self.room_group_name is None:
+            return
+        metrics.ws_disconnects.inc("call")
+        metrics.ws_open.dec("call")
+
+        for peer, call in list(self.calls.items()):
+            # A tab that only rang leaves the call to the user's other tabs.
+            if call.state == ACTIVE or call.caller == self.username:
+                hangup = {"type": "hangup", "to": peer, "reason": "disconnected"}
+                await self.relay(self.peer_group(peer), [("hangup", call.id, self.stamp(hangup, call))])
+            self.end(peer, "disconnected")
+        self.ice.cancel()
+        get_tracker().disconnect(call_key(self.scope["user"].id), self.channel_name)
+
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
+        data = jsonenc.loads(text_data)
+        msg_type = data.get("type")
+        label = metrics.frame_type(msg_type, self.FRAME_TYPES)
+        metrics.ws_frames.inc("call", label)
 
         target = data.get("to")
-        if not target:
+        if msg_type not in self.FRAME_TYPES or not isinstance(target, str) or not target:
+            return
+
+        if not self.allowed(msg_type):
+            metrics.ws_frames_limited.inc("call", label, "dropped")
+            return
+
+        call = self.calls.get(target)
+        if msg_type == "offer":
+            # Fail fast instead of letting the caller wait out ICE timeouts.
+            if not await self.is_online(target):
+                await self.send(text_data=jsonenc.dumps({
+                    "type": "unavailable",
+                    "from": target,
+                    "to": self.username,
+                }))
+                return
+            if call is not None:
+                self.end(target, "replaced")
+            call = self.ring(target, CallSession.start(self.username, target))
+        elif call is None or (msg_type == "answer" and (call.state != RINGING or call.callee != self.username)):
+            metrics.call_frames_dropped.inc(msg_type, "out")
             return
+        elif msg_type == "answer":
+            call.answer()
+
+        frame = (msg_type, call.id, self.stamp(data, call))
+        target_group = self.peer_group(target)
+
+        # Candidates arrive in bursts; batch them into one relay.
+        if msg_type == "ice":
+            self.ice.add(target_group, frame)
+            return
+
+        if msg_type == "hangup":
+            self.end(target, "hangup")
+        await self.relay(target_group, self.ice.take(target_group) + [frame])
 
-        target_group = f"call_{safe_group_name(target)}"
+    def allowed(self, msg_type):
+        if not get_limiter().allow(self.scope["user"].id):
+            return False
+        if self.limiter.delay(msg_type):
+            self.limiter.refund(msg_type)
+            return False
+        return True
 
-        await self.channel_layer.group_send(
-            target_group,
-            {
-                "type": "call_signal",
-                "data": data
-            }
+    @staticmethod
+    def peer_group(username):
+        return f"call_{safe_group_name(username)}"
+
+    def stamp(self, data, call):
+        # Encoded once here; every socket of the peer sends the same text.
+        data["from"] = self.username
+        data["call"] = call.id
+        return jsonenc.dumps(data)
+
+    # ============================
+    # Call sessions
+    # ============================
+    def ring(self, peer, call):
+        self.calls[peer] = call
+        loop = asyncio.get_running_loop()
+        call.timer = loop.call_later(
+            settings.CHAT_CALL_RING_TIMEOUT,
+            lambda: loop.create_task(self.ring_expired(peer, call)),
         )
+        return call
+
+    def end(self, peer, reason):
+        call = self.calls.pop(peer, None)
+        if call is not None:
+            call.end()
+            metrics.calls_ended.inc(reason)
+
+    async def ring_expired(self, peer, call):
+        # Both ends keep their own timer, so neither has to tell the other.
+        if self.calls.get(peer) is not call or call.state != RINGING:
+            return
+        self.end(peer, "timeout")
+        await self.send(text_data=jsonenc.dumps({
+            "type": "timeout",
+            "from": peer,
+            "to": self.username,
+            "call": call.id,
+        }))
+
+    def accept_incoming(self, peer, msg_type, call_id):
+        call = self.calls.get(peer)
+        if msg_type == "offer":
+            if call is not None:
+                self.end(peer, "replaced")
+            self.ring(peer, CallSession(call_id, peer, self.username))
+            return True
+        if call is None or call.id != call_id:
+            return False
+        if msg_type == "answer":
+            if call.state != RINGING or call.caller != self.username:
+                return False
+            call.answer()
+        elif msg_type == "hangup":
+            self.end(peer, "hangup")
+        return True
+
+    async def relay(self, target_group, frames):
+        try:
+            await metrics.group_send(
+                self.channel_layer,
+                target_group,
+                {
+                    "type": "call_signal",
+                    "sender": self.username,
+                    "frames": frames
+                }
+            )
+        except Exception:
+            logger.exception("Could not relay %d call frames to %s", len(frames), target_group)
+
+    async def is_online(self, username):
+        """Whether ``username`` has a call socket open anywhere (chat sockets don't ring)."""
+        user_id = await aresolve_user_id(username)
+        return user_id is not None and bool(await aonline([call_key(user_id)]))
 
     async def call_signal(self, event):
-        await self.send(text_data=json.dumps(event["data"]))
+        peer = event["sender"]
+        for msg_type, call_id, frame in event["frames"]:
+            if self.accept_incoming(peer, msg_type, call_id):
+                await self.send(text_data=frame)
+            else:
+                metrics.call_frames_dropped.inc(msg_type, "in")
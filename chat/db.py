@@ -0,0 +1,25 @@
+"""
+Database access from async code.
+
+channels' ``database_sync_to_async`` is thread-sensitive, so every query
+from every consumer in a worker queues behind a single thread. The version
+here runs on a dedicated pool of ``CHAT_DB_THREADS`` threads. Each thread
+keeps one connection for ``CONN_MAX_AGE`` seconds, which puts a hard bound
+on how many connections a worker opens from its websocket side.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+from chat.metrics import timed_db
+
+executor = ThreadPoolExecutor(max_workers=settings.CHAT_DB_THREADS, thread_name_prefix="chat-db")
+
+
+def database_sync_to_async(func):
+    """
+    Drop-in for channels.db.database_sync_to_async using ``executor``. Each
+    call is timed into ``chat_db_seconds`` under the function's name.
+    """
+    return DatabaseSyncToAsync(timed_db(func), thread_sensitive=False, executor=executor)
@@ -0,0 +1,103 @@
+"""
+Account deletion without a long write lock.
+
+Deleting a User cascades over every message they sent or received in one
+transaction, which on SQLite blocks every other writer for as long as it
+takes. Instead ``request_deletion`` locks the account at once (inactive,
+no usable password; sessions and sockets stop authenticating) and records
+a ``PendingDeletion``. ``purge`` then removes the messages in chunks of
+``CHAT_DELETE_CHUNK``, each its own short transaction with a
+``CHAT_DELETE_PAUSE`` between them, and deletes the now small remainder
+with the User row last.
+
+Purges run on a background thread of the worker that took the request;
+``manage.py purge_deleted_users`` finishes any a restart interrupted.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+
+from chat import archive, attachments, history, search
+from chat.cache import user_ids
+from chat.models import Attachment, GroupMessage, Message, PendingDeletion
+from chat.sessions import forget_user
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-purge")
+
+
+def request_deletion(user):
+    """Lock ``user`` out now and purge their data in the background."""
+    with transaction.atomic():
+        User.objects.filter(pk=user.pk).update(is_active=False, password=make_password(None))
+        PendingDeletion.objects.get_or_create(user_id=user.pk)
+    user_ids.invalidate(user.username)
+    forget_user(user.pk)
+    executor.submit(_purge_in_background, user.pk)
+
+
+def _purge_in_background(user_id):
+    try:
+        purge(user_id)
+    except Exception:
+        logger.exception("Purging user %s failed; purge_deleted_users will retry", user_id)
+    finally:
+        connections.close_all()
+
+
+def delete_messages(model, messages):
+    """
+    Delete ``messages`` (instances with their scope fields loaded), their
+    search rows by id, and retire each room's cached history once.
+    """
+    token = history.caller_retires.set(True)
+    try:
+        with transaction.atomic():
+            model.objects.filter(id__in=[m.id for m in messages]).delete()
+            search.unindex_messages(messages)
+            transaction.on_commit(partial(history.retire_chunks, {m.sequence_key for m in messages}))
+    finally:
+        history.caller_retires.reset(token)
+
+
+def _delete_in_chunks(queryset, chunk_size, pause) -> int:
+    fields = ["id", "group_id"] if queryset.model is GroupMessage else ["id", "sender_id", "receiver_id"]
+    deleted = 0
+    while True:
+        messages = list(queryset.only(*fields)[:chunk_size])
+        if not messages:
+            return deleted
+        delete_messages(queryset.model, messages)
+        deleted += len(messages)
+        # Let other writers take the lock between chunks.
+        time.sleep(pause)
+
+
+def purge(user_id, chunk_size=None, pause=None) -> int:
+    """Remove everything of a user queued by ``request_deletion``; returns messages deleted."""
+    chunk_size = chunk_size or settings.CHAT_DELETE_CHUNK
+    pause = settings.CHAT_DELETE_PAUSE if pause is None else pause
+
+    deleted = 0
+    for queryset in (
+        Message.objects.filter(sender_id=user_id),
+        Message.objects.filter(receiver_id=user_id),
+        GroupMessage.objects.filter(sender_id=user_id),
+    ):
+        deleted += _delete_in_chunks(queryset, chunk_size, pause)
+    archive.drop_sender(user_id)
+
+    # Conversations, read markers, memberships, attachments, the profile and
+    # the PendingDeletion row go with the user; then the files nobody else
+    # uploaded too.
+    sha256s = list(Attachment.objects.filter(uploader_id=user_id).values_list("sha256", flat=True).distinct())
+    User.objects.filter(pk=user_id).delete()
+    attachments.delete_unused(sha256s)
+    return deleted
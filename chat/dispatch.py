@@ -0,0 +1,143 @@
+"""
+Single fan-out path for saved messages.
+
+Views, consumers and the ``post_save`` receivers all end up in
+``dispatch``/``adispatch``; each message is broadcast at most once per
+process, keyed by its id, and carries that id so clients can drop replays.
+
+Async views create messages with ``asave``: one trip to the DB pool for
+the insert and its bookkeeping, then the broadcast awaited on the view's
+own loop instead of through ``async_to_sync`` from the receiver.
+"""
+import contextvars
+import re
+import threading
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+
+from chat import attachments, metrics
+from chat.db import database_sync_to_async
+from chat.fanout import frame_event
+from chat.models import Conversation, GroupMessage
+from chat.search import index_messages
+
+
+# ============================
+# Room names
+# ============================
+def safe_group_name(name: str) -> str:
+    return re.sub(r'[^a-zA-Z0-9_.-]', '_', name)
+
+
+def direct_room(username_a: str, username_b: str) -> str:
+    return (
+        f"chat_{safe_group_name(min(username_a, username_b))}_"
+        f"{safe_group_name(max(username_a, username_b))}"
+    )
+
+
+def group_room(group_id) -> str:
+    return f"group_{safe_group_name(str(group_id))}"
+
+
+def room_for(message) -> str:
+    if isinstance(message, GroupMessage):
+        return group_room(message.group_id)
+    return direct_room(message.sender.username, message.receiver.username)
+
+
+def message_event(message) -> dict:
+    return frame_event("chat_message", {
+        "id": message.id,
+        "seq": message.seq,
+        "sender": message.sender.username,
+        "text": message.text,
+        "attachment": attachments.to_dict(message.attachment),
+        "timestamp": message.timestamp.isoformat(),
+    })
+
+
+# ============================
+# Idempotency
+# ============================
+class RecentKeys:
+    """Thread-safe bounded set remembering the most recent ``size`` keys."""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def claim(self, key) -> bool:
+        """Return True the first time ``key`` is seen."""
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys[key] = None
+            if len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+            return True
+
+
+_dispatched = RecentKeys()
+
+
+def _claim(message) -> bool:
+    return _dispatched.claim((type(message).__name__, message.id))
+
+
+def mark_dispatched(message):
+    """Record a message that was already broadcast by other means (see chat/pipeline.py)."""
+    _claim(message)
+
+
+# ============================
+# Dispatch
+# ============================
+async def adispatch(message):
+    if not _claim(message):
+        return
+    await metrics.group_send(get_channel_layer(), room_for(message), message_event(message))
+
+
+def dispatch(message):
+    if not _claim(message):
+        return
+    async_to_sync(metrics.group_send)(get_channel_layer(), room_for(message), message_event(message))
+
+
+def record(message):
+    """Inbox summary and search index for a freshly created Message/GroupMessage."""
+    if not isinstance(message, GroupMessage):
+        Conversation.objects.record_message(message)
+    index_messages([message])
+
+
+def message_saved(message):
+    record(message)
+    dispatch(message)
+
+
+# Set while a message is created by ``asave``, which broadcasts it itself;
+# the post_save receivers leave it alone.
+caller_broadcasts = contextvars.ContextVar("caller_broadcasts", default=False)
+
+
+@database_sync_to_async
+def _create(model, fields):
+    token = caller_broadcasts.set(True)
+    try:
+        message = model.objects.create(**fields)
+    finally:
+        caller_broadcasts.reset(token)
+    record(message)
+    return message
+
+
+async def asave(model, **fields):
+    """Create and broadcast a Message/GroupMessage from async code."""
+    message = await _create(model, fields)
+    await adispatch(message)
+    return message
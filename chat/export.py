@@ -0,0 +1,156 @@
+"""
+Streaming NDJSON export of a user's chat history.
+
+One JSON object per line, direct conversations first (one after another,
+each in seq order) and then every group the user belongs to::
+
+    {"kind": "direct", "id": 7, "seq": 3, "timestamp": "...", "sender": "alice", "receiver": "bob", "text": "hi"}
+    {"kind": "group", "id": 9, "seq": 1, "timestamp": "...", "group_id": 2, "group": "team", "sender": "bob", "text": "..."}
+
+Every query is a range scan on an existing (…, seq) index read with
+``iterator()`` (a server-side cursor on Postgres), so memory stays flat
+however long the history is. Archived messages (chat/archive.py) are
+decoded a block at a time and merged in by seq. Output is grouped into ``CHUNK_BYTES``
+pieces and can be gzip-compressed on the fly.
+"""
+import asyncio
+import heapq
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.db import connections
+
+from chat import archive, jsonenc
+from chat.models import Conversation, GroupMessage, Message, RoomSequence
+
+ROWS_PER_FETCH = 2000
+CHUNK_BYTES = 64 * 1024
+
+
+# ============================
+# Rows
+# ============================
+def _archived(room):
+    """``(id, seq, timestamp, sender_id, sender_username, text)`` of ``room``'s archived messages."""
+    for row in archive.iter_rows(room):
+        yield row[0], row[1], datetime.fromisoformat(row[2]), row[3], row[4], row[5]
+
+
+def _direct_rows(user, peer_id, peer_name):
+    names = {user.id: user.username, peer_id: peer_name}
+    fields = ("id", "seq", "timestamp", "sender_id", "text")
+
+    def scan(sender_id, receiver_id):
+        queryset = Message.objects.filter(sender_id=sender_id, receiver_id=receiver_id).order_by("seq")
+        return queryset.values_list(*fields).iterator(chunk_size=ROWS_PER_FETCH)
+
+    archived = (
+        (pk, seq, timestamp, sender_id, text)
+        for pk, seq, timestamp, sender_id, _, text in _archived(RoomSequence.direct_key(user.id, peer_id))
+    )
+    scans = [archived, scan(user.id, peer_id)]
+    if peer_id != user.id:
+        scans.append(scan(peer_id, user.id))
+    for pk, seq, timestamp, sender_id, text in heapq.merge(*scans, key=lambda row: row[1]):
+        yield {
+            "kind": "direct",
+            "id": pk,
+            "seq": seq,
+            "timestamp": timestamp.isoformat(),
+            "sender": names[sender_id],
+            "receiver": names[peer_id if sender_id == user.id else user.id],
+            "text": text,
+        }
+
+
+def _group_rows(group_id, group_name):
+    queryset = GroupMessage.objects.filter(group_id=group_id).order_by("seq")
+    rows = queryset.values_list("id", "seq", "timestamp", "sender__username", "text")
+    archived = (
+        (pk, seq, timestamp, sender, text)
+        for pk, seq, timestamp, _, sender, text in _archived(RoomSequence.group_key(group_id))
+    )
+    merged = heapq.merge(archived, rows.iterator(chunk_size=ROWS_PER_FETCH), key=lambda row: row[1])
+    for pk, seq, timestamp, sender, text in merged:
+        yield {
+            "kind": "group",
+            "id": pk,
+            "seq": seq,
+            "timestamp": timestamp.isoformat(),
+            "group_id": group_id,
+            "group": group_name,
+            "sender": sender,
+            "text": text,
+        }
+
+
+def export_rows(user):
+    """Every message ``user`` can see, as dicts."""
+    peers = Conversation.objects.filter(owner=user).order_by("peer_id").values_list("peer_id", "peer__username")
+    for peer_id, peer_name in list(peers):
+        yield from _direct_rows(user, peer_id, peer_name)
+    for group_id, group_name in list(user.chat_groups.order_by("id").values_list("id", "name")):
+        yield from _group_rows(group_id, group_name)
+
+
+# ============================
+# Encoding
+# ============================
+def ndjson_chunks(rows):
+    """Encode rows as NDJSON, yielded as bytes in pieces of about CHUNK_BYTES."""
+    buffer, size = [], 0
+    for row in rows:
+        line = (jsonenc.dumps(row) + "\n").encode()
+        buffer.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def export_chunks(user, compress=False):
+    chunks = ndjson_chunks(export_rows(user))
+    return gzip_chunks(chunks) if compress else chunks
+
+
+# ============================
+# Async streaming
+# ============================
+def _close(iterator):
+    iterator.close()
+    # This thread's connection is not closed by request_finished.
+    connections.close_all()
+
+
+async def astream(chunks):
+    """
+    Serve a sync chunk generator as an async iterator, as ASGI responses
+    need (Django would otherwise read a sync iterator into memory first).
+
+    The generator runs on a thread of its own for its whole life: its
+    server-side cursor stays on one connection, and a long export ties up
+    neither the event loop nor the thread shared by sync views.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chat-export")
+    try:
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        await loop.run_in_executor(executor, _close, chunks)
+        executor.shutdown(wait=False)
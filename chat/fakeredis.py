@@ -0,0 +1,390 @@
+"""
+Pure-Python stand-in for a Redis server.
+
+Speaks enough RESP to back ``chat.layers.RedisChannelLayer`` in tests,
+benchmarks and single-machine development without a real Redis. It runs on
+its own thread and event loop so every client loop (daphne's, and the
+short-lived ones created by ``async_to_sync``) can connect to it.
+
+    server = FakeRedisServer().start()
+    CHANNEL_LAYERS["default"]["CONFIG"]["hosts"] = [server.url]
+    ...
+    server.stop()
+"""
+import asyncio
+import fnmatch
+import threading
+import time
+from collections import deque
+
+
+class CommandError(Exception):
+    pass
+
+
+def _simple(text):
+    return b"+%s\r\n" % text.encode()
+
+
+def _error(text):
+    return b"-%s\r\n" % text.encode()
+
+
+def _encode(value) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(_encode(v) for v in value)
+    if isinstance(value, float):
+        value = repr(value)
+    data = value if isinstance(value, bytes) else str(value).encode()
+    return b"$%d\r\n%s\r\n" % (len(data), data)
+
+
+def _score(value: str) -> float:
+    if value in ("-inf", "+inf", "inf"):
+        return float(value)
+    exclusive = value.startswith("(")
+    score = float(value[1:] if exclusive else value)
+    # Exclusive bounds are rare here; nudging is close enough for a fake.
+    return score + 1e-9 if exclusive else score
+
+
+class FakeRedisServer:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self.data = {}
+        self.expires = {}
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._changed = None
+        self._clients = set()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
+    # ============================
+    # Lifecycle
+    # ============================
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(ready,), name="fakeredis", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop = None
+
+    async def _shutdown(self):
+        self._server.close()
+        for task in self._clients:
+            task.cancel()
+        await asyncio.gather(*self._clients, return_exceptions=True)
+
+    def _run(self, ready):
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._listen())
+        ready.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    async def _listen(self):
+        self._changed = asyncio.Condition()
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    # ============================
+    # Connection handling
+    # ============================
+    async def _handle_client(self, reader, writer):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                try:
+                    reply = await self.dispatch(args)
+                except CommandError as exc:
+                    writer.write(_error(str(exc)))
+                else:
+                    writer.write(reply if isinstance(reply, bytes) else _encode(reply))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancellation comes from stop(); this is the top of the task.
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    async def _read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            # Inline command, e.g. from telnet.
+            return line.decode().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            header = await reader.readline()
+            data = await reader.readexactly(int(header[1:-2]) + 2)
+            args.append(data[:-2].decode())
+        return args
+
+    async def dispatch(self, args):
+        name = args[0].upper()
+        handler = getattr(self, f"cmd_{name.lower()}", None)
+        if handler is None:
+            raise CommandError(f"ERR unknown command '{name}'")
+        self._purge_expired()
+        result = handler(*args[1:])
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    # ============================
+    # Keyspace
+    # ============================
+    def _purge_expired(self):
+        now = time.monotonic()
+        for key in [k for k, deadline in self.expires.items() if deadline <= now]:
+            self.data.pop(key, None)
+            del self.expires[key]
+
+    def _get(self, key, kind):
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise CommandError("WRONGTYPE Operation against a key holding the wrong kind of value")
+        return value
+
+    def _drop_if_empty(self, key):
+        if not self.data.get(key):
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    def cmd_ping(self, *args):
+        return _simple("PONG") if not args else args[0]
+
+    def cmd_select(self, db):
+        return _simple("OK")
+
+    def cmd_auth(self, *args):
+        return _simple("OK")
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return _simple("OK")
+
+    def cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                removed += 1
+            self.expires.pop(key, None)
+        return removed
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def cmd_keys(self, pattern):
+        return [key for key in self.data if fnmatch.fnmatchcase(key, pattern)]
+
+    def cmd_expire(self, key, seconds):
+        return self.cmd_pexpire(key, int(seconds) * 1000)
+
+    def cmd_pexpire(self, key, millis):
+        if key not in self.data:
+            return 0
+        self.expires[key] = time.monotonic() + int(millis) / 1000
+        return 1
+
+    def cmd_persist(self, key):
+        return 1 if key in self.data and self.expires.pop(key, None) is not None else 0
+
+    def cmd_ttl(self, key):
+        if key not in self.data:
+            return -2
+        if key not in self.expires:
+            return -1
+        return max(0, round(self.expires[key] - time.monotonic()))
+
+    # ============================
+    # Strings
+    # ============================
+    def cmd_get(self, key):
+        return self._get(key, str)
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        if "NX" in options and key in self.data:
+            return None
+        if "XX" in options and key not in self.data:
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        for unit, scale in (("EX", 1000), ("PX", 1)):
+            if unit in options:
+                self.cmd_pexpire(key, int(options[options.index(unit) + 1]) * scale)
+        return _simple("OK")
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, str) or 0) + int(amount)
+        self.data[key] = str(value)
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    # ============================
+    # Lists
+    # ============================
+    async def cmd_rpush(self, key, *values):
+        items = self._get(key, deque)
+        if items is None:
+            items = self.data[key] = deque()
+        items.extend(values)
+        await self._notify()
+        return len(items)
+
+    async def cmd_lpush(self, key, *values):
+        items = self._get(key, deque)
+        if items is None:
+            items = self.data[key] = deque()
+        items.extendleft(values)
+        await self._notify()
+        return len(items)
+
+    def cmd_lpop(self, key):
+        items = self._get(key, deque)
+        if not items:
+            return None
+        value = items.popleft()
+        self._drop_if_empty(key)
+        return value
+
+    def cmd_rpop(self, key):
+        items = self._get(key, deque)
+        if not items:
+            return None
+        value = items.pop()
+        self._drop_if_empty(key)
+        return value
+
+    def cmd_llen(self, key):
+        return len(self._get(key, deque) or ())
+
+    def cmd_lrange(self, key, start, stop):
+        items = list(self._get(key, deque) or ())
+        start, stop = int(start), int(stop)
+        stop = len(items) if stop == -1 else stop + 1
+        return items[start:stop]
+
+    def cmd_ltrim(self, key, start, stop):
+        items = self._get(key, deque)
+        if items:
+            kept = self.cmd_lrange(key, start, stop)
+            items.clear()
+            items.extend(kept)
+            self._drop_if_empty(key)
+        return _simple("OK")
+
+    async def cmd_blpop(self, *args):
+        *keys, timeout = args
+        deadline = time.monotonic() + float(timeout) if float(timeout) else None
+        async with self._changed:
+            while True:
+                self._purge_expired()
+                for key in keys:
+                    if self._get(key, deque):
+                        return [key, self.cmd_lpop(key)]
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    return None
+
+    # ============================
+    # Sorted sets
+    # ============================
+    def _zset(self, key, create=False):
+        zset = self._get(key, dict)
+        if zset is None and create:
+            zset = self.data[key] = {}
+        return zset if zset is not None else {}
+
+    def _zrange_by_score(self, key, low, high):
+        low, high = _score(low), _score(high)
+        return [m for m, s in sorted(self._zset(key).items(), key=lambda i: (i[1], i[0])) if low <= s <= high]
+
+    def cmd_zadd(self, key, *args):
+        zset = self._zset(key, create=True)
+        added = 0
+        pairs = list(args)
+        while pairs and pairs[0].upper() in ("NX", "XX", "GT", "LT", "CH"):
+            pairs.pop(0)
+        for score, member in zip(pairs[::2], pairs[1::2]):
+            added += member not in zset
+            zset[member] = float(score)
+        return added
+
+    def cmd_zrem(self, key, *members):
+        zset = self._zset(key)
+        removed = sum(1 for m in members if zset.pop(m, None) is not None)
+        self._drop_if_empty(key)
+        return removed
+
+    def cmd_zcard(self, key):
+        return len(self._zset(key))
+
+    def cmd_zscore(self, key, member):
+        score = self._zset(key).get(member)
+        return None if score is None else repr(score)
+
+    def cmd_zcount(self, key, low, high):
+        return len(self._zrange_by_score(key, low, high))
+
+    def cmd_zrange(self, key, start, stop, *options):
+        members = [m for m, _ in sorted(self._zset(key).items(), key=lambda i: (i[1], i[0]))]
+        start, stop = int(start), int(stop)
+        stop = len(members) if stop == -1 else stop + 1
+        members = members[start:stop]
+        if options and options[0].upper() == "WITHSCORES":
+            zset = self._zset(key)
+            return [x for m in members for x in (m, repr(zset[m]))]
+        return members
+
+    def cmd_zrangebyscore(self, key, low, high):
+        return self._zrange_by_score(key, low, high)
+
+    def cmd_zremrangebyscore(self, key, low, high):
+        zset = self._zset(key)
+        doomed = self._zrange_by_score(key, low, high)
+        for member in doomed:
+            del zset[member]
+        self._drop_if_empty(key)
+        return len(doomed)
+
@@ -0,0 +1,274 @@
+"""
+Per-worker fan-out of room events to local websockets.
+
+Instead of every ChatConsumer joining the channel-layer group of its room,
+each worker joins once per room on behalf of all its local sockets (the
+first subscriber adds the worker's channel, the last one removes it). A
+``group_send`` therefore costs one layer delivery per *worker* rather than
+per member, and the worker encodes the outgoing frame once and hands the
+same text to every local socket. Events normally arrive with that text
+already in ``event["frame"]`` (see ``frame_event``), encoded once by
+whoever sent them.
+
+Each socket drains its own bounded ``SendBuffer``. A recipient that cannot
+keep up loses its oldest frames instead of stalling the room; the dropped
+frames are coalesced into one ``{"type": "lagged"}`` notice so the client
+knows to reload.
+
+Channel layers forget group members after ``group_expiry``; a room renews
+its worker's membership at half that interval for as long as it has
+local subscribers.
+"""
+import asyncio
+import logging
+import weakref
+from collections import deque
+
+from django.conf import settings
+
+from chat import jsonenc, metrics
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# Frames
+# ============================
+def frame_event(event_type, frame) -> dict:
+    """Channel-layer event carrying ``frame`` already encoded for the socket."""
+    return {"type": event_type, "frame": jsonenc.dumps(frame)}
+
+
+# Fallback renderers for events sent without a pre-encoded frame.
+def chat_message_frame(event):
+    frame = {
+        "id": event["id"],
+        "sender": event["sender"],
+        "text": event["text"],
+        "timestamp": event["timestamp"],
+    }
+    if "client_id" in event:
+        frame["client_id"] = event["client_id"]
+    return frame
+
+
+def chat_confirm_frame(event):
+    return {"type": "confirm", "messages": event["messages"]}
+
+
+def chat_failed_frame(event):
+    return {"type": "failed", "client_ids": event["client_ids"]}
+
+
+FRAMES = {
+    "chat_message": chat_message_frame,
+    "chat_confirm": chat_confirm_frame,
+    "chat_failed": chat_failed_frame,
+}
+
+
+def encode_event(event):
+    """The websocket text for a room event, or None for unknown types."""
+    frame = event.get("frame")
+    if frame is not None:
+        return frame
+    render = FRAMES.get(event.get("type"))
+    if render is None:
+        return None
+    return jsonenc.dumps(render(event))
+
+
+# ============================
+# Per-socket send buffer
+# ============================
+class SendBuffer:
+    """
+    Bounded queue of encoded frames for one socket, drained by its own task.
+
+    ``push`` never blocks; when ``limit`` frames are already waiting the
+    oldest one is dropped and counted. While the buffer is held (during a
+    resume, see ChatConsumer) frames queue up without being sent. If a send
+    fails the buffer stops taking frames and calls ``close``, if given.
+    """
+
+    def __init__(self, send, limit=256, close=None):
+        self._send = send
+        self._close = close
+        self.failed = False
+        self._frames = deque()
+        self._wakeup = asyncio.Event()
+        self.limit = limit
+        self.dropped = 0
+        self.held = False
+        self._task = asyncio.get_running_loop().create_task(self._drain())
+
+    def push(self, text):
+        if self.failed:
+            return
+        if len(self._frames) >= self.limit:
+            self._frames.popleft()
+            self.dropped += 1
+        self._frames.append(text)
+        self._wakeup.set()
+
+    async def _drain(self):
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while self._frames and not self.held:
+                    if self.dropped:
+                        notice = jsonenc.dumps({"type": "lagged", "dropped": self.dropped})
+                        self.dropped = 0
+                        await self._send(notice)
+                    await self._send(self._frames.popleft())
+        except Exception:
+            logger.warning("Send failed; closing the socket", exc_info=True)
+        self.failed = True
+        self._frames.clear()
+        if self._close is not None:
+            try:
+                await self._close()
+            except Exception:
+                logger.debug("Closing a failed socket raised", exc_info=True)
+
+    def hold(self):
+        self.held = True
+
+    def release(self):
+        self.held = False
+        self._wakeup.set()
+
+    def close(self):
+        self._task.cancel()
+
+
+# ============================
+# Rooms
+# ============================
+class Room:
+    def __init__(self, hub, name, layer):
+        self.hub = hub
+        self.name = name
+        self.layer = layer
+        self.channel = None
+        self.subscribers = set()
+        self.closed = False
+        self.ready = asyncio.get_running_loop().create_task(self._join())
+        self._tasks = []
+
+    async def _join(self):
+        self.channel = await self.layer.new_channel()
+        await self.layer.group_add(self.name, self.channel)
+        if self.closed:
+            return  # left while joining; leave() discards the membership
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._read()))
+        expiry = getattr(self.layer, "group_expiry", None)
+        if expiry:
+            self._tasks.append(loop.create_task(self._renew(expiry / 2)))
+
+    async def _renew(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.layer.group_add(self.name, self.channel)
+            except Exception:
+                logger.exception("Could not renew membership of room %s", self.name)
+
+    async def _read(self):
+        while True:
+            try:
+                event = await self.layer.receive(self.channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Receive failed for room %s", self.name)
+                await asyncio.sleep(1)
+                continue
+            await self.deliver(event)
+
+    async def deliver(self, event):
+        text = encode_event(event)
+        if text is None:
+            logger.warning("Dropping unknown event %r for room %s", event.get("type"), self.name)
+            return
+        # Yield between chunks so one very large room does not starve the loop.
+        chunk = self.hub.chunk_size
+        for i, buffer in enumerate(list(self.subscribers), 1):
+            buffer.push(text)
+            if i % chunk == 0:
+                await asyncio.sleep(0)
+
+    async def leave(self):
+        self.closed = True
+        for task in self._tasks:
+            task.cancel()
+        try:
+            await self.ready
+            await self.layer.group_discard(self.name, self.channel)
+        except Exception:
+            logger.exception("Could not leave room %s", self.name)
+
+
+class Hub:
+    """Local room subscriptions for one event loop."""
+
+    def __init__(self, buffer_limit=256, chunk_size=500):
+        self.buffer_limit = buffer_limit
+        self.chunk_size = chunk_size
+        self.rooms = {}
+
+    async def subscribe(self, name, layer, send, close=None):
+        """
+        Start delivering ``name``'s events to ``send``; returns the SendBuffer.
+        ``close`` is awaited if a send fails.
+        """
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(self, name, layer)
+        buffer = SendBuffer(send, self.buffer_limit, close)
+        room.subscribers.add(buffer)
+        try:
+            await room.ready
+        except BaseException:
+            await self.unsubscribe(name, buffer)
+            raise
+        return buffer
+
+    async def unsubscribe(self, name, buffer):
+        buffer.close()
+        room = self.rooms.get(name)
+        if room is None:
+            return
+        room.subscribers.discard(buffer)
+        if not room.subscribers:
+            del self.rooms[name]
+            await room.leave()
+
+
+_hubs = weakref.WeakKeyDictionary()
+
+
+def _outbox_depth() -> int:
+    return sum(
+        len(buffer._frames)
+        for hub in list(_hubs.values())
+        for room in list(hub.rooms.values())
+        for buffer in list(room.subscribers)
+    )
+
+
+metrics.Gauge("chat_outbox_frames", "Frames waiting in per-socket send buffers.", callback=_outbox_depth)
+
+
+def get_hub() -> Hub:
+    """The Hub for the running event loop."""
+    loop = asyncio.get_running_loop()
+    hub = _hubs.get(loop)
+    if hub is None:
+        hub = _hubs[loop] = Hub(
+            buffer_limit=settings.CHAT_SEND_BUFFER,
+            chunk_size=settings.CHAT_FANOUT_CHUNK,
+        )
+    return hub
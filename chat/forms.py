@@ -2,6 +2,15 @@ from django import forms
 from .models import Profile
 
 class ProfileForm(forms.ModelForm):
+    # Stored as an Attachment by the view (chat/attachments.py), not by the form.
+    avatar = forms.FileField(required=False)
+
     class Meta:
         model = Profile
-        fields = ['bio', 'profile_picture']
+        fields = ['bio']
+
+    def clean_avatar(self):
+        avatar = self.cleaned_data.get('avatar')
+        if avatar and not (avatar.content_type or '').startswith('image/'):
+            raise forms.ValidationError("Choose an image.")
+        return avatar
@@ -0,0 +1,131 @@
+"""
+Pre-rendered conversation history for the chat pages.
+
+Messages are grouped into chunks of ``CHUNK_SIZE`` by sequence number:
+chunk ``n`` holds ``seq`` ``n*CHUNK_SIZE+1 .. (n+1)*CHUNK_SIZE``. Once a
+chunk is complete it never changes, so its HTML is rendered once and
+kept in the ``CHAT_HISTORY_CACHE`` cache, keyed by room and chunk. Only the
+live tail (the newest, still-filling chunk) is rendered per request.
+
+The markup is the same for every viewer: bubbles carry ``data-sender``
+and the page marks the viewer's own ones, so one cached chunk serves both
+sides of a conversation and every member of a group.
+
+Rooms whose every message has been archived (chat/archive.py) show their
+newest archived page instead, rendered per request.
+
+Deleting messages bumps the room's generation number, which is part of
+each of its chunk keys, so all of the room's cached chunks retire at once.
+Bulk deleters (archiving, account deletion) set ``caller_retires`` and
+retire each room once per batch instead of once per message.
+"""
+import contextvars
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from chat import archive
+from chat.models import Message, RoomSequence
+from chat.pagination import PAGE_SIZE, conversation_since, encode_cursor, group_since
+
+CHUNK_SIZE = 100
+GENERATION_KEY = "chat:history:generation"
+
+
+def _cache():
+    return caches[settings.CHAT_HISTORY_CACHE]
+
+
+def render_messages(messages) -> str:
+    return render_to_string("message_chunk.html", {"messages": messages})
+
+
+def _generation(cache, room) -> int:
+    key = f"{GENERATION_KEY}:{room}"
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, 0, timeout=None)
+        generation = cache.get(key, 0)
+    return generation
+
+
+def retire_chunks(rooms):
+    """Forget the cached chunks of ``rooms`` (see chat/signals.py)."""
+    cache = _cache()
+    for room in rooms:
+        key = f"{GENERATION_KEY}:{room}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, 1, timeout=None)
+
+
+# Set while a bulk delete retires the rooms it touched itself; the
+# post_delete receiver leaves them alone.
+caller_retires = contextvars.ContextVar("caller_retires", default=False)
+
+
+class History:
+    """The tail of one room's history, as cached chunks plus live messages."""
+
+    def __init__(self, room, fetch_since):
+        self.room = room
+        # fetch_since(after, limit) -> messages with seq > after, in seq order
+        self.fetch_since = fetch_since
+
+    def _chunk(self, cache, generation, index):
+        key = f"chat:history:{generation}:{self.room}:{index}"
+        chunk = cache.get(key)
+        if chunk is None:
+            start = index * CHUNK_SIZE
+            messages = [m for m in self.fetch_since(start, CHUNK_SIZE) if m.seq <= start + CHUNK_SIZE]
+            chunk = {
+                "html": render_messages(messages),
+                "cursor": encode_cursor(messages[0]) if messages else None,
+                "first_seq": messages[0].seq if messages else None,
+            }
+            # A chunk with holes may still be waiting on a commit; don't pin it.
+            if len(messages) == CHUNK_SIZE:
+                cache.set(key, chunk, timeout=None)
+        return chunk
+
+    def render(self):
+        """Returns ``(html, next_cursor)`` for the newest messages of the room."""
+        last = RoomSequence.objects.filter(room=self.room).values_list("last", flat=True).first() or 0
+        boundary = (max(last, 1) - 1) // CHUNK_SIZE * CHUNK_SIZE
+
+        tail = self.fetch_since(boundary, CHUNK_SIZE)
+        parts = [render_messages(tail)]
+        first_seq = tail[0].seq if tail else None
+        cursor = encode_cursor(tail[0]) if tail else None
+
+        # Too little in the tail on its own; show the complete chunk before it.
+        if len(tail) < PAGE_SIZE and boundary:
+            cache = _cache()
+            chunk = self._chunk(cache, _generation(cache, self.room), boundary // CHUNK_SIZE - 1)
+            if chunk["first_seq"] is not None:
+                parts.insert(0, chunk["html"])
+                first_seq, cursor = chunk["first_seq"], chunk["cursor"]
+
+        if first_seq is None:
+            archived, more = archive.page(self.room, None, PAGE_SIZE)
+            return mark_safe(render_messages(archived)), encode_cursor(archived[0]) if more else None
+
+        has_more = first_seq > 1
+        return mark_safe("".join(parts)), cursor if has_more else None
+
+
+def for_conversation(user, other_user) -> History:
+    return History(
+        RoomSequence.direct_key(user.id, other_user.id),
+        lambda after, limit: conversation_since(Message.objects, user.id, other_user.id, after, limit),
+    )
+
+
+def for_group(group) -> History:
+    return History(
+        RoomSequence.group_key(group.id),
+        lambda after, limit: group_since(group.messages.all(), after, limit),
+    )
@@ -0,0 +1,44 @@
+"""
+JSON codec for websocket frames and channel-layer payloads.
+
+``CHAT_JSON_BACKEND`` selects the implementation: ``"orjson"``, ``"json"``
+(stdlib) or ``"auto"`` (orjson when it is installed). ``dumps`` always
+returns ``str`` so its output can go straight into ``send(text_data=...)``.
+"""
+import json
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+
+def _stdlib():
+    encoder = json.JSONEncoder(separators=(",", ":"))
+    return "json", encoder.encode, json.loads
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+
+    return "orjson", dumps, orjson.loads
+
+
+def load_backend(name):
+    if name == "json":
+        return _stdlib()
+    if name == "orjson":
+        try:
+            return _orjson()
+        except ImportError:
+            raise ImproperlyConfigured("CHAT_JSON_BACKEND is 'orjson' but orjson is not installed")
+    if name == "auto":
+        try:
+            return _orjson()
+        except ImportError:
+            return _stdlib()
+    raise ImproperlyConfigured(f"Unknown CHAT_JSON_BACKEND {name!r}")
+
+
+backend, dumps, loads = load_backend(settings.CHAT_JSON_BACKEND)
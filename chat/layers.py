@@ -0,0 +1,239 @@
+"""
+Redis-backed channel layer so several daphne workers share groups.
+
+Configured from settings (see ``CHANNEL_LAYERS``); point ``hosts`` at a real
+Redis or at ``chat.fakeredis.FakeRedisServer`` for tests and benchmarks.
+
+Layout in Redis:
+
+* ``<prefix>:ch:<name>`` — list holding messages for a normal channel, or for
+  every consumer of one process (``specific.<client>!``). A single receive
+  loop per process drains the process list and hands messages to the local
+  consumer they are addressed to.
+* ``<prefix>:group:<name>`` — sorted set of channel names scored by join time,
+  so stale memberships age out after ``group_expiry``.
+"""
+import asyncio
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+from chat import jsonenc
+from chat.resp import LoopLocalPools
+
+
+class RedisChannelLayer(BaseChannelLayer):
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        hosts=None,
+        prefix="asgi",
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        process_capacity=10000,
+        pool_size=10,
+        receive_timeout=5,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.hosts = hosts or ["redis://localhost:6379/0"]
+        self.prefix = prefix
+        self.group_expiry = group_expiry
+        self.process_capacity = process_capacity
+        self.receive_timeout = receive_timeout
+        # Sharding across several hosts is left to Redis Cluster/proxies.
+        self.pools = LoopLocalPools(self.hosts[0], max_size=pool_size)
+
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self._local_keys = set()
+        self._buffers = {}
+        self._receiving = set()
+        self._last_receive = {}
+        self._receive_task = None
+
+    # ============================
+    # Keys and payloads
+    # ============================
+    def _channel_key(self, channel):
+        return f"{self.prefix}:ch:{self.non_local_name(channel)}"
+
+    def _group_key(self, group):
+        return f"{self.prefix}:group:{group}"
+
+    def _key_capacity(self, channel):
+        return self.process_capacity if "!" in channel else self.get_capacity(channel)
+
+    def serialize(self, message, channel):
+        if "!" in channel:
+            message = dict(message, __asgi_channel__=channel)
+        return jsonenc.dumps(message)
+
+    def deserialize(self, payload):
+        return jsonenc.loads(payload)
+
+    def _push_commands(self, key, capacity, payloads):
+        # One RPUSH reports the new length; LTRIM enforces capacity in the same
+        # round trip and EXPIRE lets abandoned queues disappear.
+        return [
+            ("RPUSH", key, *payloads),
+            ("LTRIM", key, 0, capacity - 1),
+            ("EXPIRE", key, self.expiry),
+        ]
+
+    # ============================
+    # Channel API
+    # ============================
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        assert "__asgi_channel__" not in message
+
+        capacity = self._key_capacity(channel)
+        length, _, _ = await self.pools.get().pipeline(
+            self._push_commands(self._channel_key(channel), capacity, [self.serialize(message, channel)])
+        )
+        if length > capacity:
+            raise ChannelFull(channel)
+
+    async def receive(self, channel):
+        assert self.valid_channel_name(channel)
+        if "!" not in channel:
+            return await self._blocking_pop(channel)
+
+        self._ensure_receive_loop()
+        buffer = self._buffers.get(channel)
+        if buffer is None:
+            buffer = self._buffers[channel] = asyncio.Queue()
+        self._receiving.add(channel)
+        try:
+            return await buffer.get()
+        finally:
+            self._receiving.discard(channel)
+            self._last_receive[channel] = time.monotonic()
+
+    async def _blocking_pop(self, channel):
+        key = self._channel_key(channel)
+        async with self.pools.get().connection() as conn:
+            while True:
+                reply = await conn.execute("BLPOP", key, self.receive_timeout)
+                if reply is not None:
+                    return self.deserialize(reply[1])
+
+    async def new_channel(self, prefix="specific."):
+        channel = f"{prefix}.{self.client_prefix}!{uuid.uuid4().hex}"
+        self._local_keys.add(self._channel_key(channel))
+        return channel
+
+    # ============================
+    # Process-local receive loop
+    # ============================
+    def _ensure_receive_loop(self):
+        loop = asyncio.get_running_loop()
+        task = self._receive_task
+        if task is None or task.done() or task.get_loop() is not loop:
+            self._receive_task = loop.create_task(self._receive_loop())
+
+    async def _receive_loop(self):
+        pool = self.pools.get()
+        # Blocking pops hold their connection, so use one outside the pool.
+        conn = await pool.open_connection()
+        try:
+            while True:
+                try:
+                    reply = await conn.execute("BLPOP", *sorted(self._local_keys), self.receive_timeout)
+                except (ConnectionError, OSError):
+                    conn.close()
+                    await asyncio.sleep(1)
+                    conn = await pool.open_connection()
+                    continue
+                if reply is None:
+                    self._sweep_buffers()
+                    continue
+                message = self.deserialize(reply[1])
+                channel = message.pop("__asgi_channel__")
+                buffer = self._buffers.get(channel)
+                if buffer is None:
+                    # The consumer is between receive() calls (or gone; the
+                    # sweep reclaims those).
+                    buffer = self._buffers[channel] = asyncio.Queue()
+                    self._last_receive.setdefault(channel, time.monotonic())
+                if buffer.qsize() < self.get_capacity(channel):
+                    buffer.put_nowait(message)
+        finally:
+            conn.close()
+
+    def _sweep_buffers(self):
+        """Forget buffers of consumers that have not called receive() within ``expiry``."""
+        cutoff = time.monotonic() - self.expiry
+        for channel, last in list(self._last_receive.items()):
+            if channel not in self._receiving and last < cutoff:
+                self._buffers.pop(channel, None)
+                del self._last_receive[channel]
+
+    # ============================
+    # Groups extension
+    # ============================
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), "Group name not valid"
+        assert self.valid_channel_name(channel), "Channel name not valid"
+        key = self._group_key(group)
+        await self.pools.get().pipeline([
+            ("ZADD", key, time.time(), channel),
+            ("EXPIRE", key, self.group_expiry),
+        ])
+
+    async def group_discard(self, group, channel):
+        assert self.valid_channel_name(channel), "Invalid channel name"
+        assert self.valid_group_name(group), "Invalid group name"
+        await self.pools.get().execute("ZREM", self._group_key(group), channel)
+
+    async def group_send(self, group, message):
+        """
+        Deliver ``message`` to every member in two round trips: one to read
+        the membership and one pipelined write for all destination queues.
+        """
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.valid_group_name(group), "Invalid group name"
+        key = self._group_key(group)
+
+        async with self.pools.get().connection() as conn:
+            _, channels = await conn.pipeline([
+                ("ZREMRANGEBYSCORE", key, 0, time.time() - self.group_expiry),
+                ("ZRANGE", key, 0, -1),
+            ])
+            if not channels:
+                return
+
+            # Consumers on the same worker share one queue.
+            by_key = {}
+            for channel in channels:
+                by_key.setdefault(self._channel_key(channel), []).append(channel)
+
+            commands = []
+            for queue_key, members in by_key.items():
+                payloads = [self.serialize(message, channel) for channel in members]
+                commands += self._push_commands(queue_key, self._key_capacity(members[0]), payloads)
+            # Full queues silently drop, matching InMemoryChannelLayer.
+            await conn.pipeline(commands)
+
+    # ============================
+    # Flush extension
+    # ============================
+    async def flush(self):
+        pool = self.pools.get()
+        keys = await pool.execute("KEYS", f"{self.prefix}:*")
+        if keys:
+            await pool.execute("DEL", *keys)
+        self._buffers.clear()
+        self._last_receive.clear()
+
+    async def close(self):
+        if self._receive_task is not None:
+            self._receive_task.cancel()
+        self.pools.close()
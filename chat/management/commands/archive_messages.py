@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat import archive
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than the retention horizon into compressed "
+        "archive blocks, one room and block at a time."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.CHAT_RETENTION_DAYS,
+            help="Archive messages older than this many days (default: CHAT_RETENTION_DAYS).",
+        )
+        parser.add_argument("--block-size", type=int, default=settings.CHAT_ARCHIVE_BLOCK)
+        parser.add_argument("--dry-run", action="store_true", help="Only list the rooms that would be archived.")
+
+    def handle(self, *args, **options):
+        if not options["days"] or options["days"] < 1:
+            raise CommandError("Retention is disabled; pass --days or set CHAT_RETENTION_DAYS.")
+        horizon = timezone.now() - timedelta(days=options["days"])
+
+        rooms = archive.old_rooms(horizon)
+        if options["dry_run"]:
+            for room in rooms:
+                self.stdout.write(room)
+            return
+
+        total = 0
+        for room in rooms:
+            moved = archive.archive_room(room, horizon, options["block_size"])
+            total += moved
+            self.stdout.write(f"{room}: {moved}")
+        self.stdout.write(self.style.SUCCESS(f"Archived {total} messages from {len(rooms)} rooms."))
@@ -0,0 +1,99 @@
+import asyncio
+import contextlib
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from chat import bench
+from chat.fakeredis import FakeRedisServer
+
+SCENARIOS = ("direct", "group", "call")
+# The limits are there to stop abusive clients; the benchmark measures the
+# pipeline, so it lifts them (finite values keep TokenBucket's arithmetic sane).
+UNLIMITED = {
+    "CHAT_RATE_LIMITS": {"*": (1e9, 1e9)},
+    "CHAT_USER_RATE_LIMIT": 2**62,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Load-test ChatConsumer and CallConsumer in-process with simulated "
+        "websocket clients and print the results as JSON. Runs against a "
+        "throwaway test database with CHAT_RATE_LIMITS and "
+        "CHAT_USER_RATE_LIMIT lifted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200, help="Websocket clients per scenario.")
+        parser.add_argument("--messages", type=int, default=20, help="Messages each sender sends.")
+        parser.add_argument("--group-size", type=int, default=50, help="Members per group room.")
+        parser.add_argument("--rate", type=float, default=0, help="Messages/sec per sender (0 = unthrottled).")
+        parser.add_argument("--timeout", type=float, default=10, help="Seconds to wait for a missing delivery.")
+        parser.add_argument("--layer", choices=("memory", "fakeredis"), default="memory")
+        parser.add_argument("--scenario", choices=SCENARIOS, action="append", dest="scenarios")
+        parser.add_argument("--output", help="Write JSON here instead of stdout.")
+
+    def handle(self, *args, **options):
+        layer, server = self.channel_layer(options["layer"])
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            # Consumers may print; keep stdout for the JSON report.
+            with override_settings(CHANNEL_LAYERS={"default": layer}, **UNLIMITED), \
+                    contextlib.redirect_stdout(sys.stderr):
+                report = self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if server is not None:
+                server.stop()
+
+        report["config"]["layer"] = options["layer"]
+        report["config"]["rate_limits"] = "disabled"
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as fh:
+                fh.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def channel_layer(self, name):
+        if name == "memory":
+            return {"BACKEND": "channels.layers.InMemoryChannelLayer", "CONFIG": {"capacity": 10000}}, None
+        server = FakeRedisServer().start()
+        return {
+            "BACKEND": "chat.layers.RedisChannelLayer",
+            "CONFIG": {"hosts": [server.url], "capacity": 10000},
+        }, server
+
+    def run(self, options):
+        # Imported late so the ASGI app is built under the overridden settings.
+        from imessage_clone.asgi import application
+
+        users = bench.create_users(options["clients"])
+        groups = bench.create_groups(users, options["group_size"])
+        scenarios = options["scenarios"] or list(SCENARIOS)
+
+        results = asyncio.run(bench.run(
+            application,
+            scenarios,
+            users,
+            groups,
+            messages=options["messages"],
+            rate=options["rate"],
+            timeout=options["timeout"],
+        ))
+        return {
+            "config": {
+                "clients": options["clients"],
+                "messages": options["messages"],
+                "group_size": options["group_size"],
+                "rate": options["rate"],
+            },
+            "results": results,
+        }
@@ -0,0 +1,118 @@
+from django.apps import apps
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from chat.models import GroupMessage, Message
+from chat.search import index_messages
+
+SOURCE_ALIAS = "sqlite_source"
+# Apps whose rows move over. Permissions and content types are recreated by
+# ``migrate`` on the target (with their own ids), so they and anything that
+# points at them (user_permissions, admin log) are left behind.
+APPS = ("auth", "sessions", "chat")
+SKIP = {"auth.Permission"}
+
+
+def copy_order():
+    """Copyable models, each after every model it has a foreign key to."""
+    models = [
+        model
+        for label in APPS
+        for model in apps.get_app_config(label).get_models(include_auto_created=True)
+        if model._meta.label not in SKIP
+    ]
+    labels = {model._meta.label for model in models}
+
+    deps = {}
+    for model in models:
+        label = model._meta.label
+        targets = {
+            field.related_model._meta.label
+            for field in model._meta.concrete_fields
+            if field.is_relation
+        } - {label}
+        if targets <= labels:
+            deps[model] = targets
+
+    ordered, done = [], set()
+    while deps:
+        ready = [model for model, targets in deps.items() if targets <= done]
+        if not ready:
+            raise CommandError("Foreign keys form a cycle: %s" % ", ".join(m._meta.label for m in deps))
+        for model in ready:
+            ordered.append(model)
+            done.add(model._meta.label)
+            del deps[model]
+    return ordered
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy every user, session, group and message from a SQLite file into "
+        "the configured database (normally Postgres via DATABASE_URL), "
+        "streaming rows in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--source", default=str(settings.BASE_DIR / "db.sqlite3"), help="SQLite file to read."
+        )
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS, help="Database alias to copy into."
+        )
+        parser.add_argument("--batch-size", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        target = options["database"]
+        self.add_source(options["source"])
+
+        self.stdout.write(f"Migrating {target}...")
+        call_command("migrate", database=target, verbosity=0)
+
+        models = copy_order()
+        for model in models:
+            if model._base_manager.using(target).exists():
+                raise CommandError(f"{model._meta.label} already has rows in {target}; refusing to merge.")
+
+        for model in models:
+            copied = self.copy_model(model, target, options["batch_size"])
+            self.stdout.write(f"{model._meta.label}: {copied}")
+
+        # Rows kept their ids; move each table's id sequence past them.
+        connection = connections[target]
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+        self.stdout.write(self.style.SUCCESS("Done."))
+
+    def add_source(self, path):
+        databases = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            SOURCE_ALIAS: {"ENGINE": "django.db.backends.sqlite3", "NAME": path},
+        })
+        connections.settings[SOURCE_ALIAS] = databases[SOURCE_ALIAS]
+
+    def copy_model(self, model, target, batch_size):
+        queryset = model._base_manager.using(SOURCE_ALIAS).order_by("pk")
+        copied = 0
+        batch = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            batch.append(obj)
+            if len(batch) >= batch_size:
+                copied += self.write(model, target, batch)
+                batch = []
+        if batch:
+            copied += self.write(model, target, batch)
+        return copied
+
+    def write(self, model, target, batch):
+        # bulk_create sends no signals, so nothing is re-numbered or re-broadcast;
+        # the search index is filled batch by batch here instead.
+        with transaction.atomic(using=target):
+            model._base_manager.using(target).bulk_create(batch)
+            if model in (Message, GroupMessage):
+                index_messages(batch, using=target)
+        return len(batch)
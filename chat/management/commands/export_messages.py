@@ -0,0 +1,38 @@
+import sys
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.export import export_chunks
+
+
+class Command(BaseCommand):
+    help = (
+        "Write every direct and group message a user can see as NDJSON, "
+        "streaming rows in constant memory."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username")
+        parser.add_argument("--output", help="File to write (default: stdout).")
+        parser.add_argument("--gzip", action="store_true", help="Gzip-compress the output.")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['username']!r}.")
+
+        chunks = export_chunks(user, compress=options["gzip"])
+        if not options["output"]:
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options["output"], "wb") as fh:
+            for chunk in chunks:
+                fh.write(chunk)
+                written += len(chunk)
+        self.stderr.write(f"Wrote {written} bytes to {options['output']}.")
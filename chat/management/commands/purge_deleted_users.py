@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from chat.deletion import purge
+from chat.models import PendingDeletion
+
+
+class Command(BaseCommand):
+    help = "Finish deleting accounts whose background purge was interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, help="Messages deleted per transaction.")
+        parser.add_argument("--pause", type=float, help="Seconds to wait between chunks.")
+
+    def handle(self, *args, **options):
+        for user_id in list(PendingDeletion.objects.values_list("user_id", flat=True)):
+            deleted = purge(user_id, chunk_size=options["chunk_size"], pause=options["pause"])
+            self.stdout.write(f"user {user_id}: {deleted} messages deleted")
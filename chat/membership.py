@@ -0,0 +1,47 @@
+"""
+Group membership checks for sockets and views.
+
+Each user's set of group ids is kept in a per-worker ``TTLCache``, so
+"may this user see this group?" is a set lookup once warm. ``m2m_changed``
+on ``Group.members`` (chat/signals.py) drops the entries of everyone whose
+membership changed.
+
+Other workers only notice a change when their entry expires, after
+``CHAT_MEMBERSHIP_TTL`` seconds. A refusal is therefore re-checked against
+the database before it stands: someone just added gets in at once, while a
+removal reaches the other workers within the TTL.
+"""
+from django.conf import settings
+
+from chat.cache import TTLCache
+from chat.db import database_sync_to_async
+from chat.models import Group
+
+# user id -> frozenset of group ids
+memberships = TTLCache(maxsize=settings.CHAT_MEMBERSHIP_CACHE_SIZE, ttl=settings.CHAT_MEMBERSHIP_TTL)
+
+
+def _refresh(user_id) -> frozenset:
+    group_ids = frozenset(
+        Group.members.through.objects.filter(user_id=user_id).values_list("group_id", flat=True)
+    )
+    memberships.set(user_id, group_ids)
+    return group_ids
+
+
+def _cached(user_id, group_id) -> bool:
+    group_ids = memberships.get(user_id)
+    return group_ids is not None and group_id in group_ids
+
+
+def is_member(user_id, group_id) -> bool:
+    return _cached(user_id, group_id) or group_id in _refresh(user_id)
+
+
+async def ais_member(user_id, group_id) -> bool:
+    return _cached(user_id, group_id) or group_id in await database_sync_to_async(_refresh)(user_id)
+
+
+def forget(user_ids):
+    for user_id in user_ids:
+        memberships.invalidate(user_id)
@@ -0,0 +1,248 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Each thread updates its own shard of a metric, so the hot path (an event
+loop thread or a DB thread) never takes a lock. A lock is only taken the
+first time a thread touches a metric, to register its shard. Scrapes sum
+the shards. Every daphne worker exports its own numbers on ``/metrics/``,
+which only answers scrapers bearing ``CHAT_METRICS_TOKEN``.
+"""
+import bisect
+import functools
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append(shard)
+            return shard
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in list(self._shards):
+            for labels, value in dict(shard).items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = self.header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Either moved with inc/dec, or read from ``callback`` at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        super().__init__(name, help, labelnames)
+        self.callback = callback
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def values(self) -> dict:
+        if self.callback is not None:
+            return {(): self.callback()}
+        return super().values()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket counts, then +Inf, then sum.
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        totals = {}
+        for shard in list(self._shards):
+            for labels, state in dict(shard).items():
+                total = totals.setdefault(labels, [0] * len(state))
+                for i, value in enumerate(state):
+                    total[i] += value
+
+        lines = self.header()
+        for labels, state in sorted(totals.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                le = _labels(self.labelnames, labels, [("le", bound)])
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            base = _labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{base} {state[-1]}")
+            lines.append(f"{self.name}_count{base} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# ============================
+# Metrics
+# ============================
+ws_connects = Counter("chat_ws_connects_total", "Websocket connections accepted.", ["consumer"])
+ws_disconnects = Counter("chat_ws_disconnects_total", "Websocket connections closed.", ["consumer"])
+ws_open = Gauge("chat_ws_open", "Websocket connections currently open.", ["consumer"])
+ws_frames = Counter("chat_ws_frames_received_total", "Frames received from clients.", ["consumer", "type"])
+ws_frames_limited = Counter(
+    "chat_ws_frames_limited_total", "Frames deferred or dropped by rate limits.", ["consumer", "type", "action"]
+)
+call_frames_dropped = Counter(
+    "chat_call_frames_dropped_total", "Call signaling frames dropped because their call is not live.", ["type", "direction"]
+)
+calls_ended = Counter("chat_calls_ended_total", "Calls ended, by how they ended (counted at each end).", ["reason"])
+db_seconds = Histogram("chat_db_seconds", "Time spent in database calls made from async code.", ["op"])
+messages_persisted = Counter(
+    "chat_messages_persisted_total",
+    "Messages saved by the write-behind pipeline (divide chat_db_seconds{op=\"persist_batch\"} by this).",
+)
+group_send_seconds = Histogram("chat_group_send_seconds", "Channel-layer group_send latency.")
+view_seconds = Histogram("chat_view_seconds", "HTTP request time by view, rendering included.", ["view"])
+
+
+def frame_type(msg_type, known) -> str:
+    """Label for a client-supplied frame type, keeping cardinality bounded."""
+    if msg_type is None:
+        return "none"
+    return msg_type if msg_type in known else "other"
+
+
+def timed_db(func):
+    """Wrap a sync DB function so each call lands in ``chat_db_seconds``."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with db_seconds.time(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+async def group_send(layer, group, message):
+    with group_send_seconds.time():
+        await layer.group_send(group, message)
+
+
+def layer_queue_depth() -> int:
+    """Messages waiting in this process's channel-layer receive queues."""
+    from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+
+    # Only look at a layer that already exists; a scrape should not create one.
+    layer = channel_layers.backends.get(DEFAULT_CHANNEL_LAYER)
+    # InMemoryChannelLayer keeps ``channels``, RedisChannelLayer ``_buffers``.
+    queues = getattr(layer, "channels", None) or getattr(layer, "_buffers", None) or {}
+    return sum(queue.qsize() for queue in list(queues.values()))
+
+
+layer_queue = Gauge(
+    "chat_layer_queue_depth", "Channel-layer messages received but not yet consumed.", callback=layer_queue_depth
+)
+
+
+# ============================
+# Middleware
+# ============================
+def _view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    return match.url_name or "unnamed" if match else "unmatched"
+
+
+def MetricsMiddleware(get_response):
+    """Times every request by URL name (inbox, chatroom, ...)."""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            start = time.perf_counter()
+            response = await get_response(request)
+            view_seconds.observe(time.perf_counter() - start, _view_name(request))
+            return response
+
+        return markcoroutinefunction(middleware)
+
+    def middleware(request):
+        start = time.perf_counter()
+        response = get_response(request)
+        view_seconds.observe(time.perf_counter() - start, _view_name(request))
+        return response
+
+    return middleware
+
+
+MetricsMiddleware.sync_capable = True
+MetricsMiddleware.async_capable = True
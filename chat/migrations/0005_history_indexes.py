@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:17
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0004_delete_profile"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="group",
+            name="members",
+            field=models.ManyToManyField(
+                related_name="chat_groups", to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AlterField(
+            model_name="groupmessage",
+            name="group",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="messages",
+                to="chat.group",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="groupmessage",
+            name="sender",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="group_messages",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(
+                fields=["group", "timestamp"], name="chat_gmsg_group_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "receiver", "timestamp"], name="chat_msg_pair_ts_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    Conversation = apps.get_model("chat", "Conversation")
+    db = schema_editor.connection.alias
+
+    # Keep only the newest message per (owner, peer); memory is O(conversations).
+    latest = {}
+    for message in (
+        Message.objects.using(db).order_by("timestamp", "id").iterator(chunk_size=2000)
+    ):
+        latest[(message.sender_id, message.receiver_id)] = message
+        latest[(message.receiver_id, message.sender_id)] = message
+
+    Conversation.objects.using(db).bulk_create(
+        [
+            Conversation(
+                owner_id=owner_id,
+                peer_id=peer_id,
+                last_message_id=message.id,
+                preview=message.text[:100],
+                last_from_owner=message.sender_id == owner_id,
+                last_timestamp=message.timestamp,
+            )
+            for (owner_id, peer_id), message in latest.items()
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0005_history_indexes"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Conversation",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("preview", models.CharField(blank=True, max_length=100)),
+                ("last_from_owner", models.BooleanField(default=False)),
+                ("last_timestamp", models.DateTimeField()),
+                ("unread_count", models.PositiveIntegerField(default=0)),
+                (
+                    "last_message",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="chat.message",
+                    ),
+                ),
+                (
+                    "owner",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="conversations",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "peer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["owner", "-last_timestamp"],
+                        name="chat_conv_owner_recent_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="conversation",
+            constraint=models.UniqueConstraint(
+                fields=("owner", "peer"), name="chat_conversation_pair_uniq"
+            ),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
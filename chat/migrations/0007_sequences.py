@@ -0,0 +1,83 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:38
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _number(queryset, key):
+    """Assign seq in (timestamp, id) order per room; returns {room: last}."""
+    last = {}
+    batch = []
+    for message in queryset.order_by("timestamp", "id").iterator(chunk_size=2000):
+        room = key(message)
+        message.seq = last[room] = last.get(room, 0) + 1
+        batch.append(message)
+        if len(batch) >= 2000:
+            queryset.bulk_update(batch, ["seq"])
+            batch = []
+    queryset.bulk_update(batch, ["seq"])
+    return last
+
+
+def backfill_sequences(apps, schema_editor):
+    Message = apps.get_model("chat", "Message")
+    GroupMessage = apps.get_model("chat", "GroupMessage")
+    RoomSequence = apps.get_model("chat", "RoomSequence")
+    db = schema_editor.connection.alias
+
+    last = _number(
+        Message.objects.using(db).only("id", "sender_id", "receiver_id", "timestamp"),
+        lambda m: "dm:%d:%d" % tuple(sorted((m.sender_id, m.receiver_id))),
+    )
+    last.update(
+        _number(
+            GroupMessage.objects.using(db).only("id", "group_id", "timestamp"),
+            lambda m: "group:%d" % m.group_id,
+        )
+    )
+    RoomSequence.objects.using(db).bulk_create(
+        [RoomSequence(room=room, last=value) for room, value in last.items()],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0006_conversation"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="RoomSequence",
+            fields=[
+                (
+                    "room",
+                    models.CharField(max_length=64, primary_key=True, serialize=False),
+                ),
+                ("last", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="groupmessage",
+            name="seq",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="message",
+            name="seq",
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="groupmessage",
+            index=models.Index(fields=["group", "seq"], name="chat_gmsg_group_seq_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["sender", "receiver", "seq"], name="chat_msg_pair_seq_idx"
+            ),
+        ),
+        migrations.RunPython(backfill_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+from django.db import OperationalError, migrations
+
+
+def create_search_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "sqlite":
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE chat_search USING fts5("
+                "text, scope, kind UNINDEXED, message_id UNINDEXED, "
+                # Prefix indexes keep search-as-you-type ("piz"*) fast.
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5; chat.search falls back to a scan.
+            return
+        schema_editor.execute(
+            "INSERT INTO chat_search (text, scope, kind, message_id) "
+            "SELECT text, 'u' || sender_id || ' u' || receiver_id, 'm', id FROM chat_message"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_search (text, scope, kind, message_id) "
+            "SELECT text, 'g' || group_id, 'g', id FROM chat_groupmessage"
+        )
+        # Merge the segments left by the bulk load into one b-tree.
+        schema_editor.execute("INSERT INTO chat_search (chat_search) VALUES ('optimize')")
+    elif connection.vendor == "postgresql":
+        schema_editor.execute(
+            "CREATE TABLE chat_search ("
+            "kind char(1) NOT NULL, message_id bigint NOT NULL, "
+            "scope text[] NOT NULL, doc tsvector NOT NULL, "
+            "PRIMARY KEY (kind, message_id))"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_search "
+            "SELECT 'm', id, ARRAY['u' || sender_id, 'u' || receiver_id], "
+            "to_tsvector('simple', text) FROM chat_message"
+        )
+        schema_editor.execute(
+            "INSERT INTO chat_search "
+            "SELECT 'g', id, ARRAY['g' || group_id], to_tsvector('simple', text) "
+            "FROM chat_groupmessage"
+        )
+        # Built after the bulk load, which is much faster than maintaining them.
+        schema_editor.execute("CREATE INDEX chat_search_doc_idx ON chat_search USING GIN (doc)")
+        schema_editor.execute("CREATE INDEX chat_search_scope_idx ON chat_search USING GIN (scope)")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ("sqlite", "postgresql"):
+        schema_editor.execute("DROP TABLE IF EXISTS chat_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0007_sequences"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
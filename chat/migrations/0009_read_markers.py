@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 09:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0008_search_index"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReadMarker",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("room", models.CharField(max_length=64)),
+                ("seq", models.PositiveBigIntegerField(default=0)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="read_markers",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["room", "seq"], name="chat_readmarker_room_idx"
+                    )
+                ],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="readmarker",
+            constraint=models.UniqueConstraint(
+                fields=("user", "room"), name="chat_readmarker_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.0.2 on 2026-10-18 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("chat", "0009_read_markers"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PendingDeletion",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("requested_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ArchiveBlock",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("room", models.CharField(max_length=64)),
+                ("first_seq", models.PositiveBigIntegerField()),
+                ("last_seq", models.PositiveBigIntegerField()),
+                ("first_timestamp", models.DateTimeField()),
+                ("last_timestamp", models.DateTimeField()),
+                ("count", models.PositiveIntegerField()),
+                ("senders", models.TextField()),
+                ("data", models.BinaryField()),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["room", "last_seq"], name="chat_archive_room_seq_idx"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 11:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chat", "0011_attachments"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="attachment",
+            name="archived_room",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
@@ -1,11 +1,107 @@
-from django.db import models
+import logging
+
+from django.db import DatabaseError, IntegrityError, models, transaction
 from django.contrib.auth.models import User
 
+logger = logging.getLogger(__name__)
+
+
+class RoomSequenceManager(models.Manager):
+    def allocate(self, room, count=1) -> int:
+        """Reserve ``count`` consecutive numbers in ``room``; returns the first."""
+        with transaction.atomic():
+            # The UPDATE takes the row lock before we read the new value back.
+            rows = self.filter(room=room)
+            if not rows.update(last=models.F("last") + count):
+                try:
+                    with transaction.atomic():
+                        self.create(room=room, last=count)
+                    return 1
+                except IntegrityError:
+                    rows.update(last=models.F("last") + count)
+            return rows.values_list("last", flat=True).get() - count + 1
+
+    def assign(self, messages):
+        """Number every unsequenced message, in list order within each room."""
+        by_room = {}
+        for message in messages:
+            if message.seq is None:
+                by_room.setdefault(message.sequence_key, []).append(message)
+        for room, pending in by_room.items():
+            first = self.allocate(room, len(pending))
+            for offset, message in enumerate(pending):
+                message.seq = first + offset
+
+
+class RoomSequence(models.Model):
+    """Last sequence number handed out in a conversation or group."""
+
+    room = models.CharField(max_length=64, primary_key=True)
+    last = models.PositiveBigIntegerField(default=0)
+
+    objects = RoomSequenceManager()
+
+    @staticmethod
+    def direct_key(user_a_id, user_b_id) -> str:
+        low, high = sorted((user_a_id, user_b_id))
+        return f"dm:{low}:{high}"
+
+    @staticmethod
+    def group_key(group_id) -> str:
+        return f"group:{group_id}"
+
+    def __str__(self):
+        return f"{self.room}: {self.last}"
+
+
+class Attachment(models.Model):
+    """
+    One uploaded file. The bytes live once per distinct content, at a path
+    derived from ``sha256`` (see chat/attachments.py), however many
+    attachments share them.
+    """
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name="attachments")
+    sha256 = models.CharField(max_length=64, db_index=True)
+    name = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    # Filled in once a thumbnail has been made (images only, needs Pillow).
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    has_thumbnail = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+    # RoomSequence key of the room once the message carrying it is archived.
+    archived_room = models.CharField(max_length=64, blank=True, default="")
+
+    def __str__(self):
+        return f"{self.name} ({self.sha256[:12]})"
+
+
 class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="sent_messages")
     receiver = models.ForeignKey(User, on_delete=models.CASCADE, related_name="received_messages")
     text = models.TextField()
+    attachment = models.ForeignKey(Attachment, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Position in the conversation, assigned on insert (see RoomSequence).
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Backs keyset pagination of a conversation, one direction at a time.
+            models.Index(fields=["sender", "receiver", "timestamp"], name="chat_msg_pair_ts_idx"),
+            # Backs resuming a conversation after a sequence number.
+            models.Index(fields=["sender", "receiver", "seq"], name="chat_msg_pair_seq_idx"),
+        ]
+
+    @property
+    def sequence_key(self) -> str:
+        return RoomSequence.direct_key(self.sender_id, self.receiver_id)
+
+    def preview(self) -> str:
+        if self.text or self.attachment_id is None:
+            return self.text
+        return f"📎 {self.attachment.name}"
 
     def __str__(self):
         return f"{self.sender.username} → {self.receiver.username}: {self.text[:20]}"
@@ -24,7 +120,183 @@ class GroupMessage(models.Model):
     group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name="messages")
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="group_messages")
     text = models.TextField()
+    attachment = models.ForeignKey(Attachment, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
     timestamp = models.DateTimeField(auto_now_add=True)
+    seq = models.PositiveBigIntegerField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["group", "timestamp"], name="chat_gmsg_group_ts_idx"),
+            models.Index(fields=["group", "seq"], name="chat_gmsg_group_seq_idx"),
+        ]
+
+    @property
+    def sequence_key(self) -> str:
+        return RoomSequence.group_key(self.group_id)
 
     def __str__(self):
         return f"{self.sender.username} in {self.group.name}: {self.text[:20]}"
+
+
+class ConversationManager(models.Manager):
+    def record_message(self, message):
+        self.record_messages([message])
+
+    def record_messages(self, messages):
+        """
+        Fold newly created direct messages into both participants' summaries.
+
+        Messages are coalesced per (owner, peer) first, so a batch costs one
+        UPDATE per side of each conversation it touches; a row is only
+        inserted the first time two users talk.
+        """
+        latest = {}
+        unread = {}
+        for message in messages:
+            sides = [(message.sender_id, message.receiver_id, 0)]
+            if message.receiver_id != message.sender_id:
+                sides.append((message.receiver_id, message.sender_id, 1))
+            for owner_id, peer_id, increment in sides:
+                latest[(owner_id, peer_id)] = message
+                unread[(owner_id, peer_id)] = unread.get((owner_id, peer_id), 0) + increment
+
+        for (owner_id, peer_id), message in latest.items():
+            summary = {
+                "last_message_id": message.id,
+                "preview": message.preview()[:Conversation.PREVIEW_LENGTH],
+                "last_from_owner": owner_id == message.sender_id,
+                "last_timestamp": message.timestamp,
+            }
+            increment = unread[(owner_id, peer_id)]
+            rows = self.filter(owner_id=owner_id, peer_id=peer_id)
+            if rows.update(unread_count=models.F("unread_count") + increment, **summary):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(owner_id=owner_id, peer_id=peer_id, unread_count=increment, **summary)
+            except IntegrityError:
+                # Another writer created the row first; fall back to the update.
+                rows.update(unread_count=models.F("unread_count") + increment, **summary)
+
+    def mark_read(self, owner, peer):
+        self.filter(owner=owner, peer=peer, unread_count__gt=0).update(unread_count=0)
+
+
+class Conversation(models.Model):
+    """One row per (owner, peer) pair summarising their latest direct message."""
+
+    PREVIEW_LENGTH = 100
+
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="conversations")
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+")
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, related_name="+")
+    preview = models.CharField(max_length=PREVIEW_LENGTH, blank=True)
+    last_from_owner = models.BooleanField(default=False)
+    last_timestamp = models.DateTimeField()
+    unread_count = models.PositiveIntegerField(default=0)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "peer"], name="chat_conversation_pair_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-last_timestamp"], name="chat_conv_owner_recent_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.owner.username} ↔ {self.peer.username}"
+
+
+class ReadMarkerManager(models.Manager):
+    def advance(self, marks):
+        """
+        Raise each ``{(user_id, room): seq}`` marker to ``seq``; markers never
+        move backwards. One UPDATE per marker however many messages it covers.
+        A marker that can't be written is logged and skipped, not the batch.
+        """
+        for (user_id, room), seq in marks.items():
+            try:
+                self._advance(user_id, room, seq)
+            except (DatabaseError, OverflowError):
+                logger.exception("Could not move %s's read marker in %s to %s", user_id, room, seq)
+
+    def _advance(self, user_id, room, seq):
+        with transaction.atomic():
+            if self.filter(user_id=user_id, room=room, seq__lt=seq).update(seq=seq):
+                return
+            try:
+                with transaction.atomic():
+                    self.create(user_id=user_id, room=room, seq=seq)
+            except IntegrityError:
+                # Already at or past ``seq``.
+                pass
+
+
+class ReadMarker(models.Model):
+    """How far a user has read in a conversation or group, as a sequence number."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="read_markers")
+    room = models.CharField(max_length=64)  # RoomSequence key
+    seq = models.PositiveBigIntegerField(default=0)
+
+    objects = ReadMarkerManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "room"], name="chat_readmarker_uniq"),
+        ]
+        # Loading everyone's markers for a room (group "seen by").
+        indexes = [
+            models.Index(fields=["room", "seq"], name="chat_readmarker_room_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} read {self.room} to {self.seq}"
+
+
+class ArchiveBlock(models.Model):
+    """
+    A run of archived messages from one room (see chat/archive.py), packed
+    as zlib-compressed JSON. Rows are ``[id, seq, timestamp, sender_id,
+    sender_username, text, attachment_id]`` in seq order (blocks written
+    before attachments existed lack the last column).
+    """
+
+    room = models.CharField(max_length=64)  # RoomSequence key
+    first_seq = models.PositiveBigIntegerField()
+    last_seq = models.PositiveBigIntegerField()
+    first_timestamp = models.DateTimeField()
+    last_timestamp = models.DateTimeField()
+    count = models.PositiveIntegerField()
+    # " 3 17 42 ": who wrote rows in this block, for account deletion.
+    senders = models.TextField()
+    data = models.BinaryField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["room", "last_seq"], name="chat_archive_room_seq_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.room} {self.first_seq}-{self.last_seq}"
+
+
+class PendingDeletion(models.Model):
+    """An account being removed in the background (see chat/deletion.py)."""
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="+")
+    requested_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"delete {self.user_id}"
+
+
+class Profile(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="profile")
+    bio = models.TextField(blank=True)
+    avatar = models.ForeignKey(Attachment, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+
+    def __str__(self):
+        return f"Profile of {self.user}"
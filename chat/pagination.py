@@ -0,0 +1,119 @@
+import base64
+import heapq
+from datetime import datetime
+
+from django.db.models import Q
+
+from chat import attachments
+
+# How many messages a chat page renders up front, and the most a single
+# history request may ask for.
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# ============================
+# Cursors
+# ============================
+def encode_cursor(message) -> str:
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Return ``(timestamp, id)`` for a cursor, raising ValueError if it is malformed."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        timestamp, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(timestamp), int(pk)
+    except (TypeError, ValueError, UnicodeDecodeError) as exc:
+        raise ValueError("invalid cursor") from exc
+
+
+def parse_limit(value, default=PAGE_SIZE) -> int:
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+# ============================
+# Keyset pages
+# ============================
+def _older_than(queryset, before):
+    if before is None:
+        return queryset
+    timestamp, pk = before
+    return queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+
+def _newest_first(queryset, before, limit):
+    queryset = _older_than(queryset, before).order_by("-timestamp", "-id")
+    return list(queryset.select_related("sender", "attachment")[: limit + 1])
+
+
+def _page(rows, limit):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    next_cursor = encode_cursor(rows[0]) if has_more and rows else None
+    return rows, next_cursor
+
+
+def conversation_page(messages, user, other_user, before=None, limit=PAGE_SIZE):
+    """
+    Latest ``limit`` direct messages between two users, oldest first.
+
+    Each direction is its own range scan on the (sender, receiver, timestamp)
+    index and the two runs are merged here, so the cost depends on ``limit``
+    rather than on how long the conversation is.
+    """
+    sent = _newest_first(messages.filter(sender=user, receiver=other_user), before, limit)
+    received = []
+    # Notes to self match both directions; read them once.
+    if other_user != user:
+        received = _newest_first(messages.filter(sender=other_user, receiver=user), before, limit)
+    key = lambda m: (m.timestamp, m.id)
+    rows = list(heapq.merge(sent, received, key=key, reverse=True))[: limit + 1]
+    return _page(rows, limit)
+
+
+def group_page(messages, before=None, limit=PAGE_SIZE):
+    """Latest ``limit`` messages of a group queryset, oldest first."""
+    return _page(_newest_first(messages, before, limit), limit)
+
+
+# ============================
+# Resume after a sequence number
+# ============================
+def conversation_since(messages, user_id, peer_id, after, limit):
+    """
+    Up to ``limit`` direct messages with ``seq > after``, in seq order.
+
+    Like ``conversation_page`` this merges one range scan per direction, this
+    time on the (sender, receiver, seq) index.
+    """
+    def run(sender_id, receiver_id):
+        queryset = messages.filter(sender_id=sender_id, receiver_id=receiver_id, seq__gt=after)
+        return list(queryset.select_related("sender", "attachment").order_by("seq")[:limit])
+
+    sent = run(user_id, peer_id)
+    received = run(peer_id, user_id) if peer_id != user_id else []
+    return list(heapq.merge(sent, received, key=lambda m: m.seq))[:limit]
+
+
+def group_since(messages, after, limit):
+    return list(messages.filter(seq__gt=after).select_related("sender", "attachment").order_by("seq")[:limit])
+
+
+def message_to_dict(message) -> dict:
+    return {
+        "id": message.id,
+        "seq": message.seq,
+        "sender": message.sender.username,
+        "text": message.text,
+        "attachment": attachments.to_dict(message.attachment),
+        "timestamp": message.timestamp.isoformat(),
+    }
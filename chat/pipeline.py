@@ -0,0 +1,145 @@
+"""
+Write-behind persistence for messages arriving over the websocket.
+
+``ChatConsumer`` broadcasts a message straight away under a provisional
+``client_id`` and hands it to the ``MessageWriter`` of its event loop. The
+writer coalesces everything queued within ``CHAT_WRITE_WINDOW`` seconds (up
+to ``CHAT_WRITE_BATCH_SIZE``) into one transaction of ``bulk_create`` calls,
+then tells each room which durable id every provisional message received.
+
+The queue is bounded by ``CHAT_WRITE_MAX_PENDING``; when it is full
+``submit`` waits, which stalls only the sockets that keep sending.
+"""
+import asyncio
+import logging
+import weakref
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from chat import metrics
+from chat.db import database_sync_to_async
+from chat.dispatch import mark_dispatched
+from chat.fanout import frame_event
+from chat.models import Conversation, GroupMessage, Message, RoomSequence
+from chat.search import index_messages
+
+logger = logging.getLogger(__name__)
+
+
+class PendingMessage:
+    __slots__ = ("room", "client_id", "sender", "receiver_id", "group_id", "text", "attachment")
+
+    def __init__(self, room, client_id, sender, text, receiver_id=None, group_id=None, attachment=None):
+        self.room = room
+        self.client_id = client_id
+        self.sender = sender
+        self.receiver_id = receiver_id
+        self.group_id = group_id
+        self.text = text
+        self.attachment = attachment
+
+    def to_model(self):
+        if self.group_id is not None:
+            return GroupMessage(group_id=self.group_id, sender=self.sender, text=self.text, attachment=self.attachment)
+        return Message(sender=self.sender, receiver_id=self.receiver_id, text=self.text, attachment=self.attachment)
+
+
+def persist_batch(batch):
+    """Insert a batch in one transaction; returns saved instances in batch order."""
+    instances = [pending.to_model() for pending in batch]
+    direct = [m for m in instances if isinstance(m, Message)]
+    grouped = [m for m in instances if isinstance(m, GroupMessage)]
+
+    with transaction.atomic():
+        # bulk_create sends no pre_save/post_save, so number, summarise and
+        # index the messages here.
+        RoomSequence.objects.assign(instances)
+        if direct:
+            Message.objects.bulk_create(direct)
+            Conversation.objects.record_messages(direct)
+        if grouped:
+            GroupMessage.objects.bulk_create(grouped)
+        index_messages(instances)
+
+    for instance in instances:
+        mark_dispatched(instance)
+    return instances
+
+
+class MessageWriter:
+    def __init__(self, batch_size=200, window=0.01, max_pending=5000):
+        self.batch_size = batch_size
+        self.window = window
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+
+    async def submit(self, pending):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        await self.queue.put(pending)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.batch_size:
+                if not self.queue.empty():
+                    batch.append(self.queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        layer = get_channel_layer()
+        by_room = {}
+        try:
+            instances = await database_sync_to_async(persist_batch)(batch)
+        except Exception:
+            logger.exception("Failed to persist %d queued messages", len(batch))
+            for pending in batch:
+                by_room.setdefault(pending.room, []).append(pending.client_id)
+            for room, client_ids in by_room.items():
+                await metrics.group_send(layer, room, frame_event("chat_failed", {"type": "failed", "client_ids": client_ids}))
+            return
+        metrics.messages_persisted.inc(amount=len(instances))
+
+        for pending, instance in zip(batch, instances):
+            by_room.setdefault(pending.room, []).append({
+                "client_id": pending.client_id,
+                "id": instance.id,
+                "seq": instance.seq,
+                "timestamp": instance.timestamp.isoformat(),
+            })
+        for room, confirmed in by_room.items():
+            await metrics.group_send(layer, room, frame_event("chat_confirm", {"type": "confirm", "messages": confirmed}))
+
+
+_writers = weakref.WeakKeyDictionary()
+
+metrics.Gauge(
+    "chat_write_queue_depth",
+    "Messages waiting for the write-behind pipeline.",
+    callback=lambda: sum(writer.queue.qsize() for writer in list(_writers.values())),
+)
+
+
+def get_writer() -> MessageWriter:
+    """The MessageWriter for the running event loop."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = MessageWriter(
+            batch_size=settings.CHAT_WRITE_BATCH_SIZE,
+            window=settings.CHAT_WRITE_WINDOW,
+            max_pending=settings.CHAT_WRITE_MAX_PENDING,
+        )
+    return writer
@@ -0,0 +1,217 @@
+"""
+Who is connected right now.
+
+Every websocket registers with its worker's ``PresenceTracker``. The
+tracker batches connects and disconnects for ``CHAT_PRESENCE_FLUSH``
+seconds, so a reconnect wave turns into one write. It also re-announces
+all of its sockets every ``CHAT_PRESENCE_TTL / 3`` seconds, and entries
+that are not refreshed expire. A worker that dies therefore stops
+counting as online after ``CHAT_PRESENCE_TTL`` seconds.
+
+Sockets are tracked under a key: the user id for chat sockets, and
+``call_key(user_id)`` for call sockets, so "can this user be rung" is
+asked of call sockets only.
+
+The backend comes from ``CHAT_PRESENCE``:
+
+* ``LocalPresence``: a process-local dict, enough for one worker.
+* ``RedisPresence``: one sorted set per user, ``<prefix>:<user_id>``,
+  holding channel names scored by expiry. A user is online when the set
+  has any score in the future. A bulk lookup is one pipelined ``ZCOUNT``
+  per user, sent in a single round trip.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from collections import Counter
+
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from chat.resp import LoopLocalPools
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# Backends
+# ============================
+class LocalPresence:
+    def __init__(self):
+        self._sockets = {}  # user_id -> {channel: expires}
+        self._lock = threading.Lock()
+
+    async def update(self, alive, gone, expires):
+        """Refresh ``alive`` [(user_id, channel)] until ``expires``; drop ``gone``."""
+        with self._lock:
+            for user_id, channel in alive:
+                self._sockets.setdefault(user_id, {})[channel] = expires
+            for user_id, channel in gone:
+                sockets = self._sockets.get(user_id)
+                if sockets is not None:
+                    sockets.pop(channel, None)
+                    if not sockets:
+                        del self._sockets[user_id]
+
+    async def online(self, user_ids):
+        now = time.time()
+        with self._lock:
+            return {
+                user_id for user_id in user_ids
+                if any(expires > now for expires in self._sockets.get(user_id, {}).values())
+            }
+
+
+class RedisPresence:
+    def __init__(self, url, prefix="presence", pool_size=10):
+        self.prefix = prefix
+        self.pools = LoopLocalPools(url, max_size=pool_size)
+
+    def _key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+    async def update(self, alive, gone, expires):
+        by_user = {}
+        for user_id, channel in alive:
+            by_user.setdefault(user_id, []).append(channel)
+
+        now = time.time()
+        ttl = max(1, int(expires - now) + 1)
+        commands = []
+        for user_id, channels in by_user.items():
+            key = self._key(user_id)
+            pairs = [x for channel in channels for x in (expires, channel)]
+            commands += [
+                ("ZADD", key, *pairs),
+                ("ZREMRANGEBYSCORE", key, 0, now),
+                ("EXPIRE", key, ttl),
+            ]
+        for user_id, channel in gone:
+            commands.append(("ZREM", self._key(user_id), channel))
+        if commands:
+            await self.pools.get().pipeline(commands)
+
+    async def online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        now = time.time()
+        counts = await self.pools.get().pipeline([
+            ("ZCOUNT", self._key(user_id), f"({now}", "+inf") for user_id in user_ids
+        ])
+        return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = settings.CHAT_PRESENCE
+        _backend = import_string(config["BACKEND"])(**config.get("CONFIG", {}))
+    return _backend
+
+
+# ============================
+# Per-worker tracker
+# ============================
+class PresenceTracker:
+    def __init__(self, backend, ttl=60, flush_interval=0.5):
+        self.backend = backend
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.sockets = {}  # channel -> user_id, every socket on this worker
+        self.users = Counter()
+        self._joined = {}
+        self._left = {}
+        self._task = None
+
+    def connect(self, user_id, channel):
+        self.sockets[channel] = user_id
+        self.users[user_id] += 1
+        self._left.pop(channel, None)
+        self._joined[channel] = user_id
+        self._ensure_running()
+
+    def disconnect(self, user_id, channel):
+        if self.sockets.pop(channel, None) is None:
+            return
+        self.users[user_id] -= 1
+        if not self.users[user_id]:
+            del self.users[user_id]
+        # A socket that never made it to the backend needs no removal.
+        if self._joined.pop(channel, None) is None:
+            self._left[channel] = user_id
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        refreshed = loop.time()
+        while self.sockets or self._joined or self._left:
+            await asyncio.sleep(self.flush_interval)
+            if loop.time() - refreshed >= self.ttl / 3:
+                joined = dict(self.sockets)
+                refreshed = loop.time()
+            else:
+                joined = self._joined
+            left = self._left
+            self._joined, self._left = {}, {}
+            if not joined and not left:
+                continue
+            try:
+                await self.backend.update(
+                    [(user_id, channel) for channel, user_id in joined.items()],
+                    [(user_id, channel) for channel, user_id in left.items()],
+                    time.time() + self.ttl,
+                )
+            except Exception:
+                logger.exception("Presence update failed; retrying with a full refresh")
+                self._left.update(left)
+                refreshed = float("-inf")
+
+    async def online(self, user_ids):
+        local = {user_id for user_id in user_ids if user_id in self.users}
+        rest = [user_id for user_id in user_ids if user_id not in local]
+        return local | await self.backend.online(rest)
+
+
+_trackers = weakref.WeakKeyDictionary()
+
+
+def get_tracker() -> PresenceTracker:
+    """The PresenceTracker for the running event loop."""
+    loop = asyncio.get_running_loop()
+    tracker = _trackers.get(loop)
+    if tracker is None:
+        tracker = _trackers[loop] = PresenceTracker(
+            get_backend(),
+            ttl=settings.CHAT_PRESENCE_TTL,
+            flush_interval=settings.CHAT_PRESENCE_FLUSH,
+        )
+    return tracker
+
+
+# ============================
+# Queries
+# ============================
+def call_key(user_id) -> str:
+    """Presence key of a user's call sockets."""
+    return f"call:{user_id}"
+
+
+async def aonline(user_ids) -> set:
+    """The subset of ``user_ids`` with at least one live socket."""
+    return await get_tracker().online(list(user_ids))
+
+
+def online(user_ids) -> set:
+    """Sync variant for views; asks the backend directly."""
+    return async_to_sync(get_backend().online)(list(user_ids))
@@ -0,0 +1,218 @@
+"""
+Flood protection for websocket frames.
+
+Two limits apply to every frame a client sends:
+
+* Per socket: a token bucket per frame type, from ``CHAT_RATE_LIMITS``
+  (``type -> (per_second, burst)``, ``"*"`` for anything unlisted). Chat
+  messages over the limit are deferred for up to ``CHAT_RATE_MAX_DELAY``
+  seconds, which only slows the flooding socket; anything else over the
+  limit is dropped.
+* Per user: at most ``CHAT_USER_RATE_LIMIT`` frames per
+  ``CHAT_USER_RATE_WINDOW`` seconds across all of the user's sockets on all
+  workers. Like presence, each worker's ``UserLimiter`` batches its counts
+  for ``CHAT_PRESENCE_FLUSH`` seconds, so the hot path never waits on
+  I/O; the cluster total it reads back may be that much stale.
+
+The backend comes from ``CHAT_RATE_BACKEND``:
+
+* ``LocalQuota``: a process-local dict, enough for one worker.
+* ``RedisQuota``: one counter per user and window, ``<prefix>:<user_id>:<window>``,
+  updated with a pipelined ``INCRBY`` per user in a single round trip.
+"""
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from chat.resp import LoopLocalPools
+
+logger = logging.getLogger(__name__)
+
+
+# ============================
+# Per-socket buckets
+# ============================
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def delay(self, cost=1) -> float:
+        """Take ``cost`` tokens; returns how many seconds early that was (0 if in budget)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        self.tokens -= cost
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate if self.rate else float("inf")
+
+    def refund(self, cost=1):
+        self.tokens += cost
+
+
+class SocketLimiter:
+    """The token buckets of one socket, created on first use per frame type."""
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}
+
+    def delay(self, msg_type) -> float:
+        key = msg_type if msg_type in self.limits else "*"
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(*self.limits[key])
+        return bucket.delay()
+
+    def refund(self, msg_type):
+        key = msg_type if msg_type in self.limits else "*"
+        self.buckets[key].refund()
+
+
+# ============================
+# Per-user backends
+# ============================
+class LocalQuota:
+    def __init__(self):
+        self._counts = {}  # (user_id, window) -> frames
+        self._lock = threading.Lock()
+
+    async def add(self, counts, window, ttl):
+        """Add ``counts`` {user_id: frames} to ``window``; returns the new totals."""
+        with self._lock:
+            for key in [key for key in self._counts if key[1] < window]:
+                del self._counts[key]
+            totals = {}
+            for user_id, count in counts.items():
+                key = (user_id, window)
+                totals[user_id] = self._counts[key] = self._counts.get(key, 0) + count
+            return totals
+
+
+class RedisQuota:
+    def __init__(self, url, prefix="ratelimit", pool_size=10):
+        self.prefix = prefix
+        self.pools = LoopLocalPools(url, max_size=pool_size)
+
+    async def add(self, counts, window, ttl):
+        user_ids = list(counts)
+        commands = []
+        for user_id in user_ids:
+            key = f"{self.prefix}:{user_id}:{window}"
+            commands += [("INCRBY", key, counts[user_id]), ("EXPIRE", key, ttl)]
+        replies = await self.pools.get().pipeline(commands)
+        return {user_id: int(total) for user_id, total in zip(user_ids, replies[::2])}
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = settings.CHAT_RATE_BACKEND
+        _backend = import_string(config["BACKEND"])(**config.get("CONFIG", {}))
+    return _backend
+
+
+# ============================
+# Per-worker user limiter
+# ============================
+class UserLimiter:
+    def __init__(self, backend, limit=600, window=60, flush_interval=0.5):
+        self.backend = backend
+        self.limit = limit
+        self.window = window
+        self.flush_interval = flush_interval
+        self.current = None
+        self.known = {}  # user_id -> cluster total at the last flush
+        self.pending = {}  # user_id -> frames not yet flushed
+        self._task = None
+
+    def allow(self, user_id) -> bool:
+        window = int(time.time() // self.window)
+        if window != self.current:
+            self.current, self.known, self.pending = window, {}, {}
+        pending = self.pending.get(user_id, 0)
+        if self.known.get(user_id, 0) + pending >= self.limit:
+            return False
+        self.pending[user_id] = pending + 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return True
+
+    async def _run(self):
+        while self.pending:
+            await asyncio.sleep(self.flush_interval)
+            window, pending = self.current, self.pending
+            self.pending = {}
+            try:
+                totals = await self.backend.add(pending, window, self.window * 2)
+            except Exception:
+                logger.exception("Rate limit update failed; counting locally")
+                totals = {user_id: self.known.get(user_id, 0) + count for user_id, count in pending.items()}
+            if window == self.current:
+                self.known.update(totals)
+
+
+_limiters = weakref.WeakKeyDictionary()
+
+
+def get_limiter() -> UserLimiter:
+    """The UserLimiter for the running event loop."""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = UserLimiter(
+            get_backend(),
+            limit=settings.CHAT_USER_RATE_LIMIT,
+            window=settings.CHAT_USER_RATE_WINDOW,
+            flush_interval=settings.CHAT_PRESENCE_FLUSH,
+        )
+    return limiter
+
+
+# ============================
+# ICE coalescing
+# ============================
+class Coalescer:
+    """
+    Collects frames per target for ``delay`` seconds and hands each batch to
+    ``flush(target, frames)``, so a burst of ICE candidates costs one
+    ``group_send`` instead of dozens.
+    """
+
+    def __init__(self, flush, delay=0.02):
+        self._flush = flush
+        self.delay = delay
+        self.pending = {}  # target -> [frames]
+
+    def add(self, target, frame):
+        frames = self.pending.get(target)
+        if frames is None:
+            self.pending[target] = [frame]
+            asyncio.get_running_loop().call_later(self.delay, self._fire, target)
+        else:
+            frames.append(frame)
+
+    def take(self, target) -> list:
+        """Frames still waiting for ``target``, so a later frame cannot overtake them."""
+        return self.pending.pop(target, [])
+
+    def _fire(self, target):
+        frames = self.take(target)
+        if frames:
+            asyncio.get_running_loop().create_task(self._flush(target, frames))
+
+    def cancel(self):
+        self.pending.clear()
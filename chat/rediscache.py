@@ -0,0 +1,98 @@
+"""
+Django cache backend on Redis, for state every worker must agree on.
+
+With ``REDIS_URL`` set it backs the "sessions" cache (settings), so a
+session flushed on one worker is gone for all of them. It speaks RESP
+through chat/resp.py rather than needing redis-py: sync calls use one
+blocking connection per thread, and ``aget``/``aget_many`` use the running
+loop's pool, so async code never waits on a socket in the event loop.
+
+Values are stored as JSON text (chat/jsonenc.py), so only JSON-serialisable
+values round-trip; session data always is (``SESSION_SERIALIZER``).
+"""
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from chat import jsonenc
+from chat.resp import LoopLocalPools, ThreadLocalConnections
+
+# Django builds a backend instance per thread and async context; the
+# connections behind them are shared per URL.
+_connections = {}
+_pools = {}
+
+
+class RedisCache(BaseCache):
+    def __init__(self, server, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        if server not in _connections:
+            _connections[server] = ThreadLocalConnections(server)
+            _pools[server] = LoopLocalPools(server, max_size=options.get("pool_size", 10))
+        self.connections = _connections[server]
+        self.pools = _pools[server]
+
+    def _expiry(self, timeout):
+        """SET options for ``timeout``, or None if the value must not be kept."""
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.default_timeout
+        if timeout is None:
+            return []
+        millis = int(timeout * 1000)
+        return ["PX", millis] if millis > 0 else None
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expiry = self._expiry(timeout)
+        if expiry is None:
+            return False
+        return self.connections.execute("SET", key, jsonenc.dumps(value), "NX", *expiry) is not None
+
+    def get(self, key, default=None, version=None):
+        raw = self.connections.execute("GET", self.make_and_validate_key(key, version=version))
+        return default if raw is None else jsonenc.loads(raw)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expiry = self._expiry(timeout)
+        if expiry is None:
+            self.connections.execute("DEL", key)
+        else:
+            self.connections.execute("SET", key, jsonenc.dumps(value), *expiry)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expiry = self._expiry(timeout)
+        if expiry is None:
+            return bool(self.connections.execute("DEL", key))
+        if not expiry:
+            return bool(self.connections.execute("PERSIST", key))
+        return bool(self.connections.execute("PEXPIRE", key, expiry[1]))
+
+    def delete(self, key, version=None):
+        return bool(self.connections.execute("DEL", self.make_and_validate_key(key, version=version)))
+
+    def has_key(self, key, version=None):
+        return bool(self.connections.execute("EXISTS", self.make_and_validate_key(key, version=version)))
+
+    def _found(self, keys, replies):
+        return {key: jsonenc.loads(raw) for key, raw in zip(keys, replies) if raw is not None}
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        commands = [("GET", self.make_and_validate_key(key, version=version)) for key in keys]
+        return self._found(keys, self.connections.pipeline(commands))
+
+    def clear(self):
+        # Only this cache's keys; the channel layer may share the database.
+        keys = self.connections.execute("KEYS", f"{self.key_prefix}:*")
+        if keys:
+            self.connections.execute("DEL", *keys)
+
+    async def aget(self, key, default=None, version=None):
+        raw = await self.pools.get().execute("GET", self.make_and_validate_key(key, version=version))
+        return default if raw is None else jsonenc.loads(raw)
+
+    async def aget_many(self, keys, version=None):
+        keys = list(keys)
+        commands = [("GET", self.make_and_validate_key(key, version=version)) for key in keys]
+        return self._found(keys, await self.pools.get().pipeline(commands))
@@ -0,0 +1,274 @@
+"""
+Minimal asyncio client for the Redis wire protocol (RESP2).
+
+Only what the channel layer needs: single commands, pipelines, and a small
+connection pool per event loop. Works against a real Redis server or the
+in-process stand-in in ``chat.fakeredis``. Sync code (the session cache,
+chat/cache.py) gets one blocking connection per thread instead.
+"""
+import asyncio
+import socket
+import threading
+import weakref
+from contextlib import asynccontextmanager
+from urllib.parse import unquote, urlparse
+
+
+class RedisError(Exception):
+    pass
+
+
+# ============================
+# Protocol
+# ============================
+def _encode_arg(arg) -> bytes:
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, float):
+        arg = repr(arg)
+    return str(arg).encode()
+
+
+def encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = _encode_arg(arg)
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by server")
+    kind, body = line[:1], line[1:-2]
+
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RedisError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length == -1:
+            return None
+        data = await reader.readexactly(length + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        count = int(body)
+        if count == -1:
+            return None
+        return [await read_reply(reader) for _ in range(count)]
+    raise RedisError(f"unexpected reply type {kind!r}")
+
+
+def read_reply_sync(reader):
+    """``read_reply`` for a blocking binary file, e.g. ``socket.makefile("rb")``."""
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("connection closed by server")
+    kind, body = line[:1], line[1:-2]
+
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        return RedisError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length == -1:
+            return None
+        data = reader.read(length + 2)
+        if len(data) < length + 2:
+            raise ConnectionError("connection closed by server")
+        return data[:-2].decode()
+    if kind == b"*":
+        count = int(body)
+        if count == -1:
+            return None
+        return [read_reply_sync(reader) for _ in range(count)]
+    raise RedisError(f"unexpected reply type {kind!r}")
+
+
+def parse_url(url: str) -> dict:
+    parsed = urlparse(url)
+    if parsed.scheme not in ("redis", ""):
+        raise ValueError(f"unsupported redis url scheme: {parsed.scheme}")
+    db = parsed.path.lstrip("/")
+    return {
+        "host": parsed.hostname or "localhost",
+        "port": parsed.port or 6379,
+        "db": int(db) if db else 0,
+        "password": unquote(parsed.password) if parsed.password else None,
+    }
+
+
+# ============================
+# Connections
+# ============================
+class RedisConnection:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host="localhost", port=6379, db=0, password=None):
+        reader, writer = await asyncio.open_connection(host, port)
+        conn = cls(reader, writer)
+        if password:
+            await conn.execute("AUTH", password)
+        if db:
+            await conn.execute("SELECT", db)
+        return conn
+
+    async def execute(self, *args):
+        self.writer.write(encode_command(*args))
+        await self.writer.drain()
+        reply = await read_reply(self.reader)
+        if isinstance(reply, RedisError):
+            raise reply
+        return reply
+
+    async def pipeline(self, commands):
+        """Send every command in one write and read all replies back."""
+        if not commands:
+            return []
+        self.writer.write(b"".join(encode_command(*cmd) for cmd in commands))
+        await self.writer.drain()
+        replies = [await read_reply(self.reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        try:
+            self.writer.close()
+        except RuntimeError:
+            # The loop that owned this stream has already been closed.
+            pass
+
+
+class ConnectionPool:
+    """Up to ``max_size`` reusable connections, bound to one event loop."""
+
+    def __init__(self, url, max_size=10):
+        self.options = parse_url(url)
+        self.max_size = max_size
+        self._idle = []
+        self._slots = asyncio.Semaphore(max_size)
+
+    async def open_connection(self):
+        return await RedisConnection.open(**self.options)
+
+    @asynccontextmanager
+    async def connection(self):
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else await self.open_connection()
+            try:
+                yield conn
+            except BaseException:
+                # State of the stream is unknown; never hand it out again.
+                conn.close()
+                raise
+            self._idle.append(conn)
+
+    async def execute(self, *args):
+        async with self.connection() as conn:
+            return await conn.execute(*args)
+
+    async def pipeline(self, commands):
+        async with self.connection() as conn:
+            return await conn.pipeline(commands)
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class LoopLocalPools:
+    """
+    One ConnectionPool per running event loop.
+
+    asyncio streams cannot be shared between loops, and ``async_to_sync``
+    calls from sync views each run on their own loop.
+    """
+
+    def __init__(self, url, max_size=10):
+        self.url = url
+        self.max_size = max_size
+        self._pools = weakref.WeakKeyDictionary()
+
+    def get(self) -> ConnectionPool:
+        loop = asyncio.get_running_loop()
+        pool = self._pools.get(loop)
+        if pool is None:
+            pool = self._pools[loop] = ConnectionPool(self.url, self.max_size)
+        return pool
+
+    def close(self):
+        for pool in list(self._pools.values()):
+            pool.close()
+        self._pools.clear()
+
+
+# ============================
+# Blocking connections
+# ============================
+class SyncConnection:
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = sock.makefile("rb")
+
+    @classmethod
+    def open(cls, host="localhost", port=6379, db=0, password=None, timeout=5):
+        conn = cls(socket.create_connection((host, port), timeout=timeout))
+        if password:
+            conn.execute("AUTH", password)
+        if db:
+            conn.execute("SELECT", db)
+        return conn
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+
+    def pipeline(self, commands):
+        if not commands:
+            return []
+        self.sock.sendall(b"".join(encode_command(*cmd) for cmd in commands))
+        replies = [read_reply_sync(self.reader) for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+class ThreadLocalConnections:
+    """One SyncConnection per thread, opened on first use."""
+
+    def __init__(self, url):
+        self.options = parse_url(url)
+        self._local = threading.local()
+
+    def pipeline(self, commands):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = SyncConnection.open(**self.options)
+        try:
+            return conn.pipeline(commands)
+        except RedisError:
+            # Every reply was read; the stream is still in step.
+            raise
+        except BaseException:
+            conn.close()
+            self._local.conn = None
+            raise
+
+    def execute(self, *args):
+        return self.pipeline([args])[0]
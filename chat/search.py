@@ -0,0 +1,209 @@
+"""
+Full-text search over direct and group messages.
+
+Every message gets one row in ``chat_search`` (created by migration 0008)
+holding its text and a *scope*: ``u<id>`` for each participant of a direct
+message, or ``g<id>`` for a group message. A user's search matches on text
+and on scope in the same index lookup, so it only ever sees their own
+conversations and groups.
+
+* SQLite: an FTS5 table; ranked by ``bm25``.
+* Postgres: a ``tsvector`` column and a ``text[]`` scope, each with a GIN
+  index; ranked by ``ts_rank``.
+* Anything else, or SQLite built without FTS5: a plain ``icontains``
+  scan of the scoped messages, newest first.
+
+Rows are added from the same places that maintain Conversation summaries,
+``message_saved`` and ``persist_batch``, and removed by id with
+``unindex_messages`` when archiving or account deletion deletes messages.
+A message saved with new text, or deleted on its own, has its row
+rewritten or removed by signal handlers (chat/signals.py).
+"""
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+
+from chat.models import GroupMessage, Message
+
+DIRECT, GROUP = "m", "g"
+RESULTS_PER_PAGE = 20
+MAX_RESULTS_PER_PAGE = 50
+# Deep offsets make the ranked query scan further; nobody pages this far.
+MAX_PAGE = 50
+
+_available = {}
+
+
+def _has_index(conn) -> bool:
+    if conn.alias not in _available:
+        _available[conn.alias] = (
+            conn.vendor in ("sqlite", "postgresql")
+            and "chat_search" in conn.introspection.table_names()
+        )
+    return _available[conn.alias]
+
+
+def terms(query) -> list:
+    """Search words in ``query``; punctuation and operators are ignored."""
+    return re.findall(r"\w+", query.lower())[:16]
+
+
+# ============================
+# Indexing
+# ============================
+def _kind_scope(message):
+    if isinstance(message, GroupMessage):
+        return GROUP, [f"g{message.group_id}"]
+    return DIRECT, [f"u{message.sender_id}", f"u{message.receiver_id}"]
+
+
+def _rows(messages):
+    for message in messages:
+        kind, scope = _kind_scope(message)
+        yield kind, message.id, scope, message.text
+
+
+def index_messages(messages, using=DEFAULT_DB_ALIAS):
+    """Add saved Message/GroupMessage instances to the search index."""
+    conn = connections[using]
+    if not messages or not _has_index(conn):
+        return
+    rows = list(_rows(messages))
+    with conn.cursor() as cursor:
+        if conn.vendor == "sqlite":
+            cursor.executemany(
+                "INSERT INTO chat_search (text, scope, kind, message_id) VALUES (%s, %s, %s, %s)",
+                [(text, " ".join(scope), kind, pk) for kind, pk, scope, text in rows],
+            )
+        else:
+            cursor.executemany(
+                "INSERT INTO chat_search (kind, message_id, scope, doc) "
+                "VALUES (%s, %s, %s, to_tsvector('simple', %s)) ON CONFLICT DO NOTHING",
+                rows,
+            )
+
+
+def unindex_messages(messages, using=DEFAULT_DB_ALIAS):
+    """
+    Remove deleted Message/GroupMessage instances from the search index.
+    Only ids and the fields of the scope (sender/receiver, group) are read.
+    """
+    conn = connections[using]
+    if not messages or not _has_index(conn):
+        return
+    batches = {}  # kind -> (ids, scope sets)
+    for message in messages:
+        kind, scope = _kind_scope(message)
+        ids, scopes = batches.setdefault(kind, ([], []))
+        ids.append(message.id)
+        scopes.append(set(scope))
+    with conn.cursor() as cursor:
+        for kind, (ids, scopes) in batches.items():
+            if conn.vendor == "sqlite":
+                # message_id is UNINDEXED in FTS5; matching a scope first
+                # limits the scan to the rooms involved (to the one user all
+                # the messages share, when purging an account).
+                common = set.intersection(*scopes)
+                chosen = sorted(common)[:1] if common else sorted(set.union(*scopes))
+                match = f"scope : ({' OR '.join(chosen)})"
+                cursor.execute(
+                    "DELETE FROM chat_search WHERE chat_search MATCH %%s AND kind = %%s AND message_id IN (%s)"
+                    % ", ".join(["%s"] * len(ids)),
+                    [match, kind, *ids],
+                )
+            else:
+                cursor.execute("DELETE FROM chat_search WHERE kind = %s AND message_id = ANY(%s)", [kind, ids])
+
+
+def reindex_messages(messages, using=DEFAULT_DB_ALIAS):
+    """Replace the index rows of edited Message/GroupMessage instances."""
+    unindex_messages(messages, using)
+    index_messages(messages, using)
+
+
+# ============================
+# Querying
+# ============================
+def _scopes(user):
+    return [f"u{user.id}"] + [f"g{pk}" for pk in user.chat_groups.values_list("id", flat=True)]
+
+
+def _ranked_ids(words, scopes, limit, offset):
+    # The last word is matched as a prefix (search-as-you-type) once it is
+    # long enough to hit the prefix index.
+    prefix = len(words[-1]) >= 2
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            text = " ".join(f'"{w}"' for w in words) + ("*" if prefix else "")
+            match = f"text : ({text}) AND scope : ({' OR '.join(scopes)})"
+            cursor.execute(
+                "SELECT kind, message_id FROM chat_search WHERE chat_search MATCH %s "
+                "ORDER BY rank LIMIT %s OFFSET %s",
+                [match, limit, offset],
+            )
+        else:
+            tsquery = " & ".join(words) + (":*" if prefix else "")
+            cursor.execute(
+                "SELECT kind, message_id FROM chat_search, to_tsquery('simple', %s) query "
+                "WHERE doc @@ query AND scope && %s "
+                "ORDER BY ts_rank(doc, query) DESC, message_id DESC LIMIT %s OFFSET %s",
+                [tsquery, scopes, limit, offset],
+            )
+        return cursor.fetchall()
+
+
+def _scanned_ids(user, words, limit, offset):
+    direct = Message.objects.filter(sender=user) | Message.objects.filter(receiver=user)
+    grouped = GroupMessage.objects.filter(group__members=user)
+    for word in words:
+        direct = direct.filter(text__icontains=word)
+        grouped = grouped.filter(text__icontains=word)
+    rows = sorted(
+        [(m.timestamp, DIRECT, m.id) for m in direct.only("id", "timestamp")[: offset + limit]]
+        + [(m.timestamp, GROUP, m.id) for m in grouped.only("id", "timestamp")[: offset + limit]],
+        reverse=True,
+    )
+    return [(kind, pk) for _, kind, pk in rows[offset:offset + limit]]
+
+
+def _load(hits):
+    direct_ids = [pk for kind, pk in hits if kind == DIRECT]
+    group_ids = [pk for kind, pk in hits if kind == GROUP]
+    found = {}
+    for m in Message.objects.filter(id__in=direct_ids).select_related("sender", "receiver"):
+        found[DIRECT, m.id] = m
+    for m in GroupMessage.objects.filter(id__in=group_ids).select_related("sender", "group"):
+        found[GROUP, m.id] = m
+    return [found[hit] for hit in hits if hit in found]
+
+
+def result_to_dict(message, user) -> dict:
+    result = {
+        "id": message.id,
+        "seq": message.seq,
+        "sender": message.sender.username,
+        "text": message.text,
+        "timestamp": message.timestamp.isoformat(),
+    }
+    if isinstance(message, GroupMessage):
+        result.update(kind="group", group_id=message.group_id, group=message.group.name)
+    else:
+        peer = message.receiver if message.sender_id == user.id else message.sender
+        result.update(kind="direct", peer=peer.username)
+    return result
+
+
+def search(user, query, page=1, limit=RESULTS_PER_PAGE):
+    """
+    One page of ``user``'s messages matching every word of ``query``, best
+    match first. Returns ``(messages, has_more)``.
+    """
+    words = terms(query)
+    if not words:
+        return [], False
+    offset = (page - 1) * limit
+    if _has_index(connection):
+        hits = _ranked_ids(words, _scopes(user), limit + 1, offset)
+    else:
+        hits = _scanned_ids(user, words, limit + 1, offset)
+    return _load(hits[:limit]), len(hits) > limit
@@ -0,0 +1,196 @@
+"""
+Session and user resolution without a database round trip per request.
+
+* ``SessionStore`` (``SESSION_ENGINE = "chat.sessions"``) is Django's
+  cached_db store, but keeps nothing in the ``SESSION_CACHE_ALIAS`` cache
+  for longer than ``CHAT_SESSION_CACHE_TTL`` seconds.
+* ``session_users`` maps a session key to its resolved User for
+  ``CHAT_USER_CACHE_TTL`` seconds. ``CachedAuthenticationMiddleware`` (HTTP)
+  and ``CachedAuthMiddlewareStack`` (websockets) consult it first, so a
+  page load or a socket handshake from a recently seen session costs no
+  queries at all; channels' own stack spends a thread hop and two queries.
+
+Logging out and deleting an account drop the affected entries
+(chat/signals.py, chat/deletion.py). With ``REDIS_URL`` set, several
+workers share the session cache (chat/rediscache.py), and a user cached
+here is only trusted while their session is still in it and their account
+has not been revoked there: one Redis round trip instead of the queries.
+Without it there is a single worker and nothing else to tell.
+"""
+import copy
+from functools import partial
+
+from channels.auth import AuthMiddleware
+from channels.sessions import CookieMiddleware, InstanceSessionWrapper, SessionMiddleware
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+from django.utils.functional import SimpleLazyObject
+
+from chat.cache import TTLCache
+from chat.db import database_sync_to_async
+from chat.rediscache import RedisCache
+
+
+# ============================
+# Session engine
+# ============================
+class _CappedCache:
+    """Cache proxy that keeps nothing for longer than ``ttl`` seconds."""
+
+    def __init__(self, cache, ttl):
+        self.cache = cache
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(key, value, self.ttl if timeout is None else min(timeout, self.ttl))
+
+    def delete(self, key):
+        return self.cache.delete(key)
+
+    def __contains__(self, key):
+        return key in self.cache
+
+
+class SessionStore(cached_db.SessionStore):
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = _CappedCache(self._cache, settings.CHAT_SESSION_CACHE_TTL)
+
+
+# ============================
+# Users by session
+# ============================
+# session key -> User
+session_users = TTLCache(maxsize=settings.CHAT_USER_CACHE_SIZE, ttl=settings.CHAT_USER_CACHE_TTL)
+
+
+def _shared_cache():
+    """The session cache if other workers share it, else None."""
+    cache = caches[settings.SESSION_CACHE_ALIAS]
+    return cache if isinstance(cache, RedisCache) else None
+
+
+def _revoked_key(user_id):
+    return f"chat:revoked-user:{user_id}"
+
+
+def _check_keys(session_key, user):
+    return [cached_db.KEY_PREFIX + session_key, _revoked_key(user.pk)]
+
+
+def _usable(session_key, user, found):
+    """``user`` if what the shared cache holds still backs it, else None."""
+    session, revoked = _check_keys(session_key, user)
+    if session in found and revoked not in found:
+        return user
+    session_users.invalidate(session_key)
+    return None
+
+
+def cached_user(session_key):
+    """The User last resolved for ``session_key``, or None."""
+    user = session_users.get(session_key) if session_key else None
+    shared = _shared_cache()
+    if user is not None and shared is not None:
+        user = _usable(session_key, user, shared.get_many(_check_keys(session_key, user)))
+    # A copy, so nothing a request sets on its user leaks into the next one.
+    return copy.copy(user) if user is not None else None
+
+
+async def acached_user(session_key):
+    """``cached_user`` without blocking the event loop on the shared cache."""
+    user = session_users.get(session_key) if session_key else None
+    shared = _shared_cache()
+    if user is not None and shared is not None:
+        user = _usable(session_key, user, await shared.aget_many(_check_keys(session_key, user)))
+    return copy.copy(user) if user is not None else None
+
+
+def load_user(session):
+    """Resolve the session's user from the database (and the session cache)."""
+    user = auth.get_user(_Holder(session))
+    if user.is_authenticated and session.session_key:
+        session_users.set(session.session_key, user)
+    return copy.copy(user)
+
+
+class _Holder:
+    # auth.get_user only ever reads request.session.
+    __slots__ = ("session",)
+
+    def __init__(self, session):
+        self.session = session
+
+
+def forget_session(session_key):
+    session_users.invalidate(session_key)
+
+
+def forget_user(user_id):
+    session_users.prune(lambda user: user.pk == user_id)
+    shared = _shared_cache()
+    if shared is not None:
+        # Other workers' entries for the user outlive no longer than this.
+        shared.set(_revoked_key(user_id), True, settings.CHAT_USER_CACHE_TTL)
+
+
+# ============================
+# HTTP
+# ============================
+def get_user(request):
+    if not hasattr(request, "_cached_user"):
+        request._cached_user = cached_user(request.session.session_key) or load_user(request.session)
+    return request._cached_user
+
+
+async def aget_user(request):
+    if not hasattr(request, "_acached_user"):
+        user = await acached_user(request.session.session_key)
+        if user is None:
+            user = await database_sync_to_async(load_user)(request.session)
+        request._acached_user = user
+    return request._acached_user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    """AuthenticationMiddleware resolving users through ``session_users``."""
+
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: get_user(request))
+        request.auser = partial(aget_user, request)
+
+
+# ============================
+# Websockets
+# ============================
+class _SessionWrapper(InstanceSessionWrapper):
+    async def resolve_session(self):
+        # Creating a store runs no queries; skip channels' thread hop for it.
+        self.scope["session"]._wrapped = self.session_store(self.scope["cookies"].get(self.cookie_name))
+
+
+class CachedSessionMiddleware(SessionMiddleware):
+    async def __call__(self, scope, receive, send):
+        wrapper = _SessionWrapper(scope, send)
+        await wrapper.resolve_session()
+        return await self.inner(wrapper.scope, receive, wrapper.send)
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    async def resolve_scope(self, scope):
+        session = scope["session"]
+        user = await acached_user(session.session_key)
+        if user is None:
+            user = await database_sync_to_async(load_user)(session)
+        scope["user"]._wrapped = user
+
+
+def CachedAuthMiddlewareStack(inner):
+    return CookieMiddleware(CachedSessionMiddleware(CachedAuthMiddleware(inner)))
@@ -1,41 +1,93 @@
-import re
-from django.db.models.signals import post_save
+from functools import partial
+
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.contrib.auth.signals import user_logged_out
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.dispatch import receiver
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from .models import Message, GroupMessage
 
-def safe_group_name(name: str) -> str:
-    return re.sub(r'[^a-zA-Z0-9_.-]', '_', name)
+from .dispatch import caller_broadcasts, message_saved
+from .history import caller_retires, retire_chunks
+from . import membership, search
+from .models import Group, Message, GroupMessage, RoomSequence
+from .sessions import forget_session
+
+
+@receiver(pre_save, sender=Message)
+@receiver(pre_save, sender=GroupMessage)
+def assign_sequence(sender, instance, **kwargs):
+    if instance._state.adding:
+        RoomSequence.objects.assign([instance])
+
 
 @receiver(post_save, sender=Message)
 def broadcast_direct_message(sender, instance, created, **kwargs):
-    if not created:
+    if not created or caller_broadcasts.get():
         return
-    channel_layer = get_channel_layer()
-    room_group = f"chat_{safe_group_name(min(instance.sender.username, instance.receiver.username))}_{safe_group_name(max(instance.sender.username, instance.receiver.username))}"
-    async_to_sync(channel_layer.group_send)(
-        room_group,
-        {
-            "type": "chat_message",
-            "sender": instance.sender.username,
-            "text": instance.text,
-            "timestamp": str(instance.timestamp),
-        }
-    )
+    transaction.on_commit(partial(message_saved, instance))
+
 
 @receiver(post_save, sender=GroupMessage)
 def broadcast_group_message(sender, instance, created, **kwargs):
-    if not created:
+    if not created or caller_broadcasts.get():
+        return
+    transaction.on_commit(partial(message_saved, instance))
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=GroupMessage)
+def forget_rendered_history(sender, instance, **kwargs):
+    # Cached history chunks may contain the message.
+    if not caller_retires.get():
+        transaction.on_commit(partial(retire_chunks, [instance.sequence_key]))
+
+
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=GroupMessage)
+def reindex_edited_message(sender, instance, created, update_fields, **kwargs):
+    if not created and (update_fields is None or "text" in update_fields):
+        search.reindex_messages([instance])
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=GroupMessage)
+def unindex_deleted_message(sender, instance, **kwargs):
+    # Bulk deleters unindex their batch by id themselves.
+    if not caller_retires.get():
+        search.unindex_messages([instance])
+
+
+@receiver(m2m_changed, sender=Group.members.through)
+def forget_memberships(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
         return
-    channel_layer = get_channel_layer()
-    room_group = f"group_{safe_group_name(str(instance.group.id))}"
-    async_to_sync(channel_layer.group_send)(
-        room_group,
-        {
-            "type": "chat_message",
-            "sender": instance.sender.username,
-            "text": instance.text,
-            "timestamp": str(instance.timestamp),
-        }
-    )
+    if reverse:
+        # user.chat_groups.add(...): one user changed.
+        membership.forget([instance.pk])
+    elif action == "pre_clear":
+        membership.forget(instance.members.values_list("id", flat=True))
+    else:
+        membership.forget(pk_set)
+
+
+@receiver(post_delete, sender=Group)
+def forget_deleted_group(sender, instance, **kwargs):
+    # The cascade removes its member rows without m2m_changed.
+    membership.memberships.clear()
+
+
+@receiver(user_logged_out)
+def forget_logged_out_session(sender, request, **kwargs):
+    # channels' logout passes no request.
+    if request is not None:
+        forget_session(request.session.session_key)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    # WAL lets readers carry on while a write is in progress; NORMAL sync is
+    # safe under WAL and skips an fsync per commit.
+    if connection.vendor == "sqlite":
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
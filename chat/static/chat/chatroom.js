@@ -0,0 +1,463 @@
+(function() {
+    const protocol = window.location.protocol === "https:" ? "wss" : "ws";
+    // Set on <body> by chatroom.html.
+    const username = document.body.dataset.peer;
+    const currentUser = document.body.dataset.user;
+
+    /* CHAT SOCKET (see connectChat below) */
+    let chatSocket = null;
+
+    const messagesDiv = document.getElementById("messages");
+    // History is rendered once for every viewer (chat/history.py); mark our own bubbles.
+    messagesDiv.querySelectorAll(`.message[data-sender="${CSS.escape(currentUser)}"]`)
+        .forEach(el => el.classList.add("self"));
+    const form = document.getElementById("send-form");
+    const input = document.getElementById("message-input");
+
+    /* OLDER HISTORY (cursor pagination) */
+    const loadOlderBtn = document.getElementById("load-older");
+    const seenIds = new Set(
+        Array.from(messagesDiv.querySelectorAll(".message[data-id]"), el => el.dataset.id)
+    );
+    // Highest sequence number shown; a (re)connecting socket resumes after it.
+    let lastSeq = Math.max(0, ...Array.from(
+        messagesDiv.querySelectorAll(".message[data-seq]"), el => Number(el.dataset.seq) || 0
+    ));
+
+    function noteSeq(seq) {
+        if (seq != null && seq > lastSeq) lastSeq = seq;
+    }
+
+    /* TYPING + READ RECEIPTS (coalesced per room server-side, chat/activity.py) */
+    const typingDiv = document.getElementById("typing");
+    const typers = new Map();  // username -> timer that expires their indicator
+    // Highest seq each other participant has read, seeded by the page.
+    const readBy = JSON.parse(document.getElementById("read-markers").textContent);
+    let readSent = 0;
+    let readTimer = null;
+    let typingSentAt = 0;
+
+    function sendFrame(frame) {
+        if (!chatSocket || chatSocket.readyState !== WebSocket.OPEN) return false;
+        chatSocket.send(JSON.stringify(frame));
+        return true;
+    }
+
+    function renderTyping() {
+        const names = Array.from(typers.keys());
+        typingDiv.textContent = !names.length ? ""
+            : names.join(", ") + (names.length === 1 ? " is typing…" : " are typing…");
+    }
+
+    // One receipt, under our latest confirmed message.
+    function renderReceipt() {
+        const old = messagesDiv.querySelector(".receipt");
+        if (old) old.remove();
+        const own = Array.from(messagesDiv.querySelectorAll(".message.self[data-seq]"))
+            .filter(el => Number(el.dataset.seq) > 0);
+        const last = own[own.length - 1];
+        if (!last) return;
+        const readers = Object.keys(readBy).filter(name => readBy[name] >= Number(last.dataset.seq));
+        if (!readers.length) return;
+        const receipt = document.createElement("div");
+        receipt.className = "receipt";
+        receipt.textContent = "Read";
+        last.appendChild(receipt);
+    }
+
+    function applyActivity(data) {
+        for (const [name, active] of Object.entries(data.typing || {})) {
+            if (name === currentUser) continue;
+            clearTimeout(typers.get(name));
+            typers.delete(name);
+            // Lapses by itself if the "stopped" update is missed.
+            if (active) typers.set(name, setTimeout(() => { typers.delete(name); renderTyping(); }, 7000));
+        }
+        renderTyping();
+        for (const [name, seq] of Object.entries(data.read || {})) {
+            if (name !== currentUser && seq > (readBy[name] || 0)) readBy[name] = seq;
+        }
+        renderReceipt();
+    }
+
+    // Report how far we have read, at most twice a second and only while visible.
+    function scheduleRead() {
+        if (readTimer || document.visibilityState !== "visible") return;
+        readTimer = setTimeout(() => {
+            readTimer = null;
+            if (lastSeq > readSent && sendFrame({ type: "read", seq: lastSeq })) readSent = lastSeq;
+        }, 500);
+    }
+    document.addEventListener("visibilitychange", scheduleRead);
+
+    input.addEventListener("input", function() {
+        const now = Date.now();
+        if (input.value && now - typingSentAt > 3000) {
+            if (sendFrame({ type: "typing", active: true })) typingSentAt = now;
+        } else if (!input.value && typingSentAt) {
+            sendFrame({ type: "typing", active: false });
+            typingSentAt = 0;
+        }
+    });
+    renderReceipt();
+
+    function buildAttachment(attachment) {
+        const link = document.createElement("a");
+        link.className = "attachment";
+        link.href = attachment.url;
+        link.target = "_blank";
+        if (attachment.thumbnail) {
+            const img = document.createElement("img");
+            img.src = attachment.thumbnail;
+            img.alt = attachment.name;
+            img.loading = "lazy";
+            link.appendChild(img);
+        } else {
+            link.textContent = "📎 " + attachment.name;
+        }
+        return link;
+    }
+
+    function buildMessage(data) {
+        const msgDiv = document.createElement("div");
+        msgDiv.className = "message" + (data.sender === currentUser ? " self" : "");
+        if (data.id != null) msgDiv.dataset.id = data.id;
+        if (data.seq != null) msgDiv.dataset.seq = data.seq;
+        msgDiv.dataset.sender = data.sender;
+        if (data.client_id) msgDiv.dataset.clientId = data.client_id;
+        for (const [cls, value] of [["sender", data.sender], ["bubble", data.text], ["timestamp", data.timestamp]]) {
+            const part = document.createElement("div");
+            part.className = cls;
+            part.textContent = value;
+            msgDiv.appendChild(part);
+        }
+        if (data.attachment) msgDiv.querySelector(".bubble").prepend(buildAttachment(data.attachment));
+        return msgDiv;
+    }
+
+    loadOlderBtn.addEventListener("click", async function() {
+        const cursor = messagesDiv.dataset.next;
+        if (!cursor) return;
+
+        loadOlderBtn.disabled = true;
+        const response = await fetch(messagesDiv.dataset.historyUrl + "?before=" + encodeURIComponent(cursor));
+        loadOlderBtn.disabled = false;
+        if (!response.ok) return;
+        const page = await response.json();
+
+        const previousHeight = messagesDiv.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(m => fragment.appendChild(buildMessage(m)));
+        messagesDiv.prepend(fragment);
+        messagesDiv.scrollTop += messagesDiv.scrollHeight - previousHeight;
+
+        messagesDiv.dataset.next = page.next || "";
+        loadOlderBtn.hidden = !page.next;
+    });
+
+    function showMessage(data) {
+        noteSeq(data.seq);
+
+        // Every message carries its id; drop replays we have already shown.
+        const key = data.id != null ? String(data.id) : data.client_id;
+        if (key) {
+            if (seenIds.has(key)) return;
+            seenIds.add(key);
+        }
+
+        messagesDiv.appendChild(buildMessage(data));
+        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+        if (data.sender !== currentUser) scheduleRead();
+    }
+
+    function handleChatFrame(event) {
+        const data = JSON.parse(event.data);
+
+        // The server dropped frames because this tab fell behind; reload to catch up.
+        if (data.type === "lagged") {
+            window.location.reload();
+            return;
+        }
+
+        // Provisional copies are confirmed with their durable id once saved.
+        if (data.type === "confirm") {
+            data.messages.forEach(m => {
+                seenIds.add(String(m.id));
+                noteSeq(m.seq);
+                const el = messagesDiv.querySelector(`[data-client-id="${CSS.escape(m.client_id)}"]`);
+                if (el) {
+                    el.dataset.id = m.id;
+                    el.dataset.seq = m.seq;
+                }
+            });
+            renderReceipt();
+            return;
+        }
+        if (data.type === "failed") {
+            data.client_ids.forEach(clientId => {
+                const el = messagesDiv.querySelector(`[data-client-id="${CSS.escape(clientId)}"]`);
+                if (el) el.classList.add("failed");
+            });
+            return;
+        }
+
+        // Backlog replayed after a resume.
+        if (data.type === "sync") {
+            data.messages.forEach(showMessage);
+            return;
+        }
+        if (data.type === "synced") {
+            scheduleRead();
+            return;
+        }
+
+        if (data.type === "activity") {
+            applyActivity(data);
+            return;
+        }
+
+        showMessage(data);
+    }
+
+    // Reconnect with backoff; every new socket first asks for what it missed.
+    let retryDelay = 500;
+    function connectChat() {
+        chatSocket = new WebSocket(protocol + "://" + window.location.host + "/ws/chat/" + username + "/");
+        chatSocket.onopen = function() {
+            retryDelay = 500;
+            chatSocket.send(JSON.stringify({ type: "resume", after: lastSeq }));
+        };
+        chatSocket.onmessage = handleChatFrame;
+        chatSocket.onclose = function() {
+            setTimeout(connectChat, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 10000);
+        };
+    }
+    connectChat();
+
+    async function postMessage(text, attachmentId) {
+        const response = await fetch(form.dataset.sendUrl, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": form.querySelector("[name=csrfmiddlewaretoken]").value,
+            },
+            body: JSON.stringify({ text: text, attachment: attachmentId }),
+        });
+        if (response.ok) showMessage(await response.json());
+    }
+
+    form.addEventListener("submit", function(event) {
+        event.preventDefault();
+
+        const message = input.value.trim();
+        if (!message) return;
+
+        // Without a live socket, send over HTTP; the reply is the saved message.
+        if (!sendFrame({ type: "chat", text: message, sender: currentUser })) {
+            postMessage(message);
+        }
+
+        input.value = "";
+        // The server clears our typing indicator when the message arrives.
+        typingSentAt = 0;
+    });
+
+    /* ATTACHMENTS: uploaded over HTTP first, then sent by id like a message */
+    const fileInput = document.getElementById("file-input");
+    document.getElementById("attach-btn").addEventListener("click", () => fileInput.click());
+    fileInput.addEventListener("change", async function() {
+        const file = fileInput.files[0];
+        fileInput.value = "";
+        if (!file) return;
+        const body = new FormData();
+        body.append("file", file);
+        const response = await fetch(form.dataset.uploadUrl, {
+            method: "POST",
+            headers: { "X-CSRFToken": form.querySelector("[name=csrfmiddlewaretoken]").value },
+            body: body,
+        });
+        if (!response.ok) {
+            alert(response.status === 413 ? "That file is too large." : "Could not upload the file.");
+            return;
+        }
+        const attachment = await response.json();
+        if (!sendFrame({ type: "chat", text: "", attachment: attachment.id })) {
+            postMessage("", attachment.id);
+        }
+    });
+
+    /* CALL SOCKET + WEBRTC */
+    const callStatus = document.getElementById("call-status");
+    const callBtn = document.getElementById("call-btn");
+    const muteBtn = document.getElementById("mute-btn");
+    const hangupBtn = document.getElementById("hangup-btn");
+    const remoteAudio = document.getElementById("remoteAudio");
+
+    let callSocket = new WebSocket(
+        protocol + "://" + window.location.host + "/ws/call/" + currentUser + "/"
+    );
+
+    let localStream = null;
+    let peerConnection = null;
+    let isMuted = false;
+    // Who we are calling or being called by; the server tracks the call (chat/calls.py).
+    let callPeer = null;
+
+    const rtcConfig = {
+    iceServers: [
+        { urls: "stun:stun.l.google.com:19302" },
+        {
+            urls: "turn:relay.metered.ca:80",
+            username: "open",
+            credential: "open"
+        }
+    ]
+};
+
+    callSocket.onmessage = async function(event) {
+        const data = JSON.parse(event.data);
+
+        if (data.type === "offer" && data.to === currentUser) {
+            callPeer = data.from;
+            callStatus.innerText = `Incoming call from ${data.from}...`;
+            await handleIncomingOffer(data.offer, data.from);
+        }
+
+        if (data.type === "unavailable" && data.to === currentUser) {
+            endCall();
+            callStatus.innerText = `${data.from} is offline`;
+        }
+
+        if (data.type === "answer" && data.to === currentUser) {
+            await peerConnection.setRemoteDescription(new RTCSessionDescription(data.answer));
+            callStatus.innerText = "In call";
+        }
+
+        if (data.type === "ice" && data.to === currentUser) {
+            if (peerConnection && data.candidate) {
+                await peerConnection.addIceCandidate(data.candidate);
+            }
+        }
+
+        if (data.type === "hangup" && data.to === currentUser) {
+            endCall();
+            callStatus.innerText = `${data.from} ended the call`;
+        }
+
+        if (data.type === "timeout" && data.to === currentUser) {
+            endCall();
+            callStatus.innerText = "No answer";
+        }
+    };
+
+    async function createPeerConnection() {
+        peerConnection = new RTCPeerConnection(rtcConfig);
+
+        peerConnection.onicecandidate = (event) => {
+            if (event.candidate) {
+                callSocket.send(JSON.stringify({
+                    type: "ice",
+                    candidate: event.candidate,
+                    from: currentUser,
+                    to: username
+                }));
+            }
+        };
+
+        peerConnection.ontrack = (event) => {
+            remoteAudio.srcObject = event.streams[0];
+        };
+    }
+
+    async function getLocalStream() {
+        if (!localStream) {
+            localStream = await navigator.mediaDevices.getUserMedia({ audio: true });
+        }
+        return localStream;
+    }
+
+    /* ⭐ INSERTED: CALL_STARTED MESSAGE */
+    callBtn.addEventListener("click", async () => {
+
+        chatSocket.send(JSON.stringify({
+            type: "call_started",
+            sender: currentUser
+        }));
+
+        callStatus.innerText = "Starting call...";
+        callPeer = username;
+
+        await createPeerConnection();
+        const stream = await getLocalStream();
+        stream.getTracks().forEach(track => {
+            peerConnection.addTrack(track, stream);
+        });
+
+        const offer = await peerConnection.createOffer();
+        await peerConnection.setLocalDescription(offer);
+
+        callSocket.send(JSON.stringify({
+            type: "offer",
+            offer: offer,
+            from: currentUser,
+            to: username
+        }));
+
+        callStatus.innerText = "Calling...";
+    });
+
+    async function handleIncomingOffer(offer, fromUser) {
+        await createPeerConnection();
+        const stream = await getLocalStream();
+        stream.getTracks().forEach(track => {
+            peerConnection.addTrack(track, stream);
+        });
+
+        await peerConnection.setRemoteDescription(new RTCSessionDescription(offer));
+
+        const answer = await peerConnection.createAnswer();
+        await peerConnection.setLocalDescription(answer);
+
+        callSocket.send(JSON.stringify({
+            type: "answer",
+            answer: answer,
+            from: currentUser,
+            to: fromUser
+        }));
+
+        callStatus.innerText = "In call";
+    }
+
+    muteBtn.addEventListener("click", () => {
+        if (!localStream) return;
+        isMuted = !isMuted;
+        localStream.getAudioTracks().forEach(track => {
+            track.enabled = !isMuted;
+        });
+        muteBtn.textContent = isMuted ? "Unmute" : "Mute";
+    });
+
+    function endCall() {
+        callPeer = null;
+        if (peerConnection) peerConnection.close();
+        peerConnection = null;
+
+        if (localStream) {
+            localStream.getTracks().forEach(track => track.stop());
+            localStream = null;
+        }
+
+        callStatus.innerText = "Not in a call";
+        muteBtn.textContent = "Mute";
+        isMuted = false;
+    }
+
+    hangupBtn.addEventListener("click", () => {
+        if (callPeer && callSocket.readyState === WebSocket.OPEN) {
+            callSocket.send(JSON.stringify({ type: "hangup", to: callPeer }));
+        }
+        endCall();
+    });
+
+})();
@@ -0,0 +1,294 @@
+(function() {
+    const protocol = window.location.protocol === "https:" ? "wss" : "ws";
+    // Set on <body> by group_chatroom.html.
+    const groupId = document.body.dataset.group;
+    const currentUser = document.body.dataset.user;
+    let chatSocket = null;
+
+    const messagesDiv = document.getElementById("messages");
+    // History is rendered once for every viewer (chat/history.py); mark our own bubbles.
+    messagesDiv.querySelectorAll(`.message[data-sender="${CSS.escape(currentUser)}"]`)
+        .forEach(el => el.classList.add("self"));
+    const form = document.getElementById("send-form");
+    const input = document.getElementById("message-input");
+
+    /* OLDER HISTORY (cursor pagination) */
+    const loadOlderBtn = document.getElementById("load-older");
+    const seenIds = new Set(
+        Array.from(messagesDiv.querySelectorAll(".message[data-id]"), el => el.dataset.id)
+    );
+    // Highest sequence number shown; a (re)connecting socket resumes after it.
+    let lastSeq = Math.max(0, ...Array.from(
+        messagesDiv.querySelectorAll(".message[data-seq]"), el => Number(el.dataset.seq) || 0
+    ));
+
+    function noteSeq(seq) {
+        if (seq != null && seq > lastSeq) lastSeq = seq;
+    }
+
+    /* TYPING + READ RECEIPTS (coalesced per room server-side, chat/activity.py) */
+    const typingDiv = document.getElementById("typing");
+    const typers = new Map();  // username -> timer that expires their indicator
+    // Highest seq each other participant has read, seeded by the page.
+    const readBy = JSON.parse(document.getElementById("read-markers").textContent);
+    let readSent = 0;
+    let readTimer = null;
+    let typingSentAt = 0;
+
+    function sendFrame(frame) {
+        if (!chatSocket || chatSocket.readyState !== WebSocket.OPEN) return false;
+        chatSocket.send(JSON.stringify(frame));
+        return true;
+    }
+
+    function renderTyping() {
+        const names = Array.from(typers.keys());
+        typingDiv.textContent = !names.length ? ""
+            : names.join(", ") + (names.length === 1 ? " is typing…" : " are typing…");
+    }
+
+    // One receipt, under our latest confirmed message.
+    function renderReceipt() {
+        const old = messagesDiv.querySelector(".receipt");
+        if (old) old.remove();
+        const own = Array.from(messagesDiv.querySelectorAll(".message.self[data-seq]"))
+            .filter(el => Number(el.dataset.seq) > 0);
+        const last = own[own.length - 1];
+        if (!last) return;
+        const readers = Object.keys(readBy).filter(name => readBy[name] >= Number(last.dataset.seq));
+        if (!readers.length) return;
+        const receipt = document.createElement("div");
+        receipt.className = "receipt";
+        receipt.textContent = "Seen by " + readers.join(", ");
+        last.appendChild(receipt);
+    }
+
+    function applyActivity(data) {
+        for (const [name, active] of Object.entries(data.typing || {})) {
+            if (name === currentUser) continue;
+            clearTimeout(typers.get(name));
+            typers.delete(name);
+            // Lapses by itself if the "stopped" update is missed.
+            if (active) typers.set(name, setTimeout(() => { typers.delete(name); renderTyping(); }, 7000));
+        }
+        renderTyping();
+        for (const [name, seq] of Object.entries(data.read || {})) {
+            if (name !== currentUser && seq > (readBy[name] || 0)) readBy[name] = seq;
+        }
+        renderReceipt();
+    }
+
+    // Report how far we have read, at most twice a second and only while visible.
+    function scheduleRead() {
+        if (readTimer || document.visibilityState !== "visible") return;
+        readTimer = setTimeout(() => {
+            readTimer = null;
+            if (lastSeq > readSent && sendFrame({ type: "read", seq: lastSeq })) readSent = lastSeq;
+        }, 500);
+    }
+    document.addEventListener("visibilitychange", scheduleRead);
+
+    input.addEventListener("input", function() {
+        const now = Date.now();
+        if (input.value && now - typingSentAt > 3000) {
+            if (sendFrame({ type: "typing", active: true })) typingSentAt = now;
+        } else if (!input.value && typingSentAt) {
+            sendFrame({ type: "typing", active: false });
+            typingSentAt = 0;
+        }
+    });
+    renderReceipt();
+
+    function buildAttachment(attachment) {
+        const link = document.createElement("a");
+        link.className = "attachment";
+        link.href = attachment.url;
+        link.target = "_blank";
+        if (attachment.thumbnail) {
+            const img = document.createElement("img");
+            img.src = attachment.thumbnail;
+            img.alt = attachment.name;
+            img.loading = "lazy";
+            link.appendChild(img);
+        } else {
+            link.textContent = "📎 " + attachment.name;
+        }
+        return link;
+    }
+
+    function buildMessage(data) {
+        const msgDiv = document.createElement("div");
+        msgDiv.className = "message" + (data.sender === currentUser ? " self" : "");
+        if (data.id != null) msgDiv.dataset.id = data.id;
+        if (data.seq != null) msgDiv.dataset.seq = data.seq;
+        msgDiv.dataset.sender = data.sender;
+        if (data.client_id) msgDiv.dataset.clientId = data.client_id;
+        for (const [cls, value] of [["sender", data.sender], ["bubble", data.text], ["timestamp", data.timestamp]]) {
+            const part = document.createElement("div");
+            part.className = cls;
+            part.textContent = value;
+            msgDiv.appendChild(part);
+        }
+        if (data.attachment) msgDiv.querySelector(".bubble").prepend(buildAttachment(data.attachment));
+        return msgDiv;
+    }
+
+    loadOlderBtn.addEventListener("click", async function() {
+        const cursor = messagesDiv.dataset.next;
+        if (!cursor) return;
+
+        loadOlderBtn.disabled = true;
+        const response = await fetch(messagesDiv.dataset.historyUrl + "?before=" + encodeURIComponent(cursor));
+        loadOlderBtn.disabled = false;
+        if (!response.ok) return;
+        const page = await response.json();
+
+        const previousHeight = messagesDiv.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(m => fragment.appendChild(buildMessage(m)));
+        messagesDiv.prepend(fragment);
+        messagesDiv.scrollTop += messagesDiv.scrollHeight - previousHeight;
+
+        messagesDiv.dataset.next = page.next || "";
+        loadOlderBtn.hidden = !page.next;
+    });
+
+    let unreadCount = 0;
+    const originalTitle = document.title;
+
+    function showMessage(data) {
+        noteSeq(data.seq);
+
+        // Every message carries its id; drop replays we have already shown.
+        const key = data.id != null ? String(data.id) : data.client_id;
+        if (key) {
+            if (seenIds.has(key)) return;
+            seenIds.add(key);
+        }
+
+        messagesDiv.appendChild(buildMessage(data));
+        messagesDiv.scrollTop = messagesDiv.scrollHeight;
+        if (data.sender !== currentUser) scheduleRead();
+
+        if (data.sender !== currentUser) {
+            unreadCount++;
+            document.title = `(${unreadCount}) Zaptalk`;
+        }
+    }
+
+    function handleFrame(event) {
+        const data = JSON.parse(event.data);
+
+        // The server dropped frames because this tab fell behind; reload to catch up.
+        if (data.type === "lagged") {
+            window.location.reload();
+            return;
+        }
+
+        // Provisional copies are confirmed with their durable id once saved.
+        if (data.type === "confirm") {
+            data.messages.forEach(m => {
+                seenIds.add(String(m.id));
+                noteSeq(m.seq);
+                const el = messagesDiv.querySelector(`[data-client-id="${CSS.escape(m.client_id)}"]`);
+                if (el) {
+                    el.dataset.id = m.id;
+                    el.dataset.seq = m.seq;
+                }
+            });
+            renderReceipt();
+            return;
+        }
+        if (data.type === "failed") {
+            data.client_ids.forEach(clientId => {
+                const el = messagesDiv.querySelector(`[data-client-id="${CSS.escape(clientId)}"]`);
+                if (el) el.classList.add("failed");
+            });
+            return;
+        }
+
+        // Backlog replayed after a resume.
+        if (data.type === "sync") {
+            data.messages.forEach(showMessage);
+            return;
+        }
+        if (data.type === "synced") {
+            scheduleRead();
+            return;
+        }
+
+        if (data.type === "activity") {
+            applyActivity(data);
+            return;
+        }
+
+        showMessage(data);
+    }
+
+    // Reconnect with backoff; every new socket first asks for what it missed.
+    let retryDelay = 500;
+    function connect() {
+        const socket = chatSocket = new WebSocket(protocol + "://" + window.location.host + "/ws/group/" + groupId + "/");
+        socket.onopen = function() {
+            retryDelay = 500;
+            socket.send(JSON.stringify({ type: "resume", after: lastSeq }));
+        };
+        socket.onmessage = handleFrame;
+        socket.onclose = function() {
+            setTimeout(connect, retryDelay);
+            retryDelay = Math.min(retryDelay * 2, 10000);
+        };
+    }
+    connect();
+
+    window.addEventListener("focus", () => {
+        unreadCount = 0;
+        document.title = originalTitle;
+    });
+
+    // Send over HTTP (202 with the saved message) instead of a full page reload;
+    // everyone else gets it over their sockets.
+    form.addEventListener("submit", async function(e) {
+        e.preventDefault();
+        const text = input.value.trim();
+        if (!text) return;
+        input.value = "";
+        typingSentAt = 0;
+        sendFrame({ type: "typing", active: false });
+        await postMessage(text);
+    });
+
+    async function postMessage(text, attachmentId) {
+        const response = await fetch(form.dataset.sendUrl, {
+            method: "POST",
+            headers: {
+                "Content-Type": "application/json",
+                "X-CSRFToken": form.querySelector("[name=csrfmiddlewaretoken]").value,
+            },
+            body: JSON.stringify({ text: text, attachment: attachmentId }),
+        });
+        if (response.ok) showMessage(await response.json());
+    }
+
+    /* ATTACHMENTS: uploaded over HTTP first, then sent by id like a message */
+    const fileInput = document.getElementById("file-input");
+    document.getElementById("attach-btn").addEventListener("click", () => fileInput.click());
+    fileInput.addEventListener("change", async function() {
+        const file = fileInput.files[0];
+        fileInput.value = "";
+        if (!file) return;
+        const body = new FormData();
+        body.append("file", file);
+        const response = await fetch(form.dataset.uploadUrl, {
+            method: "POST",
+            headers: { "X-CSRFToken": form.querySelector("[name=csrfmiddlewaretoken]").value },
+            body: body,
+        });
+        if (!response.ok) {
+            alert(response.status === 413 ? "That file is too large." : "Could not upload the file.");
+            return;
+        }
+        const attachment = await response.json();
+        await postMessage("", attachment.id);
+    });
+})();
@@ -0,0 +1,54 @@
+(function() {
+    const input = document.getElementById("search-input");
+    const results = document.getElementById("search-results");
+    const more = document.getElementById("search-more");
+    let query = "";
+    let nextPage = null;
+    let timer = null;
+
+    function renderResult(r) {
+        const entry = document.createElement("div");
+        entry.className = "entry";
+        const link = document.createElement("a");
+        link.href = r.kind === "group" ? `/group/${r.group_id}/` : `/chat/${encodeURIComponent(r.peer)}/`;
+        link.textContent = `${r.sender}: ${r.text}`;
+        const where = document.createElement("div");
+        where.className = "where";
+        where.textContent = (r.kind === "group" ? r.group : r.peer) + " · " + new Date(r.timestamp).toLocaleString();
+        entry.append(link, where);
+        return entry;
+    }
+
+    async function load(page) {
+        const q = query;
+        const response = await fetch(input.dataset.url + "?q=" + encodeURIComponent(q) + "&page=" + page);
+        if (!response.ok || q !== query) return;
+        const data = await response.json();
+        if (page === 1) results.replaceChildren();
+        data.results.forEach(r => results.appendChild(renderResult(r)));
+        if (page === 1 && !data.results.length) {
+            const empty = document.createElement("p");
+            empty.className = "empty";
+            empty.textContent = "No matches.";
+            results.appendChild(empty);
+        }
+        nextPage = data.next_page;
+        more.hidden = !nextPage;
+    }
+
+    // Debounced search-as-you-type.
+    input.addEventListener("input", function() {
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            query = input.value.trim();
+            if (!query) {
+                results.replaceChildren();
+                more.hidden = true;
+                return;
+            }
+            load(1);
+        }, 250);
+    });
+
+    more.addEventListener("click", () => nextPage && load(nextPage));
+})();
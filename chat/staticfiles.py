@@ -0,0 +1,203 @@
+"""
+Static files served by the ASGI app itself.
+
+``collectstatic`` (with ``CompressedManifestStaticFilesStorage``) writes
+every asset under a content-hashed name, plus ``.gz`` and, when the
+optional ``brotli`` package is installed, ``.br`` copies of the text ones.
+``{% static %}`` then points pages at the hashed names, so a changed file
+gets a new URL and an unchanged one never needs revalidating.
+
+``StaticFilesApp`` wraps the Django ASGI app and answers ``STATIC_URL``
+requests from memory: hashed names with a year-long ``immutable``
+Cache-Control, the best precompressed variant the client accepts, and
+ETag/304 for everything. Until ``collectstatic`` has run, source files are
+served from the app directories under their plain names with a short
+max-age instead.
+"""
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+try:
+    import brotli
+except ImportError:  # optional; gzip only
+    brotli = None
+
+COMPRESSIBLE = (".css", ".js", ".map", ".svg", ".json", ".txt", ".html", ".xml")
+MIN_COMPRESS_BYTES = 256
+
+IMMUTABLE = b"public, max-age=31536000, immutable"
+REVALIDATE = b"public, max-age=60"
+# Assets kept in memory per worker; a project has far fewer files than this.
+MAX_CACHED_ASSETS = 2048
+
+
+# ============================
+# Storage
+# ============================
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # A name missing from the manifest falls back to the source file below.
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Not collected yet; StaticFilesApp serves it from the finders.
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in set(self.hashed_files.values()):
+            if name.endswith(COMPRESSIBLE):
+                self._compress(self.path(name))
+
+    @staticmethod
+    def _compress(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if len(data) < MIN_COMPRESS_BYTES:
+            return
+        variants = {".gz": gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            variants[".br"] = brotli.compress(data)
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data):
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+
+
+# ============================
+# Serving
+# ============================
+class Asset:
+    __slots__ = ("bodies", "content_type", "etag", "cache_control")
+
+    def __init__(self, bodies, content_type, etag, cache_control):
+        self.bodies = bodies  # encoding ("identity", "gzip", "br") -> bytes
+        self.content_type = content_type
+        self.etag = etag
+        self.cache_control = cache_control
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_asset(name):
+    """The Asset for a static ``name``, or None if there is no such file."""
+    hashed = name in _hashed_names()
+    path = None
+    if settings.STATIC_ROOT:
+        try:
+            path = safe_join(settings.STATIC_ROOT, name)
+        except SuspiciousFileOperation:
+            return None
+    if path is None or not os.path.isfile(path):
+        hashed = False
+        path = finders.find(name)
+        if path is None or not os.path.isfile(path):
+            return None
+
+    bodies = {"identity": _read(path)}
+    for encoding, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if os.path.isfile(path + suffix):
+            bodies[encoding] = _read(path + suffix)
+    content_type, _ = mimetypes.guess_type(name)
+    if content_type is None:
+        content_type = "application/octet-stream"
+    elif content_type.startswith("text/") or content_type == "application/javascript":
+        content_type += "; charset=utf-8"
+    return Asset(
+        bodies,
+        content_type.encode(),
+        b'"%s"' % hashlib.md5(bodies["identity"]).hexdigest().encode(),
+        IMMUTABLE if hashed else REVALIDATE,
+    )
+
+
+_hashed = None
+
+
+def _hashed_names():
+    global _hashed
+    if _hashed is None:
+        hashed_files = getattr(staticfiles_storage, "hashed_files", {})
+        _hashed = frozenset(v for k, v in hashed_files.items() if k != v)
+    return _hashed
+
+
+def _accepted(headers):
+    for key, value in headers:
+        if key == b"accept-encoding":
+            return {token.split(b";")[0].strip() for token in value.lower().split(b",")}
+    return set()
+
+
+def _header(headers, name):
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+class StaticFilesApp:
+    """ASGI middleware answering ``STATIC_URL`` requests ahead of Django."""
+
+    def __init__(self, app):
+        self.app = app
+        self.prefix = settings.STATIC_URL if settings.STATIC_URL.startswith("/") else "/" + settings.STATIC_URL
+        self.assets = {}  # name -> Asset, for files that exist only
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            return await self.app(scope, receive, send)
+        if scope["method"] not in ("GET", "HEAD"):
+            return await self._respond(send, 405, [(b"allow", b"GET, HEAD")])
+
+        name = scope["path"][len(self.prefix):]
+        # One spelling per file, so the cache below holds each file once.
+        if not name or posixpath.normpath(name) != name or name.startswith(("/", "..")):
+            return await self._respond(send, 404)
+        asset = self.assets.get(name)
+        if asset is None:
+            asset = await asyncio.get_running_loop().run_in_executor(None, load_asset, name)
+            if asset is None:
+                # Misses are not remembered: request paths are arbitrary.
+                return await self._respond(send, 404)
+            # Re-read on every request while developing.
+            if not settings.DEBUG and len(self.assets) < MAX_CACHED_ASSETS:
+                self.assets[name] = asset
+
+        headers = [
+            (b"cache-control", asset.cache_control),
+            (b"etag", asset.etag),
+            (b"vary", b"Accept-Encoding"),
+        ]
+        if _header(scope["headers"], b"if-none-match") == asset.etag:
+            return await self._respond(send, 304, headers)
+
+        accepted = _accepted(scope["headers"])
+        encoding = next((e for e in ("br", "gzip") if e in asset.bodies and e.encode() in accepted), "identity")
+        body = asset.bodies[encoding]
+        headers += [(b"content-type", asset.content_type), (b"content-length", str(len(body)).encode())]
+        if encoding != "identity":
+            headers.append((b"content-encoding", encoding.encode()))
+        await self._respond(send, 200, headers, b"" if scope["method"] == "HEAD" else body)
+
+    @staticmethod
+    async def _respond(send, status, headers=(), body=b""):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        await send({"type": "http.response.body", "body": body})
@@ -1,3 +1,681 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import time
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from chat import archive, attachments, deletion, membership, search, sessions
+from chat.activity import RoomActivity
+from chat.consumers import CallConsumer, ChatConsumer
+from chat.dispatch import direct_room, group_room
+from chat.fakeredis import FakeRedisServer
+from chat.layers import RedisChannelLayer
+from chat.models import (
+    ArchiveBlock,
+    Attachment,
+    Conversation,
+    Group,
+    GroupMessage,
+    Message,
+    ReadMarker,
+    RoomSequence,
+)
+from chat.pagination import MAX_PAGE_SIZE, PAGE_SIZE, conversation_page, decode_cursor, encode_cursor, parse_limit
+from chat.pipeline import MessageWriter, PendingMessage, persist_batch
+from chat.resp import RedisConnection, RedisError, read_reply, read_reply_sync
+
+
+# ============================
+# Write pipeline
+# ============================
+class PipelineTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.group = Group.objects.create(name="g")
+        self.group.members.add(self.alice, self.bob)
+        # Channel-layer group names, as ChatConsumer passes them.
+        self.dm = direct_room(self.alice.username, self.bob.username)
+        self.room = group_room(self.group.id)
+
+    def pending(self, client_id, group=False):
+        if group:
+            return PendingMessage(self.room, client_id, self.alice, client_id, group_id=self.group.id)
+        return PendingMessage(self.dm, client_id, self.alice, client_id, receiver_id=self.bob.id)
+
+    def test_persist_batch_keeps_order_and_numbers_each_room(self):
+        batch = [self.pending("d1"), self.pending("g1", True), self.pending("d2"), self.pending("g2", True)]
+        instances = persist_batch(batch)
+
+        self.assertEqual([m.text for m in instances], ["d1", "g1", "d2", "g2"])
+        self.assertTrue(all(m.pk for m in instances))
+        self.assertEqual([m.seq for m in instances], [1, 1, 2, 2])
+        persist_batch([self.pending("d3")])
+        self.assertEqual(list(Message.objects.order_by("seq").values_list("text", "seq")), [("d1", 1), ("d2", 2), ("d3", 3)])
+        self.assertEqual(list(GroupMessage.objects.order_by("seq").values_list("text", flat=True)), ["g1", "g2"])
+
+        summary = Conversation.objects.get(owner=self.bob, peer=self.alice)
+        self.assertEqual((summary.preview, summary.unread_count), ("d3", 3))
+
+    async def receive(self, layer, channel):
+        event = await asyncio.wait_for(layer.receive(channel), 5)
+        return event["type"], json.loads(event["frame"])
+
+    async def test_writer_confirms_client_ids_per_room_in_order(self):
+        layer = get_channel_layer()
+        dm_channel, group_channel = await layer.new_channel(), await layer.new_channel()
+        await layer.group_add(self.dm, dm_channel)
+        await layer.group_add(self.room, group_channel)
+
+        writer = MessageWriter(batch_size=10, window=0.05)
+        for pending in [self.pending("a"), self.pending("x", True), self.pending("b"), self.pending("c")]:
+            await writer.submit(pending)
+
+        event_type, frame = await self.receive(layer, dm_channel)
+        self.assertEqual(event_type, "chat_confirm")
+        self.assertEqual([m["client_id"] for m in frame["messages"]], ["a", "b", "c"])
+        self.assertEqual([m["seq"] for m in frame["messages"]], [1, 2, 3])
+        ids = [m["id"] for m in frame["messages"]]
+        self.assertEqual(ids, sorted(ids))
+
+        event_type, frame = await self.receive(layer, group_channel)
+        self.assertEqual(event_type, "chat_confirm")
+        self.assertEqual([m["client_id"] for m in frame["messages"]], ["x"])
+        writer._task.cancel()
+
+    async def test_writer_reports_a_failed_batch(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(self.dm, channel)
+
+        writer = MessageWriter(window=0.05)
+        with mock.patch("chat.pipeline.persist_batch", side_effect=RuntimeError("db down")), \
+                self.assertLogs("chat.pipeline", "ERROR"):
+            await writer.submit(self.pending("a"))
+            await writer.submit(self.pending("b"))
+            event_type, frame = await self.receive(layer, channel)
+        self.assertEqual(event_type, "chat_failed")
+        self.assertEqual(frame, {"type": "failed", "client_ids": ["a", "b"]})
+        writer._task.cancel()
+
+
+# ============================
+# History pagination
+# ============================
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.start = timezone.now() - timedelta(days=1)
+
+    def send(self, sender, receiver, count, same_time=False):
+        messages = []
+        for i in range(count):
+            message = Message.objects.create(sender=sender, receiver=receiver, text=f"{sender.username} {i}")
+            offset = Message.objects.count() if not same_time else 0
+            Message.objects.filter(pk=message.pk).update(timestamp=self.start + timedelta(minutes=offset))
+            messages.append(message.pk)
+        return messages
+
+    def walk(self, user, other, limit):
+        ids, before = [], None
+        while True:
+            page, next_cursor = conversation_page(Message.objects, user, other, before, limit)
+            self.assertLessEqual(len(page), limit)
+            ids = [m.id for m in page] + ids
+            if next_cursor is None:
+                return ids
+            before = decode_cursor(next_cursor)
+
+    def test_pages_merge_both_directions(self):
+        expected = []
+        for _ in range(4):
+            expected += self.send(self.alice, self.bob, 1) + self.send(self.bob, self.alice, 2)
+        self.assertEqual(self.walk(self.alice, self.bob, 5), expected)
+        self.assertEqual(self.walk(self.bob, self.alice, 1), expected)
+
+    def test_equal_timestamps_page_by_id(self):
+        expected = self.send(self.alice, self.bob, 7, same_time=True)
+        self.assertEqual(self.walk(self.alice, self.bob, 3), expected)
+
+    def test_notes_to_self_come_back_once(self):
+        expected = self.send(self.alice, self.alice, 5)
+        page, next_cursor = conversation_page(Message.objects, self.alice, self.alice, limit=10)
+        self.assertEqual([m.id for m in page], expected)
+        self.assertIsNone(next_cursor)
+        self.assertEqual(self.walk(self.alice, self.alice, 2), expected)
+
+    def test_cursor_round_trip_and_garbage(self):
+        message = Message.objects.get(pk=self.send(self.alice, self.bob, 1)[0])
+        self.assertEqual(decode_cursor(encode_cursor(message)), (message.timestamp, message.id))
+        for cursor in ("", "not a cursor", "%%%", encode_cursor(message)[:-3]):
+            with self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+    def test_parse_limit_clamps(self):
+        self.assertEqual(parse_limit(None), PAGE_SIZE)
+        self.assertEqual(parse_limit("abc"), PAGE_SIZE)
+        self.assertEqual(parse_limit("0"), 1)
+        self.assertEqual(parse_limit("-5"), 1)
+        self.assertEqual(parse_limit(str(MAX_PAGE_SIZE + 1)), MAX_PAGE_SIZE)
+
+    def history(self, other, **params):
+        client = Client()
+        client.force_login(self.alice)
+        return client.get(f"/chat/{other.username}/history/", params)
+
+    def test_history_rejects_an_invalid_cursor(self):
+        response = self.history(self.bob, before="garbage")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "invalid cursor"})
+
+    def test_history_falls_through_to_the_archive(self):
+        expected = []
+        for _ in range(3):
+            expected += self.send(self.alice, self.bob, 1) + self.send(self.bob, self.alice, 1)
+        room = RoomSequence.direct_key(self.alice.id, self.bob.id)
+        horizon = Message.objects.get(pk=expected[3]).timestamp
+        self.assertEqual(archive.archive_room(room, horizon, block_size=2), 3)
+        self.assertEqual(ArchiveBlock.objects.filter(room=room).count(), 2)
+
+        ids, before = [], None
+        while True:
+            params = {"limit": 2, **({"before": before} if before else {})}
+            body = self.history(self.bob, **params).json()
+            ids = [m["id"] for m in body["messages"]] + ids
+            before = body["next"]
+            if before is None:
+                break
+        self.assertEqual(ids, expected)
+
+    def test_full_live_page_leaves_the_archive_for_the_next_request(self):
+        archived = self.send(self.alice, self.bob, 3)
+        live = self.send(self.bob, self.alice, 2)
+        room = RoomSequence.direct_key(self.alice.id, self.bob.id)
+        archive.archive_room(room, Message.objects.get(pk=live[0]).timestamp)
+
+        body = self.history(self.bob, limit=2).json()
+        self.assertEqual([m["id"] for m in body["messages"]], live)
+        self.assertIsNotNone(body["next"])
+        body = self.history(self.bob, limit=2, before=body["next"]).json()
+        self.assertEqual([m["id"] for m in body["messages"]], archived[1:])
+        body = self.history(self.bob, limit=2, before=body["next"]).json()
+        self.assertEqual(([m["id"] for m in body["messages"]], body["next"]), (archived[:1], None))
+        self.assertEqual(archive.page(room, None, 0), ([], True))
+
+    def test_full_live_page_without_an_archive_is_the_last(self):
+        self.send(self.alice, self.bob, 2)
+        self.assertIsNone(self.history(self.bob, limit=2).json()["next"])
+
+
+# ============================
+# Read receipts
+# ============================
+class ReadMarkerTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.room = direct_room(self.alice.username, self.bob.username)
+        self.key = RoomSequence.direct_key(self.alice.id, self.bob.id)
+        for _ in range(3):
+            Message.objects.create(sender=self.bob, receiver=self.alice, text="hi")
+
+    def test_one_bad_marker_does_not_drop_the_rest(self):
+        with self.assertLogs("chat.models", "ERROR"):
+            ReadMarker.objects.advance({(self.alice.id, self.key): 10**30, (self.bob.id, self.key): 2})
+        self.assertEqual(list(ReadMarker.objects.values_list("user", "seq")), [(self.bob.id, 2)])
+
+    async def test_marks_are_capped_at_the_last_message(self):
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(self.room, channel)
+
+        activity = RoomActivity(interval=0.05)
+        activity.read(self.room, self.alice, self.key, 2**62, peer_id=self.bob.id)
+        event = await asyncio.wait_for(layer.receive(channel), 5)
+        self.assertEqual(json.loads(event["frame"])["read"], {"alice": 3})
+        activity.read(self.room, self.bob, "dm:0:0", 7)
+        await asyncio.sleep(0.2)
+        activity._task.cancel()
+
+        markers = ReadMarker.objects.values_list("user", "room", "seq")
+        self.assertEqual([m async for m in markers], [(self.alice.id, self.key, 3)])
+
+
+# ============================
+# Attachments
+# ============================
+@override_settings(CHAT_ATTACHMENT_MAX_BYTES=1000)
+class AttachmentTests(TransactionTestCase):
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = override_settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+
+    def client_for(self, user, csrf=False):
+        client = Client(enforce_csrf_checks=csrf)
+        client.force_login(user)
+        return client
+
+    def files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, names in os.walk(self.media) for name in names
+        )
+
+    def upload(self, client, content, name="note.txt", **extra):
+        return client.post("/attachments/", {"file": SimpleUploadedFile(name, content, "text/plain")}, **extra)
+
+    def test_upload_stores_the_row_and_one_blob_per_content(self):
+        client = self.client_for(self.alice)
+        first = self.upload(client, b"hello")
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(first.json()["name"], "note.txt")
+        second = self.upload(client, b"hello", name="copy.txt")
+        self.assertEqual(second.status_code, 201)
+
+        sha = Attachment.objects.get(pk=first.json()["id"]).sha256
+        self.assertEqual(Attachment.objects.filter(sha256=sha).count(), 2)
+        self.assertEqual(self.files(), [os.path.relpath(attachments.blob_path(sha), self.media)])
+        with open(attachments.blob_path(sha), "rb") as f:
+            self.assertEqual(f.read(), b"hello")
+
+    def test_rejected_uploads_leave_nothing_behind(self):
+        self.assertEqual(self.upload(self.client_for(self.alice), b"x" * 5000).status_code, 413)
+        self.assertEqual(self.upload(self.client_for(self.alice, csrf=True), b"no token").status_code, 403)
+        self.assertEqual(self.client_for(self.alice).post("/attachments/", {}).status_code, 400)
+
+        client = self.client_for(self.bob)
+        response = client.post("/profile/", {"bio": "hi", "avatar": SimpleUploadedFile("a.txt", b"text", "text/plain")})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Attachment.objects.exists())
+        self.assertEqual(self.files(), [])
+
+    def test_only_participants_can_fetch_a_file(self):
+        attachment_id = self.upload(self.client_for(self.alice), b"secret").json()["id"]
+        url = f"/attachments/{attachment_id}/"
+        self.assertEqual(self.client_for(self.bob).get(url).status_code, 404)
+
+        Message.objects.create(sender=self.alice, receiver=self.bob, text="", attachment_id=attachment_id)
+        response = self.client_for(self.bob).get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(asyncio.run(self.collect(response))), b"secret")
+        self.assertEqual(self.client_for(self.bob).get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+        self.assertEqual(self.client_for(self.carol).get(url).status_code, 404)
+
+    def test_participants_can_fetch_files_of_archived_messages(self):
+        direct = self.upload(self.client_for(self.alice), b"old direct").json()["id"]
+        grouped = self.upload(self.client_for(self.alice), b"old group").json()["id"]
+        group = Group.objects.create(name="g")
+        group.members.add(self.alice, self.bob)
+        Message.objects.create(sender=self.alice, receiver=self.bob, text="", attachment_id=direct)
+        GroupMessage.objects.create(group=group, sender=self.alice, text="", attachment_id=grouped)
+
+        horizon = timezone.now() + timedelta(seconds=1)
+        archive.archive_room(RoomSequence.direct_key(self.alice.id, self.bob.id), horizon)
+        archive.archive_room(RoomSequence.group_key(group.id), horizon)
+        self.assertFalse(Message.objects.exists() or GroupMessage.objects.exists())
+
+        for attachment_id in (direct, grouped):
+            url = f"/attachments/{attachment_id}/"
+            self.assertEqual(self.client_for(self.bob).get(url).status_code, 200)
+            self.assertEqual(self.client_for(self.carol).get(url).status_code, 404)
+        group.members.remove(self.bob)
+        self.assertEqual(self.client_for(self.bob).get(f"/attachments/{grouped}/").status_code, 404)
+
+    @staticmethod
+    async def collect(response):
+        return [chunk async for chunk in response.streaming_content]
+
+    def test_purge_removes_files_nobody_else_uploaded(self):
+        mine = Attachment.objects.get(pk=self.upload(self.client_for(self.alice), b"only mine").json()["id"])
+        shared = Attachment.objects.get(pk=self.upload(self.client_for(self.alice), b"shared").json()["id"])
+        self.upload(self.client_for(self.bob), b"shared")
+
+        deletion.purge(self.alice.id, pause=0)
+        self.assertFalse(os.path.exists(attachments.blob_path(mine.sha256)))
+        self.assertTrue(os.path.exists(attachments.blob_path(shared.sha256)))
+        self.assertEqual(list(Attachment.objects.values_list("uploader", flat=True)), [self.bob.id])
+
+
+# ============================
+# Sessions
+# ============================
+class SessionCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.client = Client()
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get("/").status_code, 200)
+        self.key = self.client.session.session_key
+        self.addCleanup(sessions.session_users.clear)
+
+    def session_cached(self):
+        return caches[settings.SESSION_CACHE_ALIAS].has_key(cached_db.KEY_PREFIX + self.key)
+
+    def test_logout_forgets_the_session(self):
+        self.assertEqual(sessions.cached_user(self.key), self.alice)
+        self.assertTrue(self.session_cached())
+
+        self.client.post("/logout/")
+        self.assertIsNone(sessions.session_users.get(self.key))
+        self.assertFalse(self.session_cached())
+        self.assertIsNone(sessions.cached_user(self.key))
+
+    def test_deletion_forgets_the_users_sessions(self):
+        with mock.patch.object(deletion.executor, "submit"):
+            deletion.request_deletion(self.alice)
+        self.assertIsNone(sessions.cached_user(self.key))
+        self.assertEqual(self.client.get("/").status_code, 302)
+
+
+class SharedSessionCacheTests(SessionCacheTests):
+    """The same, with the session cache in Redis as under ``REDIS_URL``."""
+
+    def setUp(self):
+        server = FakeRedisServer().start()
+        self.addCleanup(server.stop)
+        shared = {"BACKEND": "chat.rediscache.RedisCache", "LOCATION": server.url}
+        override = override_settings(CACHES={**settings.CACHES, "sessions": shared})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.server = server
+        super().setUp()
+
+    def test_a_flush_elsewhere_drops_the_cached_user(self):
+        # Another worker logging the session out only reaches the shared cache.
+        caches[settings.SESSION_CACHE_ALIAS].delete(cached_db.KEY_PREFIX + self.key)
+        self.assertIsNotNone(sessions.session_users.get(self.key))
+        self.assertIsNone(async_to_sync(sessions.acached_user)(self.key))
+        self.assertIsNone(sessions.session_users.get(self.key))
+
+    def test_a_deletion_elsewhere_drops_the_cached_user(self):
+        cached = sessions.session_users.get(self.key)
+        with mock.patch.object(deletion.executor, "submit"):
+            deletion.request_deletion(self.alice)
+        # As this worker's entry would still be, had the request gone elsewhere.
+        sessions.session_users.set(self.key, cached)
+        self.assertIsNone(sessions.cached_user(self.key))
+
+    def test_cache_operations(self):
+        cache = caches[settings.SESSION_CACHE_ALIAS]
+        self.assertTrue(cache.add("a", {"n": 1}))
+        self.assertFalse(cache.add("a", {"n": 2}))
+        self.assertEqual(cache.get("a"), {"n": 1})
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": {"n": 1}})
+        self.assertEqual(async_to_sync(cache.aget_many)(["a", "b"]), {"a": {"n": 1}})
+        self.assertIn(cache.make_key("a"), self.server.expires)
+        self.assertTrue(cache.touch("a", None))
+        self.assertNotIn(cache.make_key("a"), self.server.expires)
+        cache.set("b", 2, timeout=0)
+        self.assertFalse(cache.has_key("b"))
+        self.assertTrue(cache.delete("a"))
+        self.assertIsNone(cache.get("a"))
+        cache.set("c", 3)
+        self.server.data["unrelated"] = "kept"
+        cache.clear()
+        self.assertIsNone(cache.get("c"))
+        self.assertIn("unrelated", self.server.data)
+
+
+# ============================
+# Group membership
+# ============================
+class MembershipTests(TransactionTestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.group = Group.objects.create(name="g")
+        self.group.members.add(self.alice)
+        self.addCleanup(membership.memberships.clear)
+
+    def get(self, user, path):
+        client = Client()
+        client.force_login(user)
+        return client.get(f"/group/{self.group.id}/{path}").status_code
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f"/ws/group/{self.group.id}/")
+        communicator.scope["user"] = user
+        communicator.scope["url_route"] = {"kwargs": {"group_id": str(self.group.id)}}
+        connected, _ = await communicator.connect()
+        if connected:
+            await communicator.disconnect()
+        return connected
+
+    def test_non_members_get_404(self):
+        self.assertEqual(self.get(self.alice, ""), 200)
+        self.assertEqual(self.get(self.alice, "history/"), 200)
+        self.assertEqual(self.get(self.bob, ""), 404)
+        self.assertEqual(self.get(self.bob, "history/"), 404)
+
+    def test_non_member_sockets_are_closed(self):
+        self.assertTrue(async_to_sync(self.connect)(self.alice))
+        self.assertFalse(async_to_sync(self.connect)(self.bob))
+
+    def test_removal_revokes_access_at_once(self):
+        self.assertTrue(membership.is_member(self.alice.id, self.group.id))
+        self.group.members.remove(self.alice)
+        self.assertIsNone(membership.memberships.get(self.alice.id))
+        self.assertFalse(membership.is_member(self.alice.id, self.group.id))
+        self.assertEqual(self.get(self.alice, "history/"), 404)
+        self.assertFalse(async_to_sync(self.connect)(self.alice))
+
+    def test_clearing_a_users_groups_revokes_access_at_once(self):
+        self.assertTrue(membership.is_member(self.alice.id, self.group.id))
+        self.alice.chat_groups.clear()
+        self.assertIsNone(membership.memberships.get(self.alice.id))
+        self.assertFalse(membership.is_member(self.alice.id, self.group.id))
+        self.assertEqual(self.get(self.alice, ""), 404)
+
+
+# ============================
+# Channel layer
+# ============================
+class RedisLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FakeRedisServer().start()
+        self.addCleanup(self.server.stop)
+
+    def layer(self, **config):
+        return RedisChannelLayer(hosts=[self.server.url], receive_timeout=1, **config)
+
+    async def test_send_and_receive(self):
+        layer = self.layer()
+        await layer.send("test.a", {"type": "hello", "n": 1})
+        self.assertEqual(await layer.receive("test.a"), {"type": "hello", "n": 1})
+        await layer.close()
+
+    async def test_group_add_send_and_discard(self):
+        layer = self.layer()
+        first, second = await layer.new_channel(), await layer.new_channel()
+        await layer.group_add("room", first)
+        await layer.group_add("room", second)
+        await layer.group_send("room", {"type": "chat", "text": "hi"})
+        self.assertEqual(await layer.receive(first), {"type": "chat", "text": "hi"})
+        self.assertEqual(await layer.receive(second), {"type": "chat", "text": "hi"})
+
+        await layer.group_discard("room", second)
+        await layer.group_send("room", {"type": "chat", "text": "again"})
+        self.assertEqual(await layer.receive(first), {"type": "chat", "text": "again"})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(second), 0.2)
+        await layer.close()
+
+    async def test_full_channel_raises(self):
+        layer = self.layer(capacity=2)
+        await layer.send("test.full", {"type": "m"})
+        await layer.send("test.full", {"type": "m"})
+        with self.assertRaises(ChannelFull):
+            await layer.send("test.full", {"type": "m"})
+        await layer.close()
+
+    async def test_stale_group_members_expire(self):
+        layer = self.layer(group_expiry=60)
+        channel = await layer.new_channel()
+        await layer.group_add("room", channel)
+        with mock.patch("chat.layers.time.time", return_value=time.time() + 120):
+            await layer.group_send("room", {"type": "chat"})
+        self.assertNotIn(layer._group_key("room"), self.server.data)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.2)
+        await layer.close()
+
+    REPLIES = b"-ERR boom\r\n$5\r\nhello\r\n$-1\r\n*2\r\n:7\r\n$0\r\n\r\n*-1\r\n+OK\r\n"
+
+    def check_replies(self, replies):
+        error, *rest = replies
+        self.assertIsInstance(error, RedisError)
+        self.assertEqual(str(error), "ERR boom")
+        self.assertEqual(rest, ["hello", None, [7, ""], None, "OK"])
+
+    async def test_reply_parsing(self):
+        reader = asyncio.StreamReader()
+        reader.feed_data(self.REPLIES)
+        reader.feed_eof()
+        self.check_replies([await read_reply(reader) for _ in range(6)])
+        with self.assertRaises(ConnectionError):
+            await read_reply(reader)
+
+        reader = io.BytesIO(self.REPLIES)
+        self.check_replies([read_reply_sync(reader) for _ in range(6)])
+        with self.assertRaises(ConnectionError):
+            read_reply_sync(reader)
+
+    async def test_errors_raise_and_leave_the_connection_usable(self):
+        conn = await RedisConnection.open(self.server.host, self.server.port)
+        with self.assertRaisesMessage(RedisError, "unknown command"):
+            await conn.execute("NOSUCH")
+        with self.assertRaises(RedisError):
+            await conn.pipeline([("SET", "k", "v"), ("NOSUCH",)])
+        self.assertEqual(await conn.execute("GET", "k"), "v")
+        conn.close()
+
+
+# ============================
+# Search
+# ============================
+class SearchTests(TransactionTestCase):
+    def setUp(self):
+        # chat_search is not a model table, so flushing leaves its rows.
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM chat_search")
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        self.ours = Group.objects.create(name="ours")
+        self.ours.members.add(self.alice, self.bob)
+        self.theirs = Group.objects.create(name="theirs")
+        self.theirs.members.add(self.bob, self.carol)
+
+    def texts(self, user, query):
+        return sorted(m.text for m in search.search(user, query)[0])
+
+    def index_rows(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM chat_search")
+            return cursor.fetchone()[0]
+
+    def test_results_are_scoped_to_the_users_chats(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, text="pizza tonight")
+        Message.objects.create(sender=self.bob, receiver=self.carol, text="pizza without alice")
+        GroupMessage.objects.create(group=self.ours, sender=self.bob, text="pizza for the group")
+        GroupMessage.objects.create(group=self.theirs, sender=self.carol, text="secret pizza")
+
+        self.assertEqual(self.texts(self.alice, "pizza"), ["pizza for the group", "pizza tonight"])
+        self.assertEqual(self.texts(self.carol, "pizza"), ["pizza without alice", "secret pizza"])
+
+    def test_the_last_word_matches_as_a_prefix(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, text="pizza tonight")
+        self.assertEqual(self.texts(self.alice, "piz"), ["pizza tonight"])
+        self.assertEqual(self.texts(self.alice, "pizza to"), ["pizza tonight"])
+        self.assertEqual(self.texts(self.alice, "piz tonight"), [])
+
+    def test_junk_and_operators_are_not_errors(self):
+        Message.objects.create(sender=self.alice, receiver=self.bob, text="pizza tonight")
+        client = Client()
+        client.force_login(self.alice)
+        self.assertEqual(self.texts(self.alice, 'pizza"'), ["pizza tonight"])
+        for query in ['"', "AND", "OR NOT", "*", "NEAR(", "text:", "scope : u1", "-", "'", "\u00e9\u00e8"]:
+            with self.subTest(query=query):
+                self.assertEqual(self.texts(self.alice, query), [])
+                response = client.get("/search/", {"q": query})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.json()["results"], [])
+
+    def test_edits_and_deletes_update_the_index(self):
+        message = Message.objects.create(sender=self.alice, receiver=self.bob, text="pizza tonight")
+        grouped = GroupMessage.objects.create(group=self.ours, sender=self.bob, text="pizza for the group")
+        message.text = "sushi tonight"
+        message.save()
+        self.assertEqual(self.texts(self.alice, "pizza"), ["pizza for the group"])
+        self.assertEqual(self.texts(self.alice, "sushi"), ["sushi tonight"])
+        self.assertEqual(self.index_rows(), 2)
+
+        message.delete()
+        grouped.delete()
+        self.assertEqual(self.index_rows(), 0)
+
+        # Deleting a group cascades to its messages.
+        GroupMessage.objects.create(group=self.ours, sender=self.bob, text="pizza again")
+        self.ours.delete()
+        self.assertEqual(self.index_rows(), 0)
+
+
+# ============================
+# Calls
+# ============================
+class CallSocketTests(SimpleTestCase):
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(CallConsumer.as_asgi(), "/ws/call/alice/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        await communicator.disconnect()
+        return connected
+
+    async def test_anonymous_sockets_are_closed(self):
+        self.assertFalse(await self.connect(AnonymousUser()))
+        self.assertTrue(await self.connect(User(id=1, username="alice")))
+
+
+# ============================
+# Metrics
+# ============================
+class MetricsViewTests(SimpleTestCase):
+    def scrape(self, **headers):
+        return self.client.get("/metrics/", headers=headers).status_code
+
+    def test_requires_the_bearer_token(self):
+        with override_settings(CHAT_METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.scrape(authorization="Bearer s3cret"), 200)
+            self.assertEqual(self.scrape(authorization="Bearer wrong"), 404)
+            self.assertEqual(self.scrape(), 404)
+            # The client address no longer counts, e.g. behind a proxy.
+            self.assertEqual(self.client.get("/metrics/", REMOTE_ADDR="127.0.0.1").status_code, 404)
+
+    @override_settings(CHAT_METRICS_TOKEN="")
+    def test_disabled_without_a_token(self):
+        self.assertEqual(self.scrape(authorization="Bearer "), 404)
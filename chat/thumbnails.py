@@ -0,0 +1,22 @@
+"""
+Thumbnail rendering, run in chat.attachments' process pool.
+
+Kept free of Django imports: the pool starts fresh ("spawn") interpreters,
+and this module is all they need to load.
+"""
+import os
+
+
+def make_thumbnail(source, target, size):
+    """Write a JPEG of ``source`` fitting ``size`` x ``size`` to ``target``; returns the original (width, height)."""
+    from PIL import Image
+
+    with Image.open(source) as image:
+        width, height = image.size
+        image.thumbnail((size, size))
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        partial = f"{target}.{os.getpid()}.tmp"
+        image.save(partial, "JPEG", quality=80)
+    os.replace(partial, target)
+    return width, height
@@ -5,7 +5,18 @@ from . import views
 urlpatterns = [
     path("", views.inbox, name="inbox"),
     path("chat/<str:username>/", views.chatroom, name="chatroom"),
+    path("chat/<str:username>/history/", views.chat_history, name="chat_history"),
+    path("chat/<str:username>/send/", views.send_message, name="send_message"),
     path("group/<int:group_id>/", views.group_chatroom, name="group_chatroom"),
+    path("group/<int:group_id>/history/", views.group_history, name="group_history"),
+    path("group/<int:group_id>/send/", views.group_send, name="group_send"),
+    path("attachments/", views.upload_attachment, name="upload_attachment"),
+    path("attachments/<int:attachment_id>/", views.attachment_file, name="attachment_file"),
+    path("attachments/<int:attachment_id>/thumbnail/", views.attachment_file, {"thumbnail": True}, name="attachment_thumbnail"),
+    path("profile/", views.edit_profile, name="edit_profile"),
+    path("search/", views.search_messages, name="search_messages"),
+    path("export/", views.export_messages, name="export_messages"),
+    path("metrics/", views.metrics_view, name="metrics"),
     path("create_group/", views.create_group, name="create_group"),
     path("delete_user/<int:user_id>/", views.delete_user, name="delete_user"),
     path("login/", auth_views.LoginView.as_view(template_name="login.html"), name="login"),
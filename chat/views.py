@@ -1,98 +1,355 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import hmac
+import os
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth import logout
 from django.contrib.auth.forms import UserCreationForm
-from chat.models import Message, Group, GroupMessage
-
-# ⭐ NEW IMPORTS FOR REAL-TIME BROADCASTING
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+from django.contrib.auth.views import redirect_to_login
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseForbidden,
+    HttpResponseNotModified,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.utils import timezone
+from django.utils.http import content_disposition_header
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from chat import archive, attachments, deletion, export, history, jsonenc, membership, metrics, presence, search
+from chat.db import database_sync_to_async
+from chat.dispatch import asave
+from chat.forms import ProfileForm
+from chat.models import Attachment, Conversation, Message, Group, GroupMessage, Profile, ReadMarker, RoomSequence
+from chat.pagination import (
+    conversation_page,
+    decode_cursor,
+    encode_cursor,
+    group_page,
+    message_to_dict,
+    parse_limit,
+)
 
 
-@login_required
-def inbox(request):
-    messages = Message.objects.filter(receiver=request.user) | Message.objects.filter(sender=request.user)
-    groups = request.user.chat_groups.all()
+def alogin_required(view):
+    """``login_required`` for async views, which Django 5.0's decorator can't wrap."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        # Templates read request.user; don't leave it to a sync lazy lookup.
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+@alogin_required
+async def inbox(request):
+    conversations = [
+        c async for c in request.user.conversations.select_related("peer__profile__avatar").order_by("-last_timestamp")
+    ]
+    online_ids = await presence.aonline(c.peer_id for c in conversations)
+    for conversation in conversations:
+        conversation.peer_online = conversation.peer_id in online_ids
+        conversation.peer_avatar = _avatar(conversation.peer)
+    groups = [group async for group in request.user.chat_groups.all()]
     return render(request, "inbox.html", {
-        "messages": messages.order_by("-timestamp"),
+        "conversations": conversations,
         "groups": groups,
     })
 
 
-@login_required
-def chatroom(request, username):
-    other_user = get_object_or_404(User, username=username)
+def _avatar(user):
+    """Metadata of a user's avatar (``profile`` must already be loaded), or None."""
+    try:
+        return attachments.to_dict(user.profile.avatar)
+    except Profile.DoesNotExist:
+        return None
+
+
+def _read_markers(room, viewer) -> dict:
+    """{username: seq} for everyone but ``viewer`` who has read in ``room``."""
+    return dict(
+        ReadMarker.objects.filter(room=room).exclude(user=viewer).values_list("user__username", "seq")
+    )
+
+
+@database_sync_to_async
+def _conversation_context(user, other_user) -> dict:
+    # Complete chunks come from the history cache; only the tail is rendered.
+    history_html, next_cursor = history.for_conversation(user, other_user).render()
+    Conversation.objects.mark_read(user, other_user)
+    return {
+        "history": history_html,
+        "next_cursor": next_cursor,
+        "other_user": other_user,
+        "read_markers": _read_markers(RoomSequence.direct_key(user.id, other_user.id), user),
+    }
+
+
+@alogin_required
+async def chatroom(request, username):
+    other_user = await aget_object_or_404(User, username=username)
 
     if request.method == "POST":
         text = request.POST.get("text")
         if text:
-            # Save message to DB
-            Message.objects.create(sender=request.user, receiver=other_user, text=text)
-
-            # ⭐ REAL-TIME BROADCAST
-            room_group = (
-                f"chat_{min(request.user.username, other_user.username)}_"
-                f"{max(request.user.username, other_user.username)}"
-            )
-
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                room_group,
-                {
-                    "type": "chat_message",
-                    "sender": request.user.username,
-                    "text": text,
-                    "timestamp": timezone.now().strftime("%b. %d, %Y, %-I:%M %p"),
-                }
-            )
+            await asave(Message, sender=request.user, receiver=other_user, text=text)
 
         return redirect("chatroom", username=other_user.username)
 
-    messages = Message.objects.filter(
-        sender=request.user, receiver=other_user
-    ) | Message.objects.filter(
-        sender=other_user, receiver=request.user
-    )
+    return render(request, "chatroom.html", await _conversation_context(request.user, other_user))
 
-    return render(request, "chatroom.html", {
-        "messages": messages.order_by("timestamp"),
-        "other_user": other_user,
+
+async def _posted_message(request):
+    """
+    ``{"text", "attachment"}`` of a JSON send request, or None without
+    either. An attachment must be one the sender uploaded.
+    """
+    try:
+        body = jsonenc.loads(request.body)
+        text, attachment_id = body.get("text"), body.get("attachment")
+    except (ValueError, AttributeError):
+        return None
+    attachment = None
+    if attachment_id is not None:
+        attachment = await attachments.aowned(request.user, attachment_id)
+        if attachment is None:
+            return None
+    if not (isinstance(text, str) and text.strip()):
+        if attachment is None:
+            return None
+        text = ""
+    return {"text": text, "attachment": attachment}
+
+
+@require_POST
+@alogin_required
+async def send_message(request, username):
+    """Send a direct message; it reaches the page over the websocket like any other."""
+    other_user = await aget_object_or_404(User, username=username)
+    fields = await _posted_message(request)
+    if fields is None:
+        return JsonResponse({"error": "text or attachment required"}, status=400)
+    message = await asave(Message, sender=request.user, receiver=other_user, **fields)
+    return JsonResponse(message_to_dict(message), status=202)
+
+
+def _history_response(request, room, fetch_page):
+    before = request.GET.get("before")
+    try:
+        before = decode_cursor(before) if before else None
+    except ValueError:
+        return JsonResponse({"error": "invalid cursor"}, status=400)
+
+    limit = parse_limit(request.GET.get("limit"))
+    messages, next_cursor = fetch_page(before, limit)
+    if next_cursor is None:
+        # Out of hot rows; anything older is in the archive.
+        if messages:
+            before = (messages[0].timestamp, messages[0].id)
+        if len(messages) < limit:
+            archived, more = archive.page(room, before, limit - len(messages))
+            messages = archived + messages
+        else:
+            more = archive.has_older(room, before)
+        if more:
+            next_cursor = encode_cursor(messages[0])
+    return JsonResponse({
+        "messages": [message_to_dict(m) for m in messages],
+        "next": next_cursor,
     })
 
 
 @login_required
-def group_chatroom(request, group_id):
-    group = get_object_or_404(Group, id=group_id)
+def chat_history(request, username):
+    other_user = get_object_or_404(User, username=username)
+    return _history_response(
+        request,
+        RoomSequence.direct_key(request.user.id, other_user.id),
+        lambda before, limit: conversation_page(Message.objects, request.user, other_user, before, limit),
+    )
+
+
+@database_sync_to_async
+def _group_context(user, group) -> dict:
+    history_html, next_cursor = history.for_group(group).render()
+    return {
+        "group": group,
+        "history": history_html,
+        "next_cursor": next_cursor,
+        "read_markers": _read_markers(RoomSequence.group_key(group.id), user),
+    }
+
+
+async def _member_group(request, group_id):
+    # Non-members get the same 404 as a missing group.
+    if not await membership.ais_member(request.user.id, group_id):
+        raise Http404
+    return await aget_object_or_404(Group, id=group_id)
+
+
+@alogin_required
+async def group_chatroom(request, group_id):
+    group = await _member_group(request, group_id)
 
     if request.method == "POST":
         text = request.POST.get("text")
         if text:
-            GroupMessage.objects.create(group=group, sender=request.user, text=text)
-
-            # ⭐ REAL-TIME BROADCAST FOR GROUPS
-            room_group = f"group_{group_id}"
-
-            channel_layer = get_channel_layer()
-            async_to_sync(channel_layer.group_send)(
-                room_group,
-                {
-                    "type": "chat_message",
-                    "sender": request.user.username,
-                    "text": text,
-                    "timestamp": timezone.now().strftime("%b. %d, %Y, %-I:%M %p"),
-                }
-            )
+            await asave(GroupMessage, group=group, sender=request.user, text=text)
 
         return redirect("group_chatroom", group_id=group.id)
 
-    return render(request, "group_chatroom.html", {
-        "group": group,
-        "messages": group.messages.order_by("timestamp"),
+    return render(request, "group_chatroom.html", await _group_context(request.user, group))
+
+
+@require_POST
+@alogin_required
+async def group_send(request, group_id):
+    group = await _member_group(request, group_id)
+    fields = await _posted_message(request)
+    if fields is None:
+        return JsonResponse({"error": "text or attachment required"}, status=400)
+    message = await asave(GroupMessage, group=group, sender=request.user, **fields)
+    return JsonResponse(message_to_dict(message), status=202)
+
+
+@login_required
+def group_history(request, group_id):
+    if not membership.is_member(request.user.id, group_id):
+        raise Http404
+    group = get_object_or_404(Group, id=group_id)
+    return _history_response(
+        request,
+        RoomSequence.group_key(group.id),
+        lambda before, limit: group_page(group.messages.all(), before, limit),
+    )
+
+
+@require_POST
+@alogin_required
+async def upload_attachment(request):
+    """Store the multipart ``file`` for a message to come; answers 201 with its metadata."""
+    failure = await sync_to_async(attachments.receive, thread_sensitive=False)(request)
+    if failure is not None:
+        return failure
+    upload = request.FILES.get("file")
+    if upload is None:
+        return JsonResponse({"error": "file required"}, status=400)
+    attachment = await attachments.acreate(request.user, upload)
+    return JsonResponse(attachments.to_dict(attachment), status=201)
+
+
+@login_required
+def attachment_file(request, attachment_id, thumbnail=False):
+    """
+    An attachment's file (or thumbnail), streamed off the event loop. The
+    content behind an id never changes, so browsers may keep it for good.
+    """
+    attachment = get_object_or_404(Attachment, id=attachment_id)
+    if not attachments.can_view(request.user, attachment):
+        raise Http404
+    if thumbnail:
+        path, content_type = attachments.thumbnail_path(attachment.sha256), "image/jpeg"
+    else:
+        path, content_type = attachments.blob_path(attachment.sha256), attachment.content_type
+    if not os.path.exists(path):
+        raise Http404
+
+    etag = f'"{attachment.sha256[:32]}{"-thumb" if thumbnail else ""}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        response = StreamingHttpResponse(export.astream(attachments.file_chunks(path)), content_type=content_type)
+        response["Content-Length"] = os.path.getsize(path)
+        inline = thumbnail or content_type in attachments.INLINE_TYPES
+        response["Content-Disposition"] = content_disposition_header(not inline, attachment.name)
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, max-age=31536000, immutable"
+    return response
+
+
+@database_sync_to_async
+def _profile(user):
+    Profile.objects.get_or_create(user=user)
+    return Profile.objects.select_related("avatar").get(user=user)
+
+
+@alogin_required
+async def edit_profile(request):
+    profile = await _profile(request.user)
+    if request.method == "POST":
+        failure = await sync_to_async(attachments.receive, thread_sensitive=False)(request)
+        if failure is not None:
+            return failure
+        form = ProfileForm(request.POST, request.FILES, instance=profile)
+        if await database_sync_to_async(form.is_valid)():
+            upload = form.cleaned_data["avatar"]
+            if upload:
+                profile.avatar = await attachments.acreate(request.user, upload)
+            await database_sync_to_async(form.save)()
+            return redirect("edit_profile")
+    else:
+        form = ProfileForm(instance=profile)
+    return render(request, "edit_profile.html", {"form": form, "avatar": attachments.to_dict(profile.avatar)})
+
+
+@login_required
+def search_messages(request):
+    """Ranked full-text search across the user's conversations and groups."""
+    try:
+        page = max(1, min(int(request.GET.get("page", 1)), search.MAX_PAGE))
+    except ValueError:
+        page = 1
+    limit = min(parse_limit(request.GET.get("limit"), search.RESULTS_PER_PAGE), search.MAX_RESULTS_PER_PAGE)
+
+    results, has_more = search.search(request.user, request.GET.get("q", ""), page, limit)
+    return JsonResponse({
+        "results": [search.result_to_dict(m, request.user) for m in results],
+        "page": page,
+        "next_page": page + 1 if has_more and page < search.MAX_PAGE else None,
     })
 
 
+@login_required
+def export_messages(request):
+    """
+    Download the user's whole history as NDJSON (``?gzip=1`` to compress).
+    Staff may export someone else's with ``?user=<username>``.
+    """
+    user = request.user
+    target = request.GET.get("user")
+    if target and target != user.username:
+        if not user.is_staff:
+            return HttpResponseForbidden()
+        user = get_object_or_404(User, username=target)
+
+    compress = request.GET.get("gzip") in ("1", "true")
+    filename = f"zaptalk-{user.username}-{timezone.now():%Y%m%d}.ndjson" + (".gz" if compress else "")
+    response = StreamingHttpResponse(
+        export.astream(export.export_chunks(user, compress)),
+        content_type="application/gzip" if compress else "application/x-ndjson",
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint; only answers the CHAT_METRICS_TOKEN bearer."""
+    token = settings.CHAT_METRICS_TOKEN
+    sent = request.headers.get("Authorization", "")
+    if not token or not hmac.compare_digest(sent.encode(), f"Bearer {token}".encode()):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 @login_required
 def create_group(request):
     if request.method == "POST":
@@ -107,8 +364,8 @@ def create_group(request):
 @login_required
 def delete_user(request, user_id):
     if request.user.id == user_id:
-        user = User.objects.get(id=user_id)
-        user.delete()
+        # Locks the account now; the messages are removed in the background.
+        deletion.request_deletion(request.user)
         logout(request)
         return redirect("login")
     return redirect("inbox")
@@ -1,7 +1,6 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "imessage_clone.settings")
 
@@ -9,10 +8,12 @@ django_asgi_app = get_asgi_application()
 
 # ⭐ IMPORTANT: import routing *after* Django loads
 import chat.routing
+from chat.sessions import CachedAuthMiddlewareStack
+from chat.staticfiles import StaticFilesApp
 
 application = ProtocolTypeRouter({
-    "http": django_asgi_app,
-    "websocket": AuthMiddlewareStack(
+    "http": StaticFilesApp(django_asgi_app),
+    "websocket": CachedAuthMiddlewareStack(
         URLRouter(chat.routing.websocket_urlpatterns)
     ),
 })
@@ -5,7 +5,17 @@ from django.contrib.auth import views as auth_views
 from chat.views import (
     inbox,
     chatroom,
+    chat_history,
+    send_message,
     group_chatroom,
+    group_history,
+    group_send,
+    upload_attachment,
+    attachment_file,
+    edit_profile,
+    search_messages,
+    export_messages,
+    metrics_view,
     create_group,
     delete_user,
     signup,
@@ -20,9 +30,30 @@ urlpatterns = [
 
     # 1-on-1 chat
     path("chat/<str:username>/", chatroom, name="chatroom"),
+    path("chat/<str:username>/history/", chat_history, name="chat_history"),
+    path("chat/<str:username>/send/", send_message, name="send_message"),
 
     # Group chat
     path("group/<int:group_id>/", group_chatroom, name="group_chatroom"),
+    path("group/<int:group_id>/history/", group_history, name="group_history"),
+    path("group/<int:group_id>/send/", group_send, name="group_send"),
+
+    # Attachments
+    path("attachments/", upload_attachment, name="upload_attachment"),
+    path("attachments/<int:attachment_id>/", attachment_file, name="attachment_file"),
+    path("attachments/<int:attachment_id>/thumbnail/", attachment_file, {"thumbnail": True}, name="attachment_thumbnail"),
+
+    # Profile
+    path("profile/", edit_profile, name="edit_profile"),
+
+    # Search
+    path("search/", search_messages, name="search_messages"),
+
+    # Export
+    path("export/", export_messages, name="export_messages"),
+
+    # Metrics (Prometheus)
+    path("metrics/", metrics_view, name="metrics"),
 
     # Create group
     path("create_group/", create_group, name="create_group"),